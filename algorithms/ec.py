@@ -13,9 +13,11 @@ import random
 import logging
 import multiprocessing
 
+from bisect import bisect_left
+from itertools import chain
+
 from deap import base, creator, tools
 from deap.algorithms import varAnd
-from jcvi.algorithms.lis import longest_monotonic_subseq_length
 
 
 def make_data(POINTS, SCF):
@@ -28,12 +30,77 @@ def make_data(POINTS, SCF):
     return scaffolds
 
 
+def monotonic_length(series):
+    """
+    Length of the longest monotonic subsequence, the increasing and decreasing
+    piles are grown in the same pass over the series. Equivalent to
+    `longest_monotonic_subseq_length(series)[0]`.
+
+    >>> monotonic_length([4, 5, 1, 2, 3])
+    3
+    >>> monotonic_length([3, 2, 2, 1])
+    3
+    """
+    inc, dec = [], []
+    ninc = ndec = 0
+    for x in series:
+        i = bisect_left(inc, x, 0, ninc)
+        if i == ninc:
+            inc.append(x)
+            ninc += 1
+        else:
+            inc[i] = x
+        x = -x
+        i = bisect_left(dec, x, 0, ndec)
+        if i == ndec:
+            dec.append(x)
+            ndec += 1
+        else:
+            dec[i] = x
+    return max(ninc, ndec)
+
+
+class ColinearEvaluator (object):
+    """
+    Fitness function for tours of scaffolds. Marker series are encoded once
+    as tuples indexed by scaffold id (one table per linkage group), so that
+    scoring a tour is a single monotonic scan over the chained tuples. Scores
+    are memoized on the tour since the GA keeps producing the same
+    individuals (elites, crossovers between identical parents).
+    """
+    def __init__(self, scfs, weights=None, cachesize=10000):
+        size = 1 + max(max(scf) if scf else -1 for scf in scfs)
+        self.tables = []
+        for scf in scfs:
+            table = [()] * size
+            for i, series in scf.items():
+                table[i] = tuple(series)
+            self.tables.append(table)
+        self.weights = weights or [1] * len(scfs)
+        self.cachesize = cachesize
+        self.cache = {}
+
+    def score(self, tour):
+        weighted_score = 0
+        for table, w in zip(self.tables, self.weights):
+            series = chain.from_iterable(table[t] for t in tour)
+            weighted_score += monotonic_length(series) * w
+        return weighted_score
+
+    def __call__(self, tour):
+        key = tuple(tour)
+        cache = self.cache
+        if key in cache:
+            return cache[key]
+        score = (self.score(tour),)
+        if len(cache) >= self.cachesize:
+            cache.clear()
+        cache[key] = score
+        return score
+
+
 def colinear_evaluate(tour, scaffolds):
-    series = []
-    for t in tour:
-        series.extend(scaffolds[t])
-    score, diff = longest_monotonic_subseq_length(series)
-    return score,
+    return monotonic_length(chain.from_iterable(scaffolds[t] for t in tour)),
 
 
 def genome_mutation(candidate):
@@ -94,6 +161,26 @@ def GA_setup(guess, weights=(1.0,)):
     return toolbox
 
 
+def evaluate_invalid(population, toolbox):
+    """
+    Evaluate the individuals with an invalid fitness.
+    """
+    invalid_ind = [ind for ind in population if not ind.fitness.valid]
+    fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
+    for ind, fit in zip(invalid_ind, fitnesses):
+        ind.fitness.values = fit
+
+
+def next_generation(population, toolbox, cxpb, mutpb):
+    """
+    Select, vary and evaluate the offspring of the current population.
+    """
+    offspring = toolbox.select(population, len(population))
+    offspring = varAnd(offspring, toolbox, cxpb, mutpb)
+    evaluate_invalid(offspring, toolbox)
+    return offspring
+
+
 def eaSimpleConverge(population, toolbox, cxpb, mutpb, ngen, stats=None,
              halloffame=None, verbose=True):
     """This algorithm reproduce the simplest evolutionary algorithm as
@@ -104,11 +191,7 @@ def eaSimpleConverge(population, toolbox, cxpb, mutpb, ngen, stats=None,
     eaSimple, ngen is total number of iterations; in eaSimpleConverge, we
     terminate only when the best is NOT updated for ngen iterations.
     """
-    # Evaluate the individuals with an invalid fitness
-    invalid_ind = [ind for ind in population if not ind.fitness.valid]
-    fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
-    for ind, fit in zip(invalid_ind, fitnesses):
-        ind.fitness.values = fit
+    evaluate_invalid(population, toolbox)
 
     if halloffame is not None:
         halloffame.update(population)
@@ -119,17 +202,7 @@ def eaSimpleConverge(population, toolbox, cxpb, mutpb, ngen, stats=None,
     gen = 1
     best = 0
     while True:
-        # Select the next generation individuals
-        offspring = toolbox.select(population, len(population))
-
-        # Vary the pool of individuals
-        offspring = varAnd(offspring, toolbox, cxpb, mutpb)
-
-        # Evaluate the individuals with an invalid fitness
-        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
-        for ind, fit in zip(invalid_ind, fitnesses):
-            ind.fitness.values = fit
+        offspring = next_generation(population, toolbox, cxpb, mutpb)
 
         # Update the hall of fame with the generated individuals
         if halloffame is not None:
@@ -156,13 +229,118 @@ def eaSimpleConverge(population, toolbox, cxpb, mutpb, ngen, stats=None,
     return population
 
 
-def GA_run(toolbox, ngen=500, npop=100, cpus=1):
+# Islands are evolved in forked workers that inherit the toolbox, so only the
+# populations (lists of integers) are shipped between processes
+ISLAND_TOOLBOX = None
+
+
+def evolve_island(args):
+    """
+    Evolve one island for a fixed number of generations. Returns the
+    population as plain lists together with their fitness values.
+    """
+    population, fitnesses, ngen, cxpb, mutpb, seed = args
+    toolbox = ISLAND_TOOLBOX
+    random.seed(seed)
+    pop = []
+    for x, fit in zip(population, fitnesses):
+        ind = creator.Individual(x)
+        if fit:
+            ind.fitness.values = fit
+        pop.append(ind)
+
+    evaluate_invalid(pop, toolbox)
+    for gen in xrange(ngen):
+        pop = next_generation(pop, toolbox, cxpb, mutpb)
+
+    return [list(ind) for ind in pop], [ind.fitness.values for ind in pop]
+
+
+def migrate(islands, nmigrants):
+    """
+    Ring migration: the best individuals of each island replace the worst
+    individuals of the next island. Islands are lists of (individual,
+    fitness) pairs.
+    """
+    n = len(islands)
+    emigrants = [sorted(island, key=lambda x: x[1], reverse=True)[:nmigrants]
+                    for island in islands]
+    for i, island in enumerate(islands):
+        island.sort(key=lambda x: x[1])
+        island[:nmigrants] = emigrants[(i - 1) % n]
+
+
+def eaIslandConverge(toolbox, npop, cxpb, mutpb, ngen, cpus=2, islands=None,
+                     migration=20, nmigrants=2, verbose=True):
+    """
+    Island-model version of eaSimpleConverge(). The population of `npop` is
+    split across the islands (at least 10 individuals each), and each island
+    is evolved in its own process for `migration` generations, followed by a
+    ring migration of the best individuals. Terminate when the global best
+    is NOT updated for ngen generations.
+    """
+    global ISLAND_TOOLBOX
+    ISLAND_TOOLBOX = toolbox
+    islands = islands or cpus
+    npop = max(npop / islands, 10)
+    nmigrants = min(nmigrants, npop)
+    logging.debug("Island model: {0} islands of {1} individuals".\
+                    format(islands, npop))
+
+    guess = list(toolbox.individual())
+    pops = [[(guess, ())] * npop for i in xrange(islands)]
+    gen = 0
+    best, best_ind = None, None
+    updated = 0
+    pool = multiprocessing.Pool(min(cpus, islands))
+    try:
+        while True:
+            args = []
+            for pop in pops:
+                population, fitnesses = zip(*pop)
+                args.append((population, fitnesses, migration, cxpb, mutpb,
+                             random.random()))
+            results = pool.map(evolve_island, args)
+            pops = [zip(population, fitnesses) \
+                        for population, fitnesses in results]
+            gen += migration
+
+            ind, fit = max((x for pop in pops for x in pop),
+                           key=lambda x: x[1])
+            if best is None or fit > best:
+                best, best_ind = fit, ind
+                updated = gen
+            if verbose:
+                print >> sys.stderr, "Current iteration {0}: max_score={1}".\
+                                format(gen, best)
+
+            if gen - updated > ngen:
+                break
+            migrate(pops, nmigrants)
+    finally:
+        pool.terminate()
+        pool.join()
+        ISLAND_TOOLBOX = None
+
+    tour = creator.Individual(best_ind)
+    tour.fitness.values = best
+    return tour
+
+
+def GA_run(toolbox, ngen=500, npop=100, cpus=1, islands=None, migration=20):
+    """
+    Run GA on a single population, or with an island model when cpus > 1 (one
+    island per cpu unless `islands` is given, sharing the `npop` individuals).
+    Individuals are evaluated in-process in both cases.
+    """
     logging.debug("GA setup: ngen={0} npop={1} cpus={2}".\
                     format(ngen, npop, cpus))
-    if cpus > 1:
-        pool = multiprocessing.Pool(cpus)
-        toolbox.register("map", pool.map)
     #random.seed(666)
+    if cpus > 1:
+        tour = eaIslandConverge(toolbox, npop, .7, .2, ngen, cpus=cpus,
+                                islands=islands, migration=migration)
+        return tour, tour.fitness
+
     pop = toolbox.population(n=npop)
     hof = tools.HallOfFame(1)
 
@@ -173,8 +351,6 @@ def GA_run(toolbox, ngen=500, npop=100, cpus=1):
     eaSimpleConverge(pop, toolbox, .7, .2, ngen, stats=stats,
                         halloffame=hof)
     tour = hof[0]
-    if cpus > 1:
-        pool.terminate()
     return tour, tour.fitness
 
 
@@ -189,6 +365,6 @@ if __name__ == "__main__":
     print guess
 
     toolbox = GA_setup(guess)
-    toolbox.register("evaluate", colinear_evaluate, scaffolds=scaffolds)
+    toolbox.register("evaluate", ColinearEvaluator([dict(enumerate(scaffolds))]))
     tour, tour.fitness = GA_run(toolbox, cpus=8)
     print tour, tour.fitness
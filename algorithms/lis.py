@@ -58,6 +58,42 @@ def longest_decreasing_subseq_length(xs):
     return longest_increasing_subseq_length(reversed(xs))
 
 
+def pile_tops(xs, tops=None):
+    '''Return the pile tops after patience sorting xs, optionally continuing
+    from the pile tops of a previous sequence. The k-th top is the smallest
+    tail of any increasing subsequence of length k + 1.
+
+    >>> pile_tops([4, 5, 1, 2, 3])
+    [1, 2, 3]
+    >>> pile_tops([4], tops=[1, 2, 3])
+    [1, 2, 3, 4]
+    '''
+    tops = [] if tops is None else tops[:]
+    for x in xs:
+        pile = bisect.bisect_left(tops, x)
+        if pile == len(tops):
+            tops.append(x)
+        else:
+            tops[pile] = x
+    return tops
+
+
+def concat_increasing_subseq_length(tails, heads):
+    '''Return the length of the longest increasing subsequence of X + Y, where
+    tails = pile_tops(X) and heads = pile_tops(-y for y in reversed(Y)).
+    This avoids rescanning X and Y when they are shared by many queries.
+
+    >>> concat_increasing_subseq_length([1, 2, 3], [-6, -5])
+    5
+    >>> concat_increasing_subseq_length([1, 2, 3], [-2])
+    3
+    '''
+    best = len(heads)
+    for k, x in enumerate(tails):
+        best = max(best, k + 1 + bisect.bisect_left(heads, -x))
+    return best
+
+
 def longest_increasing_subsequence(xs):
     '''Return a longest increasing subsequence of xs.
 
@@ -3,7 +3,8 @@
 
 """
 TSP solver using Concorde. This is much faster than the LP-formulation in
-algorithms.lpsolve.tsp().
+algorithms.lpsolve.tsp(). When Concorde is not available, a greedy + 2-opt +
+Or-opt heuristic on a distance matrix is provided in hamiltonian_heuristic().
 """
 
 import os.path as op
@@ -28,7 +29,7 @@ Work_dir = "tsp_work"
 class Concorde (object):
 
     def __init__(self, edges, work_dir=Work_dir, clean=True, verbose=False,
-                       precision=0, seed=666):
+                       precision=0, seed=666, timeout=None):
 
         self.work_dir = work_dir
         self.clean = clean
@@ -36,14 +37,17 @@ class Concorde (object):
 
         mkdir(work_dir)
         tspfile = op.join(work_dir, "data.tsp")
-        self.print_to_tsplib(edges, tspfile, precision=precision)
-        retcode, outfile = self.run_concorde(tspfile, seed=seed)
-        self.tour = self.parse_output(outfile)
-
-        if clean:
-            shutil.rmtree(work_dir)
-            residual_output = ["data.sol", "data.res", "Odata.res"]
-            FileShredder(residual_output)
+        try:
+            self.print_to_tsplib(edges, tspfile, precision=precision)
+            retcode, outfile = self.run_concorde(tspfile, seed=seed,
+                                                 timeout=timeout)
+            self.tour = self.parse_output(outfile)
+        finally:
+            # Also on timeout or missing concorde, callers fall back
+            if clean:
+                shutil.rmtree(work_dir, ignore_errors=True)
+                residual_output = ["data.sol", "data.res", "Odata.res"]
+                FileShredder(residual_output)
 
 
     def print_to_tsplib(self, edges, tspfile, precision=0):
@@ -96,7 +100,7 @@ class Concorde (object):
         fw.close()
         logging.debug("Write TSP instance to `{0}`".format(tspfile))
 
-    def run_concorde(self, tspfile, seed=666):
+    def run_concorde(self, tspfile, seed=666, timeout=None):
         outfile = op.join(self.work_dir, "data.sol")
         if op.exists(outfile):
             os.remove(outfile)
@@ -105,6 +109,8 @@ class Concorde (object):
         assert which(cc), "You must install `concorde` on your PATH" + \
                           " [http://www.math.uwaterloo.ca/tsp/concorde.html]"
         cmd = "{0} -s {1} -x -o {2} {3}".format(cc, seed, outfile, tspfile)
+        if timeout and which("timeout"):
+            cmd = "timeout {0} {1}".format(timeout, cmd)
 
         outf = None if self.verbose else "/dev/null"
         retcode = sh(cmd, outfile=outf, errfile=outf)
@@ -154,7 +160,7 @@ def populate_edge_weights(edges):
     return new_edges
 
 
-def hamiltonian(edges, directed=False, precision=0):
+def hamiltonian(edges, directed=False, precision=0, timeout=None):
     """
     Calculates shortest path that traverses each node exactly once. Convert
     Hamiltonian path problem to TSP by adding one dummy point that has a distance
@@ -175,7 +181,7 @@ def hamiltonian(edges, directed=False, precision=0):
         dummy_edges += [(x, DUMMY, 0) for x in nodes]
         dummy_edges = reformulate_atsp_as_tsp(dummy_edges)
 
-    tour = tsp(dummy_edges, precision=precision)
+    tour = tsp(dummy_edges, precision=precision, timeout=timeout)
 
     dummy_index = tour.index(DUMMY)
     tour = tour[dummy_index:] + tour[:dummy_index]
@@ -193,11 +199,129 @@ def hamiltonian(edges, directed=False, precision=0):
     return path
 
 
-def tsp(edges, precision=0):
-    c = Concorde(edges, precision=precision)
+def tsp(edges, precision=0, timeout=None):
+    c = Concorde(edges, precision=precision, timeout=timeout)
     return c.tour
 
 
+def greedy_path(M, start=0, end=None):
+    """
+    Nearest neighbor path through all nodes of distance matrix M, starting
+    from `start` and, if given, ending at `end`.
+    """
+    n = M.shape[0]
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    if end is not None:
+        visited[end] = True
+    path = [start]
+    current = start
+    for i in xrange(n - visited.sum()):
+        d = np.where(visited, np.inf, M[current])
+        current = int(np.argmin(d))
+        visited[current] = True
+        path.append(current)
+    if end is not None and end != start:
+        path.append(end)
+    return np.array(path)
+
+
+def path_length(M, path):
+    return M[path[:-1], path[1:]].sum()
+
+
+def two_opt(M, path, maxiter=100):
+    """
+    Reverse segments path[i:j + 1] while this shortens the path. The two
+    endpoints stay in place. The improvement of all segments starting at i
+    is evaluated at once.
+    """
+    path = np.array(path)
+    n = len(path)
+    for it in xrange(maxiter):
+        improved = False
+        for i in xrange(1, n - 2):
+            j = np.arange(i + 1, n - 1)
+            a, b = path[i - 1], path[i]
+            c, d = path[j], path[j + 1]
+            delta = M[a, c] + M[b, d] - M[a, b] - M[c, d]
+            k = np.argmin(delta)
+            if delta[k] < -1e-9:
+                jj = j[k]
+                path[i:jj + 1] = path[i:jj + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return path
+
+
+def or_opt(M, path, maxsegment=3, maxiter=100):
+    """
+    Move segments of up to `maxsegment` nodes, possibly reversed, to the best
+    position elsewhere in the path. The two endpoints stay in place.
+    """
+    path = np.array(path)
+    n = len(path)
+    for it in xrange(maxiter):
+        improved = False
+        for k in xrange(1, maxsegment + 1):
+            i = 1
+            while i + k <= n - 1:
+                seg = path[i:i + k]
+                prev, nxt = path[i - 1], path[i + k]
+                gain = M[prev, seg[0]] + M[seg[-1], nxt] - M[prev, nxt]
+                rest = np.concatenate((path[:i], path[i + k:]))
+                a, b = rest[:-1], rest[1:]
+                base = M[a, b]
+                fwd = M[a, seg[0]] + M[seg[-1], b] - base
+                rev = M[a, seg[-1]] + M[seg[0], b] - base
+                t = np.argmin(np.minimum(fwd, rev))
+                cost = min(fwd[t], rev[t])
+                if cost < gain - 1e-9:
+                    if rev[t] < fwd[t]:
+                        seg = seg[::-1]
+                    path = np.concatenate((rest[:t + 1], seg, rest[t + 1:]))
+                    improved = True
+                i += 1
+        if not improved:
+            break
+    return path
+
+
+def hamiltonian_heuristic(M, start=0, end=None, maxiter=100):
+    """
+    Approximate shortest Hamiltonian path on a dense distance matrix M, which
+    should be symmetric except for the rows/columns of `start` and `end`.
+    Returns the path as a list of node indices. Used when Concorde is not
+    available.
+
+    >>> M = np.array([[0, 1, 5, 9], [1, 0, 1, 5], [5, 1, 0, 1], [9, 5, 1, 0]])
+    >>> hamiltonian_heuristic(M, start=0, end=3)
+    [0, 1, 2, 3]
+    """
+    M = np.asarray(M, dtype=float)
+    path = greedy_path(M, start=start, end=end)
+    if end is None:  # Dummy end so that the last node can move too
+        n = M.shape[0]
+        D = np.zeros((n + 1, n + 1))
+        D[:n, :n] = M
+        path = np.append(path, n)
+        M = D
+    score = path_length(M, path)
+    for it in xrange(maxiter):
+        path = two_opt(M, path, maxiter=maxiter)
+        path = or_opt(M, path, maxiter=maxiter)
+        new_score = path_length(M, path)
+        if new_score >= score - 1e-9:
+            break
+        score = new_score
+    logging.debug("TSP heuristic path length: {0}".format(score))
+    path = list(int(x) for x in path)
+    if end is None:
+        path = path[:-1]
+    return path
+
+
 def reformulate_atsp_as_tsp(edges):
     """
     To reformulate the ATSP as a TSP, for each city a dummy city (e.g, for New
@@ -12,6 +12,7 @@ from os import symlink
 import sys
 import re
 import logging
+from time import time
 
 from jcvi.formats.base import must_open
 from jcvi.apps.base import OptionParser, ActionDispatcher, mkdir, glob
@@ -191,207 +192,194 @@ def main():
 Unknown = "Unknown protein"
 Hypothetical = "hypothetical protein"
 
+# Patterns used inline by the rules below
+accn_paren_pat = re.compile(r"([A-Z0-9]){6} \(")
+semicolon_pat = re.compile(r";\s*")
+entity_pat = re.compile(r"&apos;?|&gt")
+runs_pat = re.compile(r"[-]+|[']+")
+dash_domain_pat = re.compile(r"-domain")
+kinase_pat = re.compile(r"Protein kinase")
+leading_space_pat = re.compile(r"^\s+")
+plural_s_pat = re.compile(r"s$")
+dot_space_pat = re.compile(r"\. ")
+trail_sym_pat = re.compile(r"\W{1,}$")
+trail_paren_pat = re.compile(r"\)$")
+
+
+def fuse(pairs, flags=0):
+    """
+    Fuse a run of independent (pattern, replacement) substitutions into one
+    alternation, so the description is scanned once instead of len(pairs)
+    times. The patterns must not contain groups or overlap one another.
+    """
+    fused_pat = re.compile("|".join("({0})".format(pat.pattern) \
+                                    for pat, repl in pairs), flags)
+    repls = [repl for pat, repl in pairs]
+
+    def sub(s):
+        return fused_pat.sub(lambda m: repls[m.lastindex - 1], s)
+
+    return sub
+
+
+def trim_all(pats):
+    """
+    Remove each pattern in turn, re-padding with a single trailing space
+    before each one since word boundaries don't work on /
+    """
+    subs = [pat.sub for pat in pats]
+
+    def sub(s):
+        for f in subs:
+            s = f("", s.strip() + " ")
+        return s
+
+    return sub
 
-def fix_text(s):
 
+def rule_brackets(s):
     # Fix descriptions like D7TDB1 (
-    s = re.sub("([A-Z0-9]){6} \(", "", s)
+    s = accn_paren_pat.sub("", s)
     s = s.translate(None, "[]")
     s = s.replace("(-)", "[-]")
     s = s.replace("(+)", "[+]")
     s = s.replace("(Uncharacterized protein)", "")
-    s = s.translate(None, "()")
+    return s.translate(None, "()")
 
+
+def rule_semicolon(s):
     # before trimming off at the first ";", check if name has glycosidic
     # linkage information (e.g 1,3 or 1,4). If so, also check if multiple
     # linkages are separated by ";". If so, replace ";" by "-"
-    m = re.findall(glycosidic_link_pat, s)
-    if m and ";" in s:
-        s = re.sub(";\s*", "-", s)
-
-    s = s.split(";")[0]
-
-    # Cellular locations
-    # Any word that matches e.g. AT5G54690
-    # Any word that matches e.g. Os02g0234800
-    # (fragment)
-    # Trailing protein numeric copy (e.g. Myb 1)
-    # UPF
-    # Remove 'DDB_G\d+' ID
-    # '_At[0-9]+g[0-9]+' to ''
-    for pat in (loc_pat, osg_pat, frag_pat, trail_pat, upf_pat, ddb_pat):
-        # below is a hack since word boundaries don't work on /
-        s = s.strip() + " "
-        s = re.sub(pat, "", s)
-
-    # &apos;? => '
-    s = re.sub(apos_pat, "'", s)
-    # &gt => none
-    s = re.sub(gt_pat, "", s)
-    # reduce runs such as -- '''
-    s = re.sub(r"[-]+", "-", s)
-    s = re.sub(r"[']+", "'", s)
+    if ";" not in s:
+        return s
+    if glycosidic_link_pat.search(s):
+        s = semicolon_pat.sub("-", s)
+    return s.split(";")[0]
 
-    s = s.strip()
 
-    # -like to -like protein
-    s = re.sub(like_pat, "-like protein", s)
+def rule_entities(s):
+    # &apos;? => ', &gt => none, then reduce runs such as -- '''
+    s = entity_pat.sub(lambda m: "" if m.group(0) == "&gt" else "'", s)
+    s = runs_pat.sub(lambda m: m.group(0)[0], s)
+    return s.strip()
+
 
+def rule_repeat(s):
     # 'repeat$' to 'repeat protein'
-    if re.search(repeat_pat, s):
+    if repeat_pat.search(s):
         s += "-containing protein"
+    return s
+
 
+def rule_binding(s):
     # 'binding$' to 'binding protein'
-    if re.search(binding_pat, s):
+    if binding_pat.search(s):
         s += " protein"
-        if re.match(Protein_pat, s):
-            s = re.sub(Protein_pat, "", s)
+        if Protein_pat.match(s):
+            s = Protein_pat.sub("", s)
+    return s
 
+
+def rule_domain(s):
     # 'domain$' to 'domain-containing protein'
-    if re.search(domain_pat, s):
+    if domain_pat.search(s):
         s += "-containing protein"
-        if re.search(r"-domain", s):
-            s = re.sub(r"-domain", " domain", s)
-        if re.match(Protein_pat, s):
-            s = re.sub(Protein_pat, "", s)
+        s = dash_domain_pat.sub(" domain", s)
+        if Protein_pat.match(s):
+            s = Protein_pat.sub("", s)
+    return s
+
 
+def rule_related(s):
     # 'related$' to '-like protein'
-    if re.search(related_pat, s):
-        s = re.sub(related_pat, "-like protein", s)
-        if re.match(Protein_pat, s) and not re.match(r"Protein kinase", s):
-            s = re.sub(Protein_pat, "", s)
+    if related_pat.search(s):
+        s = related_pat.sub("-like protein", s)
+        if Protein_pat.match(s) and not kinase_pat.match(s):
+            s = Protein_pat.sub("", s)
+    return s
+
 
+def rule_numbered_homolog(s):
     # '[0-9]+ homolog' to '-like protein'
-    if re.search(homolog_pat1, s):
-        s = re.sub(homolog_pat1, "-like protein", s)
-        if re.match(Protein_pat, s):
-            s = re.sub(Protein_pat, "", s)
+    if homolog_pat1.search(s):
+        s = homolog_pat1.sub("-like protein", s)
+        if Protein_pat.match(s):
+            s = Protein_pat.sub("", s)
+    return s
+
 
+def rule_protein_homolog(s):
     # 'Protein\s+(.*)\s+homolog' to '$1-like protein'
-    match = re.search(homolog_pat2, s)
-    if match and not re.match(r"Protein kinase", s):
-        ret = match.group(1)
-        s = re.sub(homolog_pat2, ret + "-like protein", s)
-        s = re.sub(r"^\s+", "", s)
+    match = homolog_pat2.search(s)
+    if match and not kinase_pat.match(s):
+        s = homolog_pat2.sub(match.group(1) + "-like protein", s)
+        s = leading_space_pat.sub("", s)
         s = s.capitalize()
+    return s
 
-    # 'homolog protein' to '-like protein'
-    # 'homolog \S+' to '-like protein'
-    # 'homologue$' to '-like protein'
-    # 'homolog$' to '-like protein'
-    for pat in (homolog_pat3, homolog_pat4, homolog_pat5, homolog_pat6):
-        if re.search(pat, s):
-            s = re.sub(pat, "-like protein", s)
-
-    # 'Agenet domain-containing protein / bromo-adjacent homology (BAH) domain-containing protein'
-    # to 'Agenet and bromo-adjacent homology (BAH) domain-containing protein'
-    if re.search(agenet_pat, s):
-        s = re.sub(agenet_pat, "Agenet and ", s)
 
+def rule_plural(s):
     # plural to singular
-    if re.search(plural_pat, s):
-        #if s.find('biogenesis') == -1 and s.find('Topors') == -1 and s.find('allergens') == -1:
-        if s.find('biogenesis') == -1 and s.find('Topors') == -1:
-            s = re.sub(r"s$", "", s)
-
-    # 'like_TBP' or 'likeTBP' to 'like TBP'
-    if re.search(tbp_pat, s):
-        s = re.sub(tbp_pat, "like TBP", s)
-
-    # 'protein protein' to 'protein'
-    if re.search(prot_pat, s):
-        s = re.sub(prot_pat, " protein", s)
-
-    # 'Candidate|Hypothetical|Novel|Predicted|Possible' to 'Putative'
-    if re.search(put_pat, s):
-        s = re.sub(put_pat, "Putative", s)
+    if plural_pat.search(s) and 'biogenesis' not in s and 'Topors' not in s:
+        s = plural_s_pat.sub("", s)
+    return s
 
-    # 'dimerisation' to 'dimerization'
-    if re.search(dimer_pat, s):
-        s = re.sub(dimer_pat, "dimerization", s)
 
+def rule_uninformative(s):
     # Any AHRD that matches e.g. "AT5G54690-like protein"
     # Any AHRD that contains the words '^Belongs|^Encoded|^Expression|^highly'
-    for pat in (atg_pat, athila_pat1):
-        if re.search(pat, s):
-            s = Unknown
-
-    # remove 'arabidopsis[ thaliana]' and/or embedded Atg IDs
-    for pat in (atg_id_pat, athila_pat2, athila_pat3, athila_pat4):
-        # below is a hack since word boundaries don't work on /
-        s = s.strip() + " "
-        s = re.sub(pat, "", s)
+    if atg_pat.search(s) or athila_pat1.search(s):
+        s = Unknown
+    return s
 
-    # remove "\s+LENGTH=\d+" from TAIR deflines
-    if re.search(length_pat, s):
-        s = re.sub(length_pat, "", s)
 
+def rule_comma(s):
     # if name has a dot followed by a space (". ") in it and contains multiple
     # parts separated by a comma, strip name starting from first occurrence of ","
-    if re.search(r"\. ", s):
-        if re.search(r",", s):
-            s = s.split(",")[0]
-
-    # if name contains any of the disallowed words,
-    # remove word occurrence from name
-    # if name contains references to any other organism, trim name upto
-    # that occurrence
-    for pat in (disallow_pat, organism_pat):
-        if re.search(pat, s):
-            s = re.sub(pat, "", s)
+    if "," in s and dot_space_pat.search(s):
+        s = s.split(",")[0]
+    return s
 
-    s = s.strip()
 
+def rule_symbol(s):
     # if name is entirely a gene symbol-like (all capital letters, maybe followed by numbers)
     # add a "-like protein" at the end
-    if (re.search(sym_pat, s) or re.search(lc_sym_pat, s)) \
-            and not re.search(spada_pat, s):
+    s = s.strip()
+    if (sym_pat.search(s) or lc_sym_pat.search(s)) and not spada_pat.search(s):
         s = s + "-like protein"
+    return s
 
-    # if gene symbol in parantheses at EOL, remove symbol
-    if re.search(eol_sym_pat, s):
-        s = re.sub(eol_sym_pat, "", s)
 
+def rule_trailing_symbol(s):
     # if name terminates at a symbol([^A-Za-z0-9_]), trim it off
-    if re.search(r"\W{1,}$", s) and not re.search(r"\)$", s):
-        s = re.sub("\W{1,}$", "", s)
-
-    # change sulfer to sulfur
-    if re.search(sulfer_pat, s):
-        s = re.sub(sulfer_pat, "sulfur", s)
+    if trail_sym_pat.search(s) and not trail_paren_pat.search(s):
+        s = trail_sym_pat.sub("", s)
+    return s
 
-    # change assessory to accessory
-    if re.search(assessory_pat, s):
-        s = re.sub(assessory_pat, "accessory", s)
 
-    # change -ise/-isation to -ize/-ization
-    match = re.search(ise_pat, s)
-    if match:
-        ret = match.group(1)
-        s = re.sub(ise_pat, "{0}ize".format(ret), s)
+def rule_british(s):
+    # change -ise/-isation to -ize/-ization, every occurrence takes the stem
+    # of the first one
+    for pat, suffix in ((ise_pat, "ize"), (isation_pat, "ization")):
+        match = pat.search(s)
+        if match:
+            s = pat.sub(match.group(1) + suffix, s)
+    return s
 
-    match = re.search(isation_pat, s)
-    if match:
-        ret = match.group(1)
-        s = re.sub(isation_pat, "{0}ization".format(ret), s)
 
+def rule_final(s):
     """
     case (qr/^Histone-lysine/) { $ahrd =~ s/,\s+H\d{1}\s+lysine\-\d+//gs; }
     """
     sl = s.lower()
 
     # Any mention of `clone` or `contig` is not informative
-    if "clone" in sl or "contig" in sl:
-        s = Unknown
-
     # All that's left is `protein` is not informative
-    if sl in ("protein", "protein, putative", ""):
-        s = Unknown
-
-    if Unknown.lower() in sl:
-        s = Unknown
-
-    if "FUNCTIONS IN".lower() in sl and "unknown" in sl:
+    if "clone" in sl or "contig" in sl or \
+            sl in ("protein", "protein, putative", "") or \
+            Unknown.lower() in sl or \
+            ("functions in" in sl and "unknown" in sl):
         s = Unknown
 
     if "uncharacterized" in sl:
@@ -404,11 +392,165 @@ def fix_text(s):
         s = Hypothetical
 
     # Compact all spaces
-    s = ' '.join(s.split())
+    return ' '.join(s.split())
+
+
+# Ordered (name, function) list applied by `fix_text`, the order matters
+Rules = (
+    ("brackets", rule_brackets),
+    ("semicolon", rule_semicolon),
+    # Cellular locations, Os02g0234800, (fragment), trailing numeric copy
+    # (e.g. Myb 1), UPF, 'DDB_G\d+' IDs
+    ("ids", trim_all((loc_pat, osg_pat, frag_pat, trail_pat, upf_pat, ddb_pat))),
+    ("entities", rule_entities),
+    ("like", lambda s: like_pat.sub("-like protein", s)),
+    ("repeat", rule_repeat),
+    ("binding", rule_binding),
+    ("domain", rule_domain),
+    ("related", rule_related),
+    ("numbered_homolog", rule_numbered_homolog),
+    ("protein_homolog", rule_protein_homolog),
+    # 'homolog protein', 'homolog \S+', 'homologue$', 'homolog$' to '-like protein'
+    ("homolog", lambda s: homolog_pat6.sub("-like protein",
+                          homolog_pat5.sub("-like protein",
+                          homolog_pat4.sub("-like protein",
+                          homolog_pat3.sub("-like protein", s))))),
+    ("agenet", lambda s: agenet_pat.sub("Agenet and ", s)),
+    ("plural", rule_plural),
+    # like_TBP, protein protein, Candidate|Hypothetical|..., dimerisation
+    ("wording", fuse(((tbp_pat, "like TBP"), (prot_pat, " protein"),
+                      (put_pat, "Putative"), (dimer_pat, "dimerization")),
+                     flags=re.I)),
+    ("uninformative", rule_uninformative),
+    # remove 'arabidopsis[ thaliana]' and/or embedded Atg IDs
+    ("arabidopsis", trim_all((atg_id_pat, athila_pat2, athila_pat3, athila_pat4))),
+    ("length", lambda s: length_pat.sub("", s)),
+    ("comma", rule_comma),
+    # disallowed words, other organisms
+    ("disallow", lambda s: organism_pat.sub("", disallow_pat.sub("", s))),
+    ("symbol", rule_symbol),
+    ("eol_symbol", lambda s: eol_sym_pat.sub("", s)),
+    ("trailing_symbol", rule_trailing_symbol),
+    ("spelling", fuse(((sulfer_pat, "sulfur"), (assessory_pat, "accessory")))),
+    ("british", rule_british),
+    ("final", rule_final),
+)
+
+
+class TextFixer (object):
+    """
+    Applies `Rules` in order to a description. Results are memoized since
+    identical descriptions are very common, and the number of descriptions
+    each rule changed (plus time spent, when `profile` is on) is tallied.
+    """
+    def __init__(self, rules=Rules, profile=False):
+        self.names = [name for name, func in rules]
+        self.funcs = [func for name, func in rules]
+        self.profile = profile
+        self.cache = {}
+        self.calls = 0
+        self.hits = [0] * len(rules)
+        self.timings = [0.] * len(rules)
+
+    def __call__(self, s):
+        self.calls += 1
+        try:
+            return self.cache[s]
+        except KeyError:
+            pass
+
+        t = self.cache[s] = self.apply(s)
+        return t
+
+    def apply(self, s):
+        hits, timings = self.hits, self.timings
+        for i, func in enumerate(self.funcs):
+            if self.profile:
+                start = time()
+                t = func(s)
+                timings[i] += time() - start
+            else:
+                t = func(s)
+            if t != s:
+                hits[i] += 1
+            s = t
+
+        assert s.strip()
+
+        return s
+
+    def update(self, hits, timings):
+        for i, (h, t) in enumerate(zip(hits, timings)):
+            self.hits[i] += h
+            self.timings[i] += t
+
+    def report(self, fw=sys.stderr):
+        print >> fw, "A total of {0} descriptions ({1} distinct)".\
+                        format(self.calls, len(self.cache))
+        print >> fw, "\t".join(("rule", "hits", "seconds"))
+        for name, h, t in zip(self.names, self.hits, self.timings):
+            print >> fw, "\t".join((name, str(h), "{0:.3f}".format(t)))
+
+
+Fixer = TextFixer()
 
-    assert s.strip()
 
-    return s
+def fix_text(s):
+    return Fixer(s)
+
+
+def fix_chunk(job):
+    descs, profile = job
+    fixer = TextFixer(profile=profile)
+    fixed = [fixer.apply(s) for s in descs]
+    return descs, fixed, fixer.hits, fixer.timings
+
+
+def fix_texts(descs, fixer=Fixer, cpus=1, chunksize=1000):
+    """
+    Fix a list of descriptions. Only distinct ones that `fixer` has not seen
+    are sent, in chunks, to a pool of `cpus` workers.
+    """
+    from jcvi.formats.fasta import imap_chunks
+
+    todo, seen = [], set()
+    for s in descs:
+        if s in seen or s in fixer.cache:
+            continue
+        seen.add(s)
+        todo.append(s)
+
+    jobs = ((todo[i:i + chunksize], fixer.profile) \
+                for i in xrange(0, len(todo), chunksize))
+    for chunk, fixed, hits, timings in imap_chunks(fix_chunk, jobs, cpus=cpus):
+        fixer.cache.update(zip(chunk, fixed))
+        fixer.update(hits, timings)
+
+    return [fixer(s) for s in descs]
+
+
+def fix_rows(rows, fw, cpus=1, stats=False):
+    """
+    Append fixed descriptions to AHRD `rows` (lists of columns) and write
+    them to `fw`.
+    """
+    fixer = TextFixer(profile=stats)
+    parsed = []
+    for atoms in rows:
+        name, hit, ahrd_code, desc = atoms[:4] \
+                if len(atoms) > 2 else \
+                atoms[0], None, None, atoms[-1]
+        parsed.append((atoms, hit, desc))
+
+    newdescs = fix_texts([desc for atoms, hit, desc in parsed],
+                         fixer=fixer, cpus=cpus)
+    for (atoms, hit, desc), newdesc in zip(parsed, newdescs):
+        if hit and hit.strip() != "" and newdesc == Hypothetical:
+            newdesc = "conserved " + newdesc
+        print >> fw, "\t".join(atoms[:4] + [newdesc] + atoms[4:])
+
+    if stats:
+        fixer.report()
 
 
 def fix(args):
@@ -418,6 +560,9 @@ def fix(args):
     Fix ugly names from Uniprot.
     """
     p = OptionParser(fix.__doc__)
+    p.add_option("--stats", default=False, action="store_true",
+                 help="Print per-rule hit counts and timings to stderr")
+    p.set_cpus(cpus=1)
     p.set_outfile()
     opts, args = p.parse_args(args)
 
@@ -426,20 +571,16 @@ def fix(args):
 
     csvfile, = args
     fp = open(csvfile)
-    fw = must_open(opts.outfile, "w")
+    rows = []
     for row in fp:
         if row[0] == '#':
             continue
         if row.strip() == "":
             continue
-        atoms = row.rstrip("\r\n").split("\t")
-        name, hit, ahrd_code, desc = atoms[:4] \
-                if len(atoms) > 2 else \
-                atoms[0], None, None, atoms[-1]
-        newdesc = fix_text(desc)
-        if hit and hit.strip() != "" and newdesc == Hypothetical:
-            newdesc = "conserved " + newdesc
-        print >> fw, "\t".join(atoms[:4] + [newdesc] + atoms[4:])
+        rows.append(row.rstrip("\r\n").split("\t"))
+
+    fw = must_open(opts.outfile, "w")
+    fix_rows(rows, fw, cpus=opts.cpus, stats=opts.stats)
 
 
 def merge(args):
@@ -448,9 +589,15 @@ def merge(args):
 
     Merge AHRD results, remove redundant headers, empty lines, etc. If there are
     multiple lines containing the same ID (first column). Then whatever comes
-    the first will get retained.
+    the first will get retained. With --fix, names are also fixed, same as
+    piping the result through `fix`.
     """
     p = OptionParser(merge.__doc__)
+    p.add_option("--fix", default=False, action="store_true",
+                 help="Fix names of the merged results")
+    p.add_option("--stats", default=False, action="store_true",
+                 help="Print per-rule hit counts and timings to stderr")
+    p.set_cpus(cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) < 1:
@@ -463,7 +610,7 @@ def merge(args):
         if row.startswith("Protein"):
             break
     header = row.rstrip()
-    print header
+    rows = [header]
 
     seen = set()
     for cf in csvfiles:
@@ -483,7 +630,15 @@ def merge(args):
                 continue
 
             seen.add(id)
-            print row.strip()
+            rows.append(row.strip())
+
+    if opts.fix:
+        fix_rows([x.split("\t") for x in rows if x.strip()], sys.stdout,
+                 cpus=opts.cpus, stats=opts.stats)
+        return
+
+    for row in rows:
+        print row
 
 
 def batch(args):
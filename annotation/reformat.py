@@ -14,9 +14,11 @@ import logging
 import re
 
 from itertools import groupby, product
+from collections import defaultdict
 
 from jcvi.formats.bed import Bed, BedLine, sort
 from jcvi.formats.base import SetFile, must_open, get_number, flexible_cast
+from jcvi.apps.emboss import needle_pairs
 from jcvi.apps.base import OptionParser, OptionGroup, ActionDispatcher, \
             need_update, popen, sh
 
@@ -522,8 +524,9 @@ def annotate(args):
     gene numbering.
 
     Ambiguity in ID assignment can be resolved by either of the following 2 methods:
-    - `alignment`: make use of global sequence alignment score (calculated by `needle`)
-    - `overlap`: make use of overlap length (calculated by `intersectBed`)
+    - `alignment`: make use of global sequence alignment score (calculated by
+      `needle`, or in-process when --newpep and --oldpep are given)
+    - `overlap`: make use of overlap length (same as `intersectBed`)
 
     Transfer over as many identifiers as possible while following guidelines:
     http://www.arabidopsis.org/portals/nomenclature/guidelines.jsp#editing
@@ -554,6 +557,12 @@ def annotate(args):
             help="Percent identity cutoff [default: %default]")
     g1.add_option("--score", dest="score", default=250., type="float",
             help="Alignment score cutoff [default: %default]")
+    g1.add_option("--newpep",
+            help="Protein FASTA of `new.bed` features, to align in-process")
+    g1.add_option("--oldpep",
+            help="Protein FASTA of `old.bed` features, to align in-process")
+    g1.add_option("--band", default=100, type="int",
+            help="Band width beyond the length difference [default: %default]")
     p.add_option_group(g1)
 
     g2 = OptionGroup(p, "Optional parameters (overlap):\n" \
@@ -566,6 +575,7 @@ def annotate(args):
     g2.add_option("-s", dest="s", default=True, action="store_true",
             help="Require same strandedness [default: %default]")
     p.add_option_group(g2)
+    p.set_cpus(cpus=1)
 
     opts, args = p.parse_args(args)
 
@@ -595,14 +605,19 @@ def annotate(args):
             logging.warning("`{0}` already exists. Checking for needle output".\
                     format(pairsfile))
 
-        # If needle scores do not exist, prompt user to run needle
+        # If needle scores do not exist, align the pairs or prompt user to
+        # run needle
         if not os.path.isfile(scoresfile):
-            logging.error("`{0}` does not exist. Please process {1} using `needle`".\
-                    format(scoresfile, pairsfile))
-            sys.exit()
+            if not (opts.newpep and opts.oldpep):
+                logging.error("`{0}` does not exist. Please process {1} using "\
+                        "`needle`, or use --newpep and --oldpep".\
+                        format(scoresfile, pairsfile))
+                sys.exit()
+            needle_pairs(pairsfile, opts.newpep, opts.oldpep, scoresfile,
+                         cpus=opts.cpus, band=opts.band)
     else:
         scoresfile = "ovl.scores"
-        # Calculate overlap length using intersectBed
+        # Calculate overlap length, same as intersectBed
         calculate_ovl(nbedfile, obedfile, opts, scoresfile)
 
     logging.warning("`{0}' exists. Storing scores in memory".\
@@ -639,14 +654,64 @@ def annotate(args):
     sort([abedfile, "-i"])
 
 
-def calculate_ovl(nbedfile, obedfile, opts, scoresfile):
-    from pybedtools import BedTool
-    nbedtool = BedTool(nbedfile)
-    obedtool = BedTool(obedfile)
+def intersect_overlaps(abed, bbed, f=1e-9, r=False, s=False):
+    """
+    Pairs of overlapping features (i, j, overlap) between two lists of
+    BedLine, in the order of `abed` then `bbed`, filtered the same way as
+    `intersectBed -f -r -s`.
+    """
+    import numpy as np
+
+    groups = defaultdict(list)
+    for j, b in enumerate(bbed):
+        groups[(b.seqid, b.strand if s else None)].append(j)
+    bstarts = np.array([b.start - 1 for b in bbed], dtype=int)
+    bends = np.array([b.end for b in bbed], dtype=int)
+
+    hits = []
+    agroups = defaultdict(list)
+    for i, a in enumerate(abed):
+        agroups[(a.seqid, a.strand if s else None)].append(i)
+    for key, ai in agroups.items():
+        if key not in groups:
+            continue
+        ai = np.array(ai)
+        bj = np.array(groups[key])
+        bj = bj[np.argsort(bstarts[bj], kind="mergesort")]
+        bs, be = bstarts[bj], bends[bj]
+        astarts = np.array([abed[i].start - 1 for i in ai], dtype=int)
+        aends = np.array([abed[i].end for i in ai], dtype=int)
+
+        # Candidates start before the end, and after start - longest feature
+        maxlen = (be - bs).max()
+        lo = np.searchsorted(bs, astarts - maxlen, side="right")
+        hi = np.searchsorted(bs, aends, side="left")
+        nc = np.maximum(hi - lo, 0)
+        ia = np.repeat(np.arange(len(ai)), nc)
+        ib = np.repeat(lo - np.cumsum(nc) + nc, nc) + np.arange(nc.sum())
+        ov = np.minimum(aends[ia], be[ib]) - np.maximum(astarts[ia], bs[ib])
+        ok = (ov > 0) & (ov >= f * (aends[ia] - astarts[ia]))
+        if r:
+            ok &= ov >= f * (be[ib] - bs[ib])
+        hits.append(np.column_stack((ai[ia[ok]], bj[ib[ok]], ov[ok])))
+
+    if not hits:
+        return []
+    hits = np.concatenate(hits)
+    hits = hits[np.lexsort((hits[:, 1], hits[:, 0]))]
+    return hits.tolist()
+
 
-    ab = nbedtool.intersect(obedtool, wao=True, f=opts.f, r=opts.r, s=opts.s)
-    cmd = """cut -f4,5,10,13 | awk -F $'\t' 'BEGIN { OFS = FS } ($3 != "."){ print $1,$3,$2,$4; }'"""
-    sh(cmd, infile=ab.fn, outfile=scoresfile)
+def calculate_ovl(nbedfile, obedfile, opts, scoresfile):
+    nbed = Bed(nbedfile, sorted=False)
+    obed = Bed(obedfile, sorted=False)
+
+    fw = open(scoresfile, "w")
+    for i, j, ov in intersect_overlaps(nbed, obed, f=opts.f, r=opts.r, s=opts.s):
+        a, b = nbed[i], obed[j]
+        print >> fw, "\t".join(str(x) for x in \
+                    (a.accn, b.accn, a.score or ".", ov))
+    fw.close()
 
 
 def read_scores(scoresfile, opts):
@@ -6,6 +6,9 @@ Run EMBOSS programs.
 """
 
 import sys
+import logging
+
+import numpy as np
 
 from jcvi.apps.base import OptionParser, ActionDispatcher
 
@@ -24,6 +27,178 @@ class NeedleHeader (object):
                 self.score = row.split(":")[-1].strip()
 
 
+def get_blosum62():
+    """
+    EBLOSUM62 as a 256 x 256 lookup on byte values, upper and lower case.
+    """
+    from Bio.SubsMat.MatrixInfo import blosum62
+
+    m = np.empty((256, 256), dtype=float)
+    m.fill(-4)
+    m[ord("*"), ord("*")] = 1
+    for (a, b), score in blosum62.items():
+        for x in (a, a.lower()):
+            for y in (b, b.lower()):
+                m[ord(x), ord(y)] = m[ord(y), ord(x)] = score
+    return m
+
+
+SCORE_MATRIX = None
+
+
+def needle_align(a, b, gapopen=10., gapextend=.5, band=100, matrix=None):
+    """
+    Global alignment with affine gaps and free end gaps (same defaults as
+    EMBOSS `needle`), computed one row at a time with NumPy. Only cells
+    within `band` of the diagonal (plus the length difference) are filled,
+    and only that band is kept for the traceback.
+    Returns the identity string as in the needle header, and the score.
+    """
+    global SCORE_MATRIX
+    if matrix is None:
+        if SCORE_MATRIX is None:
+            SCORE_MATRIX = get_blosum62()
+        matrix = SCORE_MATRIX
+
+    n, m = len(a), len(b)
+    if not n or not m:
+        length = n + m
+        return "0/{0} (0.0%)".format(length), 0.
+    ai = np.fromstring(a, dtype=np.uint8)
+    bi = np.fromstring(b, dtype=np.uint8)
+    w = abs(n - m) + band
+    ninf = -np.inf
+    kge = np.arange(m + 1) * gapextend
+
+    # Pointers: 0 from diagonal, 1 from vertical gap, 2 from horizontal gap
+    # Only the band is kept, row i holds columns offsets[i] .. + 2w
+    width = 2 * w + 1
+    ptr = np.zeros((n + 1, width), dtype=np.int8)
+    eext = np.zeros((n + 1, width), dtype=bool)
+    fext = np.zeros((n + 1, width), dtype=bool)
+    offsets = np.zeros(n + 1, dtype=int)
+    lastcol = np.empty(n + 1)
+    lastcol.fill(ninf)
+
+    H = np.zeros(m + 1)  # leading gaps are free
+    E = np.empty(m + 1)
+    E.fill(ninf)
+    for i in xrange(1, n + 1):
+        center = i * m / n
+        lo, hi = max(1, center - w), min(m, center + w)
+        if lo > hi:
+            Hprev, H = H, np.empty(m + 1)
+            H.fill(ninf)
+            H[0] = 0
+            continue
+        Hprev, Eprev = H, E
+        H, E = np.empty(m + 1), np.empty(m + 1)
+        H.fill(ninf)
+        E.fill(ninf)
+        H[0] = 0
+
+        j = slice(lo, hi + 1)
+        k = hi - lo + 1
+        offsets[i] = lo
+        diag = Hprev[lo - 1: hi] + matrix[ai[i - 1], bi[lo - 1: hi]]
+        eopen, eextend = Hprev[j] - gapopen, Eprev[j] - gapextend
+        E[j] = np.maximum(eopen, eextend)
+        eext[i, :k] = eextend > eopen
+        Hp = np.maximum(diag, E[j])
+
+        # Horizontal gaps: F[j] = max_{k < j} Hp[k] - gapopen - (j - 1 - k) * ge
+        hp = np.concatenate(([H[lo - 1]], Hp[:-1]))  # Hp[k] for k = j - 1
+        kk = kge[lo - 1: hi]
+        best = np.maximum.accumulate(hp + kk)
+        F = best - gapopen - kk
+        fopen = hp - gapopen
+        fext[i, 1: k] = F[:-1] - gapextend > fopen[1:]
+
+        H[j] = np.maximum(Hp, F)
+        ptr[i, :k] = np.where(H[j] == diag, 0, np.where(H[j] == E[j], 1, 2))
+        lastcol[i] = H[m]
+
+    # Trailing gaps are free too, best of last row and last column
+    i, j = n, int(np.argmax(H))
+    score = H[j]
+    if lastcol.max() > score:
+        i, j = int(np.argmax(lastcol)), m
+        score = lastcol[i]
+
+    length = (n - i) + (m - j)
+    matches = 0
+    state = 0
+    while i > 0 and j > 0:
+        c = j - offsets[i]
+        if state == 0:
+            state = ptr[i, c]
+            if state == 0:
+                matches += ai[i - 1] == bi[j - 1]
+                i -= 1
+                j -= 1
+                length += 1
+            continue
+        length += 1
+        if state == 1:
+            state = 1 if eext[i, c] else 0
+            i -= 1
+        else:
+            state = 2 if fext[i, c] else 0
+            j -= 1
+    length += i + j
+
+    identity = "{0}/{1} ({2:.1f}%)".format(matches, length,
+                                           matches * 100. / length)
+    return identity, float(score)
+
+
+def needle_chunk(args):
+    """
+    Pool worker: needle scores of a chunk of (aid, bid, aseq, bseq).
+    """
+    pairs, band = args
+    return [(aid, bid) + needle_align(aseq, bseq, band=band) \
+            for aid, bid, aseq, bseq in pairs]
+
+
+def needle_pairs(pairsfile, afastafile, bfastafile, scoresfile, cpus=1,
+                 band=100, chunksize=100):
+    """
+    Score all pairs with `needle_align` and write the identity and score in
+    the same columns as `needle` action.
+    """
+    from jcvi.formats.fasta import Fasta, imap_chunks
+
+    afasta = Fasta(afastafile, index=True)
+    bfasta = Fasta(bfastafile, index=True)
+
+    def iter_jobs():
+        chunk = []
+        for row in open(pairsfile):
+            a, b = row.split()[:2]
+            if a not in afasta or b not in bfasta:
+                logging.debug("Pair {0}-{1} skipped (no sequence)".format(a, b))
+                continue
+            chunk.append((a, b, str(afasta[a].seq).rstrip("*"),
+                          str(bfasta[b].seq).rstrip("*")))
+            if len(chunk) >= chunksize:
+                yield chunk, band
+                chunk = []
+        if chunk:
+            yield chunk, band
+
+    fw = open(scoresfile, "w")
+    npairs = 0
+    for rows in imap_chunks(needle_chunk, iter_jobs(), cpus=cpus):
+        for a, b, identity, score in rows:
+            print >> fw, "\t".join((a, b, identity, "{0:.1f}".format(score)))
+        npairs += len(rows)
+    fw.close()
+    logging.debug("A total of {0} pairs written to `{1}`".\
+                    format(npairs, scoresfile))
+    return scoresfile
+
+
 def main():
 
     actions = (
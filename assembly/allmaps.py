@@ -10,7 +10,6 @@ import sys
 import logging
 
 import numpy as np
-import networkx as nx
 
 from itertools import combinations, product
 from collections import defaultdict
@@ -18,10 +17,11 @@ from collections import defaultdict
 from jcvi import __version__ as version
 from jcvi.algorithms.formula import reject_outliers, spearmanr
 from jcvi.algorithms.lis import longest_monotonic_subseq_length as lms, \
-            longest_monotonic_subsequence as lmseq
-from jcvi.algorithms.tsp import hamiltonian
+            longest_monotonic_subsequence as lmseq, pile_tops, \
+            concat_increasing_subseq_length
+from jcvi.algorithms.tsp import hamiltonian, hamiltonian_heuristic
 from jcvi.algorithms.matrix import determine_signs
-from jcvi.algorithms.ec import GA_setup, GA_run
+from jcvi.algorithms.ec import GA_setup, GA_run, ColinearEvaluator
 from jcvi.formats.agp import AGP, order_to_agp, build as agp_build, reindex
 from jcvi.formats.base import DictFile, FileMerger, must_open
 from jcvi.formats.bed import Bed, BedLine, sort
@@ -30,10 +30,10 @@ from jcvi.formats.sizes import Sizes
 from jcvi.utils.cbook import human_size, percentage
 from jcvi.utils.counter import Counter
 from jcvi.utils.grouper import Grouper
-from jcvi.utils.iter import flatten, pairwise
+from jcvi.utils.iter import pairwise
 from jcvi.utils.table import tabulate
 from jcvi.apps.base import OptionParser, ActionDispatcher, sh, \
-            need_update, get_today, SUPPRESS_HELP
+            need_update, get_today, which, SUPPRESS_HELP
 
 
 START, END = "START", "END"
@@ -123,7 +123,7 @@ class ScaffoldOO (object):
     """
     def __init__(self, lgs, scaffolds, mapc, pivot, weights, sizes,
                  function=(lambda x: x.rank), linkage=min,
-                 ngen=500, npop=100, cpus=8):
+                 ngen=500, npop=100, cpus=8, tsptimeout=None):
 
         self.lgs = lgs
         self.lengths = mapc.lengths
@@ -134,6 +134,7 @@ class ScaffoldOO (object):
         self.weights = weights
         self.function = function
         self.linkage = linkage
+        self.tsptimeout = tsptimeout
 
         self.prepare_linkage_groups()  # populate all data
         signs = self.assign_orientation()
@@ -149,8 +150,7 @@ class ScaffoldOO (object):
             scaffolds_oo = dict(tour)
             scfs, tour, ww = self.prepare_ec(scaffolds, tour, weights)
             toolbox = GA_setup(tour)
-            toolbox.register("evaluate", colinear_evaluate_multi,
-                                         scfs=scfs, weights=ww)
+            toolbox.register("evaluate", ColinearEvaluator(scfs, weights=ww))
             tour, fitness = GA_run(toolbox, ngen=ngen, npop=npop, cpus=cpus)
             tour = [scaffolds[x] for x in tour]
             tour = [(x, scaffolds_oo[x]) for x in tour]
@@ -225,37 +225,55 @@ class ScaffoldOO (object):
             self.linkage_groups.append(LG)
 
     def distances_to_tour(self):
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import shortest_path
+
         scaffolds = self.scaffolds
         distances = self.distances
-        G = nx.DiGraph()
+        nodes = [START] + list(scaffolds) + [END]
+        nodes_ii = dict((s, i) for i, s in enumerate(nodes))
+        n = len(nodes)
+        weights = {}
         for (a, b), v in distances.items():
             d = self.weighted_mean(v)
-            G.add_edge(a, b, weight=d)
+            ia, ib = nodes_ii[a], nodes_ii[b]
+            weights[ia, ib] = d
             if a == START or b == END:
                 continue
-            G.add_edge(b, a, weight=d)
-
-        logging.debug("Graph size: |V|={0}, |E|={1}.".format(len(G), G.size()))
-
-        L = nx.all_pairs_dijkstra_path_length(G)
-        for a, b in combinations(scaffolds, 2):
-            if G.has_edge(a, b):
-                continue
-            l = L[a][b]
-            G.add_edge(a, b, weight=l)
-            G.add_edge(b, a, weight=l)
-
-        edges = []
-        for a, b, d in G.edges(data=True):
-            edges.append((a, b, d['weight']))
-
-        try:
-            tour = hamiltonian(edges, directed=True, precision=2)
-            assert tour[0] == START and tour[-1] == END
-            tour = tour[1:-1]
-        except:
-            logging.debug("concorde-TSP failed. Use default scaffold ordering.")
-            tour = scaffolds[:]
+            weights[ib, ia] = d
+
+        logging.debug("Graph size: |V|={0}, |E|={1}.".format(n, len(weights)))
+
+        ii, jj = np.array(weights.keys()).T
+        w = np.array(weights.values(), dtype=float)
+        # Explicit zeros are not edges to csgraph
+        G = csr_matrix((np.maximum(w, 1e-9), (ii, jj)), shape=(n, n))
+        D = shortest_path(G, method="D", directed=True)
+        D[ii, jj] = w  # Direct edges are used as is
+        finite = np.isfinite(D)
+        D[~finite] = 2 * D[finite].max() if finite.any() else 1
+        np.fill_diagonal(D, 0)
+
+        tour = None
+        if which("concorde"):
+            edges = []
+            for ia, ib in zip(*np.nonzero(~np.eye(n, dtype=bool))):
+                if ib == 0 or ia == n - 1 or (ia == 0 and ib == n - 1):
+                    continue
+                edges.append((nodes[ia], nodes[ib], D[ia, ib]))
+            try:
+                tour = hamiltonian(edges, directed=True, precision=2,
+                                   timeout=self.tsptimeout)
+                assert tour[0] == START and tour[-1] == END
+                tour = tour[1:-1]
+            except:
+                logging.debug("concorde-TSP failed.")
+                tour = None
+
+        if tour is None:
+            logging.debug("Use TSP heuristic for scaffold ordering.")
+            path = hamiltonian_heuristic(D, start=0, end=n - 1)
+            tour = [nodes[x] for x in path[1:-1]]
         return tour
 
     def assign_order(self):
@@ -317,17 +335,23 @@ class ScaffoldOO (object):
         """
         if not si or not sj:
             return 0
+        key = (tuple(si), tuple(sj))
+        if key in self.orientation_cache:
+            return self.orientation_cache[key]
         # Same orientation configuration
         a = lms(si + sj)
         b = lms(sj + si)
         # Opposite orientation configuration
         c = lms(si + sj[::-1])
         d = lms(sj[::-1] + si)
-        return max(a, b)[0] - max(c, d)[0]
+        self.orientation_cache[key] = o = max(a, b)[0] - max(c, d)[0]
+        return o
 
     def assign_orientation(self):
         signs = defaultdict(list)
         scaffolds = self.scaffolds
+        scaffolds_ii = dict((s, i) for i, s in enumerate(scaffolds))
+        self.orientation_cache = {}
         for mlg in self.linkage_groups:
             mapname = mlg.mapname
             series = mlg.series
@@ -335,9 +359,12 @@ class ScaffoldOO (object):
                 pivot_oo = mlg.oo
                 pivot_nmarkers = mlg.nmarkers
 
-            for i, j in combinations(range(len(scaffolds)), 2):
+            # Only scaffolds with markers on this LG can have a signal
+            present = sorted(scaffolds_ii[x] for x in series \
+                                if x in scaffolds_ii)
+            for i, j in combinations(present, 2):
                 si, sj = scaffolds[i], scaffolds[j]
-                si, sj = series.get(si, []), series.get(sj, [])
+                si, sj = series[si], series[sj]
                 d = self.get_orientation(si, sj)
                 if not d:
                     continue
@@ -368,15 +395,9 @@ class ScaffoldOO (object):
         for mlg in self.linkage_groups:
             lg = mlg.lg
             mapname = mlg.mapname
-            for s, o in tour:
-                i = scaffolds.index(s)
-                L = [self.get_series(lg, x, xo) for x, xo in tour[:i]]
-                U = [self.get_series(lg, x, xo) for x, xo in tour[i + 1:]]
-                L, U = list(flatten(L)), list(flatten(U))
-                M = self.get_series(lg, s)
-                plus = lms(L + M + U)
-                minus = lms(L + M[::-1] + U)
-                d = plus[0] - minus[0]
+            series = [self.get_series(lg, x, xo) for x, xo in tour]
+            raw = [self.get_series(lg, x) for x in scaffolds]
+            for s, d in zip(scaffolds, flip_deltas(series, raw)):
                 if not d:
                     continue
                 scaffold_oo[s].append((d, mapname))  # reset orientation
@@ -709,16 +730,41 @@ class GapEstimator (object):
             self.gapsizes.append(gapsize)
 
 
-def colinear_evaluate_multi(tour, scfs, weights):
-    weighted_score = 0
-    for scf, w in zip(scfs, weights):
-        subtour = [x for x in tour if x in scf]
-        series = []
-        for t in subtour:
-            series.extend(scf[t])
-        score, diff = lms(series)
-        weighted_score += score * w
-    return (weighted_score,)
+def flip_deltas(series, raw):
+    """
+    For each block M = raw[i], compute lms(L + M + U) - lms(L + M[::-1] + U),
+    where L and U are the concatenated series before and after block i.
+    Patience pile tops of the prefix are carried forward, and those of the
+    reversed suffix are precomputed once, so each test only scans M and the
+    pile tops instead of the whole chain.
+    """
+    n = len(series)
+    deltas = [0] * n
+    best = [[0, 0] for i in xrange(n)]  # (plus, minus) for each block
+    for sign in (1, -1):  # increasing, then decreasing
+        heads = [None] * n
+        h = []
+        for i in xrange(n - 1, -1, -1):
+            heads[i] = h
+            if series[i]:
+                h = pile_tops([-sign * x for x in series[i][::-1]], tops=h)
+
+        tails = []
+        for i in xrange(n):
+            M = [sign * x for x in raw[i]]
+            if M:
+                plus = pile_tops(M, tops=tails)
+                minus = pile_tops(M[::-1], tops=tails)
+                b = best[i]
+                b[0] = max(b[0], concat_increasing_subseq_length(plus, heads[i]))
+                b[1] = max(b[1], concat_increasing_subseq_length(minus, heads[i]))
+            if series[i]:
+                tails = pile_tops([sign * x for x in series[i]], tops=tails)
+
+    for i, (plus, minus) in enumerate(best):
+        if raw[i]:
+            deltas[i] = plus - minus
+    return deltas
 
 
 def get_rho(xy):
@@ -972,6 +1018,8 @@ def path(args):
                  help="Iterations in GA, more ~ slower")
     p.add_option("--npop", default=100, type="int",
                  help="Population size in GA, more ~ slower")
+    p.add_option("--tsptimeout", default=600, type="int",
+                 help="Seconds before concorde-TSP falls back to heuristic")
     p.add_option("--seqid", help="Only run partition with this seqid")
     p.add_option("--links", default=10, type="int",
                  help="Only plot matchings more than")
@@ -1077,7 +1125,8 @@ def path(args):
         logging.debug("Working on {0} ...".format(tag))
         s = ScaffoldOO(lgs, scaffolds, cc, pivot, weights, sizes,
                        function=function, linkage=linkage,
-                       ngen=ngen, npop=npop, cpus=cpus)
+                       ngen=ngen, npop=npop, cpus=cpus,
+                       tsptimeout=opts.tsptimeout)
 
         for fw in (sys.stderr, fwtour):
             print >> fw, ">{0} ({1})".format(s.object, tag)
@@ -5,6 +5,7 @@
 Deals with K-mers and K-mer distribution from reads or genome
 """
 
+import os
 import os.path as op
 import sys
 import logging
@@ -12,15 +13,234 @@ import numpy as np
 
 from jcvi.graphics.base import plt, asciiplot, set_human_axis, savefig, \
             markup, panel_labels, normalize_axes, set_ticklabels_helvetica
-from jcvi.formats.fasta import Fasta
+from jcvi.formats.fasta import iter_record_chunks, imap_chunks
 from jcvi.formats.base import BaseFile, must_open, get_number
 from jcvi.utils.cbook import thousands, percentage
 from jcvi.apps.base import OptionParser, ActionDispatcher, sh, \
-            need_update, Popen, PIPE
+            need_update, popen
 
 
 KMERYL, KSOAP, KALLPATHS = range(3)
 
+# 2-bit codes, N and other symbols are read as A
+KMER_CODES = np.zeros(256, dtype=np.uint64)
+for i, c in enumerate("ACGT"):
+    KMER_CODES[ord(c)] = KMER_CODES[ord(c.lower())] = i
+
+
+KMER_VALID = np.zeros(256, dtype=bool)
+KMER_VALID[np.fromstring("ACGTacgt", dtype=np.uint8)] = True
+
+
+def encode_kmers(seq, K, canonical=False, valid=False):
+    """
+    All K-mers of the sequence, 2-bit packed into uint64 (K <= 32). With
+    `canonical`, the smaller of each K-mer and its reverse complement. With
+    `valid`, K-mers that span a symbol other than ACGT are dropped.
+    """
+    assert K <= 32, "K-mer size must be <= 32"
+    n = len(seq) - K + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    two = np.uint64(2)
+    codes = KMER_CODES[np.fromstring(seq, dtype=np.uint8)]
+    kmers = np.zeros(n, dtype=np.uint64)
+    for j in xrange(K):
+        kmers <<= two
+        kmers |= codes[j: j + n]
+    if canonical:
+        codes = np.uint64(3) - codes
+        rc = np.zeros(n, dtype=np.uint64)
+        for j in xrange(K - 1, -1, -1):
+            rc <<= two
+            rc |= codes[j: j + n]
+        kmers = np.minimum(kmers, rc)
+    if valid:
+        bad = np.cumsum(~KMER_VALID[np.fromstring(seq, dtype=np.uint8)])
+        bad = np.concatenate(([0], bad))
+        kmers = kmers[bad[K:] == bad[:n]]
+    return kmers
+
+
+def text_kmers(seq, K):
+    """
+    All K-mers of the sequence as text, one K-mer per line. Same symbols as
+    make_kmers: upper case, with N read as A.
+    """
+    seq = str(seq).upper().replace("N", "A")
+    n = len(seq) - K + 1
+    if n <= 0:
+        return ""
+
+    a = np.fromstring(seq, dtype=np.uint8)
+    out = np.empty((n, K + 1), dtype=np.uint8)
+    out[:, K] = ord("\n")
+    out[:, :K] = np.lib.stride_tricks.as_strided(a, shape=(n, K),
+                                                 strides=(1, 1))
+    return out.tostring()
+
+
+class KmerSet (object):
+    """
+    Sorted array of distinct canonical K-mers, 2-bit packed, for membership
+    queries with binary search.
+    """
+    def __init__(self, kmers, K):
+        self.K = K
+        self.kmers = np.unique(kmers)
+
+    @classmethod
+    def from_fasta(cls, fastafile, K, cpus=1):
+        jobs = ((x, K) for x in iter_record_chunks(fastafile))
+        parts = list(imap_chunks(kmer_chunk, jobs, cpus=cpus))
+        kmers = np.concatenate(parts) if parts else \
+                np.zeros(0, dtype=np.uint64)
+        return cls(kmers, K)
+
+    @classmethod
+    def from_jellyfish(cls, jfdb, K, batchsize=1000000):
+        fp = popen("jellyfish dump -c -t {0}".format(jfdb))
+        parts, batch = [], []
+        for row in fp:
+            batch.append(row[:K])
+            if len(batch) >= batchsize:
+                parts.append(cls.encode_batch(batch, K))
+                batch = []
+        if batch:
+            parts.append(cls.encode_batch(batch, K))
+        kmers = np.concatenate(parts) if parts else \
+                np.zeros(0, dtype=np.uint64)
+        return cls(kmers, K)
+
+    @classmethod
+    def encode_batch(cls, batch, K):
+        # Separate K-mers with a symbol, then keep every (K + 1)-th K-mer
+        kmers = encode_kmers("N".join(batch), K, canonical=True)
+        return np.unique(kmers[::K + 1])
+
+    def __len__(self):
+        return len(self.kmers)
+
+    def __contains__(self, kmer):
+        return self.contains(encode_kmers(kmer, self.K, canonical=True))[0]
+
+    def contains(self, kmers):
+        """
+        Boolean mask of the packed canonical K-mers that are in the set.
+        """
+        if not len(self.kmers):
+            return np.zeros(len(kmers), dtype=bool)
+        idx = np.searchsorted(self.kmers, kmers)
+        idx[idx == len(self.kmers)] = 0
+        return self.kmers[idx] == kmers
+
+
+def kmer_chunk(args):
+    """
+    Pool worker: distinct canonical K-mers in a chunk of (header, seq).
+    """
+    records, K = args
+    kmers = [np.unique(encode_kmers(seq, K, canonical=True)) \
+                for header, seq in records]
+    return np.unique(np.concatenate(kmers)) if kmers else \
+           np.zeros(0, dtype=np.uint64)
+
+
+KMERSET = None  # Shared with the pool workers
+
+
+def shared_chunk(records):
+    """
+    Pool worker: for each sequence, mask of its K-mers found in KMERSET.
+    """
+    K = KMERSET.K
+    return [(header.split(None, 1)[0],
+             KMERSET.contains(encode_kmers(seq, K, canonical=True))) \
+             for header, seq in records]
+
+
+def iter_reads(filename):
+    """
+    Sequences of a FASTA or FASTQ file, possibly gzipped.
+    """
+    from itertools import chain
+    from jcvi.formats.fasta import iter_fasta_raw
+
+    fp = must_open(filename)
+    row = fp.readline()
+    if row[:1] == "@":
+        while row:
+            seq = fp.readline().rstrip()
+            fp.readline()
+            fp.readline()
+            yield seq
+            row = fp.readline()
+    else:
+        for rec in iter_fasta_raw(chain([row], fp)):
+            yield rec.seq
+
+
+def iter_read_chunks(filenames, chunksize=10000000):
+    """
+    Batches of reads totalling about `chunksize` bases.
+    """
+    chunk, size = [], 0
+    for filename in filenames:
+        for seq in iter_reads(filename):
+            chunk.append(seq)
+            size += len(seq)
+            if size >= chunksize:
+                yield chunk
+                chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+SHARD_HASH = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shard_chunk(args):
+    """
+    Pool worker: canonical K-mers in a batch of reads, appended to the shard
+    files by the top bits of a multiplicative hash.
+    """
+    reads, K, bits, tmpdir = args
+    kmers = encode_kmers("N".join(reads), K, canonical=True, valid=True)
+    if bits:
+        shards = (kmers * SHARD_HASH) >> np.uint64(64 - bits)
+        order = np.argsort(shards, kind="mergesort")
+        kmers = kmers[order]
+        bounds = np.cumsum(np.bincount(shards.astype(int),
+                                       minlength=1 << bits))
+    else:
+        bounds = [len(kmers)]
+
+    pid = os.getpid()
+    start = 0
+    for s, end in enumerate(bounds):
+        if end > start:
+            shardfile = op.join(tmpdir, "shard.{0}.{1}".format(s, pid))
+            with open(shardfile, "ab") as fw:
+                kmers[start:end].tofile(fw)
+        start = end
+    return len(kmers)
+
+
+def count_shard(shardfiles):
+    """
+    Pool worker: histogram of K-mer multiplicities in one shard.
+    """
+    kmers = [np.fromfile(x, dtype=np.uint64) for x in shardfiles]
+    kmers = np.concatenate(kmers)
+    for x in shardfiles:
+        os.remove(x)
+    kmers.sort()
+    # Run lengths of the sorted K-mers
+    bounds = np.flatnonzero(np.diff(kmers)) + 1
+    bounds = np.concatenate(([0], bounds, [len(kmers)]))
+    return np.bincount(np.diff(bounds))
+
 
 class KmerSpectrum (BaseFile):
 
@@ -207,6 +427,7 @@ def main():
 
     actions = (
         ('jellyfish', 'dump histogram using `jellyfish`'),
+        ('spectrum', 'dump histogram with the built-in K-mer counter'),
         ('meryl', 'dump histogram using `meryl`'),
         ('histogram', 'plot the histogram based on meryl K-mer distribution'),
         ('multihistogram', 'plot histogram across a set of K-mer sizes'),
@@ -214,7 +435,7 @@ def main():
         ('dump', 'convert FASTA sequences to list of K-mers'),
         ('bin', 'serialize counts to bitarrays'),
         ('bincount', 'count K-mers in the bin'),
-        ('count', 'run dump - jellyfish - bin - bincount in serial'),
+        ('count', 'count K-mers of each sequence shared with a K-mer db'),
         ('logodds', 'compute log likelihood between two db'),
             )
     p = ActionDispatcher(actions)
@@ -258,51 +479,67 @@ def get_K(jfdb):
     return int(j[1:])
 
 
+def is_fasta(filename):
+    """
+    FASTA by extension or by the leading `>`; jellyfish dbs written by
+    jellyfish() are named `{prefix}-K{K}` without extension.
+    """
+    base = filename[:-3] if filename.endswith(".gz") else filename
+    if base.rsplit(".", 1)[-1] in ("fasta", "fa", "fna", "fas", "fsa"):
+        return True
+    fp = must_open(filename)
+    c = fp.read(1)
+    fp.close()
+    return c == ">"
+
+
 def count(args):
     """
     %prog count fastafile jf.db
 
-    Run dump - jellyfish - bin - bincount in serial.
+    Count K-mers of each sequence that are shared with the K-mer db, which
+    is a jellyfish db or a FASTA file (-K required). Sequences are encoded as
+    packed K-mers and queried against the sorted db in-process, in a pool
+    of workers. Writes the bits (.bin) and the counts per sequence (.cnt).
     """
-    from bitarray import bitarray
+    global KMERSET
 
     p = OptionParser(count.__doc__)
+    p.add_option("-K", type="int",
+                 help="K-mer size, inferred from jellyfish db name if not "
+                      "given [default: %default]")
+    p.set_cpus(cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 2:
         sys.exit(not p.print_help())
 
     fastafile, jfdb = args
-    K = get_K(jfdb)
-    cmd = "jellyfish query {0} -C | cut -d' ' -f 2".format(jfdb)
-    t = must_open("tmp", "w")
-    proc = Popen(cmd, stdin=PIPE, stdout=t)
-    t.flush()
-
-    f = Fasta(fastafile, lazy=True)
-    for name, rec in f.iteritems_ordered():
-        kmers = list(make_kmers(rec.seq, K))
-        print >> proc.stdin, "\n".join(kmers)
-    proc.stdin.close()
-    logging.debug(cmd)
-    proc.wait()
-
-    a = bitarray()
-    binfile = ".".join((fastafile, jfdb, "bin"))
-    fw = open(binfile, "w")
-    t.seek(0)
-    for row in t:
-        c = row.strip()
-        a.append(int(c))
-    a.tofile(fw)
-    logging.debug("Serialize {0} bits to `{1}`.".format(len(a), binfile))
-    fw.close()
-    sh("rm {0}".format(t.name))
+    if is_fasta(jfdb):
+        K = opts.K
+        assert K, "-K is required for FASTA db `{0}`".format(jfdb)
+        KMERSET = KmerSet.from_fasta(jfdb, K, cpus=opts.cpus)
+    else:
+        K = opts.K or get_K(jfdb)
+        KMERSET = KmerSet.from_jellyfish(jfdb, K)
+    logging.debug("Loaded {0} distinct K-mers (K={1}) from `{2}`.".\
+                    format(len(KMERSET), K, jfdb))
 
+    binfile = ".".join((fastafile, jfdb, "bin"))
+    cntfile = ".".join((fastafile, jfdb, "cnt"))
+    fwcnt = open(cntfile, "w")
+    bits = []
+    chunks = iter_record_chunks(fastafile)
+    for results in imap_chunks(shared_chunk, chunks, cpus=opts.cpus):
+        for name, shared in results:
+            bits.append(shared)
+            print >> fwcnt, "\t".join(str(x) for x in (name, shared.sum()))
+    fwcnt.close()
+
+    bits = np.concatenate(bits) if bits else np.zeros(0, dtype=bool)
+    np.packbits(bits).tofile(binfile)
     logging.debug("Shared K-mers (K={0}) between `{1}` and `{2}` written to `{3}`.".\
                     format(K, fastafile, jfdb, binfile))
-    cntfile = ".".join((fastafile, jfdb, "cnt"))
-    bincount([fastafile, binfile, "-o", cntfile, "-K {0}".format(K)])
     logging.debug("Shared K-mer counts written to `{0}`.".format(cntfile))
 
 
@@ -312,7 +549,6 @@ def bincount(args):
 
     Count K-mers in the bin.
     """
-    from bitarray import bitarray
     from jcvi.formats.sizes import Sizes
 
     p = OptionParser(bincount.__doc__)
@@ -327,18 +563,16 @@ def bincount(args):
     fastafile, binfile = args
     K = opts.K
 
-    fp = open(binfile)
-    a = bitarray()
-    a.fromfile(fp)
+    a = np.unpackbits(np.fromfile(binfile, dtype=np.uint8))
     f = Sizes(fastafile)
-    tsize = 0
+    names, sizes = zip(*f.iter_sizes()) if len(f) else ((), ())
+    ksizes = np.maximum(np.array(sizes, dtype=int) - K + 1, 0)
+    ends = np.cumsum(ksizes)
+    cumcounts = np.concatenate(([0], np.cumsum(a, dtype=int)))
+    counts = cumcounts[ends] - cumcounts[ends - ksizes]
     fw = must_open(opts.outfile, "w")
-    for name, seqlen in f.iter_sizes():
-        ksize = seqlen - K + 1
-        b = a[tsize: tsize + ksize]
-        bcount = b.count()
+    for name, bcount in zip(names, counts):
         print >> fw, "\t".join(str(x) for x in (name, bcount))
-        tsize += ksize
 
 
 def bin(args):
@@ -347,7 +581,6 @@ def bin(args):
 
     Serialize counts to bitarrays.
     """
-    from bitarray import bitarray
     p = OptionParser(bin.__doc__)
     opts, args = p.parse_args(args)
 
@@ -356,13 +589,8 @@ def bin(args):
 
     inp, outp = args
     fp = must_open(inp)
-    fw = must_open(outp, "w")
-    a = bitarray()
-    for row in fp:
-        c = row.split()[-1]
-        a.append(int(c))
-    a.tofile(fw)
-    fw.close()
+    a = np.array([int(row.split()[-1]) for row in fp]) > 0
+    np.packbits(a).tofile(outp)
 
 
 def make_kmers(seq, K):
@@ -390,10 +618,9 @@ def dump(args):
     fastafile, = args
     K = opts.K
     fw = must_open(opts.outfile, "w")
-    f = Fasta(fastafile, lazy=True)
-    for name, rec in f.iteritems_ordered():
-        kmers = list(make_kmers(rec.seq, K))
-        print >> fw, "\n".join(kmers)
+    for records in iter_record_chunks(fastafile):
+        for header, seq in records:
+            fw.write(text_kmers(seq, K) or "\n")
     fw.close()
 
 
@@ -458,6 +685,73 @@ def jellyfish(args):
         sh(cmd)
 
 
+def spectrum(args):
+    """
+    %prog spectrum [*.fastq|*.fasta]
+
+    Count canonical K-mers of the reads and dump histogram to be used in
+    kmer.histogram(). K-mers are 2-bit packed and hashed into shards on disk,
+    each shard small enough to be sorted and counted within --memory.
+    """
+    import shutil
+
+    from tempfile import mkdtemp
+    from jcvi.apps.base import getfilesize
+
+    p = OptionParser(spectrum.__doc__)
+    p.add_option("-K", default=23, type="int",
+                 help="K-mer size [default: %default]")
+    p.add_option("--prefix", default="jf",
+                 help="Histogram prefix [default: %default]")
+    p.add_option("--memory", default=4, type="float",
+                 help="Memory budget in Gb [default: %default]")
+    p.set_cpus(cpus=1)
+    p.set_tmpdir()
+    opts, args = p.parse_args(args)
+
+    if len(args) < 1:
+        sys.exit(not p.print_help())
+
+    fastqfiles = args
+    K, cpus = opts.K, opts.cpus
+    histfile = "{0}-K{1}.histogram".format(opts.prefix, K)
+    if not need_update(fastqfiles, histfile):
+        return histfile
+
+    # Each base is at most one 8-byte K-mer; sorting needs about a copy more.
+    # Shards are counted `cpus` at a time.
+    totalfilesize = sum(getfilesize(x, ratio=4) for x in fastqfiles)
+    budget = opts.memory * 1e9 / cpus
+    bits = 0
+    while totalfilesize * 16 >> bits > budget and bits < 16:
+        bits += 1
+    logging.debug("Split K-mers into {0} shards".format(1 << bits))
+
+    tmpdir = mkdtemp(prefix="kmer-", dir=opts.tmpdir)
+    jobs = ((x, K, bits, tmpdir) for x in iter_read_chunks(fastqfiles))
+    total = sum(imap_chunks(shard_chunk, jobs, cpus=cpus))
+    logging.debug("A total of {0} K-mers".format(total))
+
+    shardfiles = {}
+    for x in os.listdir(tmpdir):
+        s = int(x.split(".")[1])
+        shardfiles.setdefault(s, []).append(op.join(tmpdir, x))
+    hist = np.zeros(1, dtype=int)
+    for h in imap_chunks(count_shard, shardfiles.values(), cpus=cpus):
+        if len(h) > len(hist):
+            h, hist = hist, h
+        hist[:len(h)] += h
+    shutil.rmtree(tmpdir)
+
+    fw = open(histfile, "w")
+    for freq in np.flatnonzero(hist):
+        print >> fw, "{0}\t{1}".format(freq, hist[freq])
+    fw.close()
+    logging.debug("Histogram written to `{0}`".format(histfile))
+
+    return histfile
+
+
 def meryl(args):
     """
     %prog meryl merylfile
@@ -23,7 +23,6 @@ from math import log
 from jcvi.utils.iter import pairwise
 from jcvi.compara.synteny import AnchorFile, check_beds
 from jcvi.formats.bed import Bed
-from jcvi.formats.blast import BlastLine
 from jcvi.apps.base import OptionParser, ActionDispatcher, need_update, sh
 
 
@@ -43,55 +42,47 @@ def make_arrays(blastfile, qpadbed, spadbed, qpadnames, spadnames):
     contains the statistical significance for each comparison.
     """
     m, n = len(qpadnames), len(spadnames)
-    qpadorder, spadorder = qpadbed.order, spadbed.order
     qpadid = dict((a, i) for i, a in enumerate(qpadnames))
     spadid = dict((a, i) for i, a in enumerate(spadnames))
-    qpadlen = dict((a, len(b)) for a, b in qpadbed.sub_beds())
-    spadlen = dict((a, len(b)) for a, b in spadbed.sub_beds())
+    # Map each gene directly to the integer code of its PAD
+    qcode = dict((b.accn, qpadid[b.seqid]) for b in qpadbed)
+    scode = dict((b.accn, spadid[b.seqid]) for b in spadbed)
+    qpadlen = np.bincount([qpadid[b.seqid] for b in qpadbed], minlength=m)
+    spadlen = np.bincount([spadid[b.seqid] for b in spadbed], minlength=n)
 
     qsize, ssize = len(qpadbed), len(spadbed)
 
-    assert sum(qpadlen.values()) == qsize
-    assert sum(spadlen.values()) == ssize
+    assert qpadlen.sum() == qsize
+    assert spadlen.sum() == ssize
 
     # Populate arrays of observed counts and expected counts
     logging.debug("Initialize array of size ({0} x {1})".format(m, n))
-    observed = np.zeros((m, n))
+    qi, si = [], []
     fp = open(blastfile)
-    all_dots = 0
     for row in fp:
-        b = BlastLine(row)
-        qi, q = qpadorder[b.query]
-        si, s = spadorder[b.subject]
-        qseqid, sseqid = q.seqid, s.seqid
-        qsi, ssi = qpadid[qseqid], spadid[sseqid]
-        observed[qsi, ssi] += 1
-        all_dots += 1
+        query, subject = row.split("\t", 2)[:2]
+        qi.append(qcode[query])
+        si.append(scode[subject])
+    fp.close()
 
-    assert int(round(observed.sum())) == all_dots
+    all_dots = len(qi)
+    cells = np.array(qi, dtype=int) * n + np.array(si, dtype=int)
+    observed = np.bincount(cells, minlength=m * n).reshape((m, n))
+
+    assert observed.sum() == all_dots
 
     logging.debug("Total area: {0} x {1}".format(qsize, ssize))
     S = qsize * ssize
-    expected = np.zeros((m, n))
-    qsum = 0
-    for i, a in enumerate(qpadnames):
-        alen = qpadlen[a]
-        qsum += alen
-        for j, b in enumerate(spadnames):
-            blen = spadlen[b]
-            expected[i, j] = all_dots * alen * blen * 1. / S
+    expected = np.outer(qpadlen, spadlen) * (all_dots * 1. / S)
 
     assert int(round(expected.sum())) == all_dots
 
     # Calculate the statistical significance for each cell
     from scipy.stats.distributions import poisson
     M = m * n  # multiple testing
-    logmp = np.zeros((m, n))
-    for i in xrange(m):
-        for j in xrange(n):
-            obs, exp = observed[i, j], expected[i, j]
-            pois = max(poisson.pmf(obs, exp), 1e-250)  # Underflow
-            logmp[i, j] = max(- log(pois), 0)
+    logmp = - poisson.logpmf(observed, expected)
+    # Clip at pmf of 1e-250 as underflow guard
+    logmp = np.clip(logmp, 0, - log(1e-250))
 
     return logmp
 
@@ -138,17 +129,12 @@ def pad(args):
     snames = range(len(sparts))
 
     logmp = make_arrays(blastfile, qbed, sbed, qnames, snames)
-    m, n = logmp.shape
     pvalue_cutoff = 1e-30
     cutoff = - log(pvalue_cutoff)
 
     significant = []
-    for i in xrange(m):
-        for j in xrange(n):
-            score = logmp[i, j]
-            if score < cutoff:
-                continue
-            significant.append((qparts[i], sparts[j], score))
+    for i, j in np.argwhere(logmp >= cutoff):
+        significant.append((qparts[i], sparts[j], logmp[i, j]))
 
     for a, b, score in significant:
         print "|".join(a), "|".join(b), score
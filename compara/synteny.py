@@ -9,7 +9,7 @@ import numpy as np
 from collections import defaultdict
 
 from jcvi.algorithms.lis import heaviest_increasing_subsequence as his
-from jcvi.formats.bed import Bed
+from jcvi.formats.bed import Bed, get_gene_order
 from jcvi.formats.blast import BlastLine
 from jcvi.formats.base import BaseFile, SetFile, read_block, must_open
 from jcvi.utils.grouper import Grouper
@@ -405,10 +405,9 @@ def check_beds(hintfile, p, opts):
     if is_self:
         logging.debug("Looks like self-self comparison.")
 
-    qbed = Bed(opts.qbed)
-    sbed = Bed(opts.sbed)
-    qorder = qbed.order
-    sorder = sbed.order
+    qorder = get_gene_order(qbed_file)
+    sorder = get_gene_order(sbed_file)
+    qbed, sbed = qorder.bed, sorder.bed
 
     return qbed, sbed, qorder, sorder, is_self
 
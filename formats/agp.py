@@ -7,6 +7,7 @@ http://www.ncbi.nlm.nih.gov/projects/genome/assembly/agp
 """
 
 import os
+import os.path as op
 import re
 import sys
 import shutil
@@ -21,8 +22,9 @@ from Bio.SeqRecord import SeqRecord
 from Bio import SeqIO
 
 from jcvi.formats.base import LineFile, must_open
-from jcvi.formats.fasta import Fasta
+from jcvi.formats.fasta import Fasta, FastaIndex, write_wrapped
 from jcvi.formats.bed import Bed, BedLine
+from jcvi.formats.chain import LiftOver
 from jcvi.assembly.base import calculate_A50
 from jcvi.utils.range import range_intersect
 from jcvi.utils.iter import pairwise, flatten
@@ -405,12 +407,59 @@ class AGP (LineFile):
             if len(rec) > 1000000:
                 logging.debug("Write object %s to `%s`" % (object, fw.name))
 
-    def build_all(self, componentfasta, targetfasta, newagp=None):
-        f = Fasta(componentfasta, index=False)
-        fw = open(targetfasta, "w")
+    def build_all(self, componentfasta, targetfasta, newagp=None, cpus=1):
+        """
+        Components are fetched on demand through a byte-offset index of the
+        component FASTA. Unless trimming (`newagp`), each object is streamed
+        into its own temporary file in a pool of `cpus` workers, and the
+        files are concatenated in AGP order. Component FASTA that can't be
+        indexed (compressed, ragged lines) is loaded and built serially.
+        """
+        try:
+            f = FastaIndex(componentfasta)
+        except AssertionError as e:
+            logging.debug("{0}, load `{1}` instead.".format(e, componentfasta))
+            f = None
+
+        if newagp or f is None:
+            f = f or Fasta(componentfasta, index=False)
+            fw = open(targetfasta, "w")
+            for ob, lines in self.iter_object():
+                self.build_one(ob, lines, f, fw, newagp=newagp)
+            fw.close()
+            return
 
-        for ob, lines in self.iter_object():
-            self.build_one(ob, lines, f, fw, newagp=newagp)
+        from tempfile import mkdtemp
+        from multiprocessing import Pool
+
+        tmpdir = mkdtemp(dir=op.dirname(op.abspath(targetfasta)))
+        jobs = [(ob, lines, componentfasta, op.join(tmpdir, str(i)),
+                 self.validate) for i, (ob, lines) in \
+                 enumerate(self.iter_object())]
+        pool = Pool(cpus) if cpus > 1 else None
+        # Forked workers load their own index, not to share the file offset
+        if not pool:
+            FastaIndexes[componentfasta] = f
+        try:
+            results = pool.imap(build_object, jobs) if pool else \
+                      (build_object(x) for x in jobs)
+
+            fw = open(targetfasta, "w")
+            for ob, objectfasta, total_bp in results:
+                fp = open(objectfasta)
+                shutil.copyfileobj(fp, fw)
+                fp.close()
+                os.remove(objectfasta)
+                if total_bp > 1000000:
+                    logging.debug("Write object %s to `%s`" % \
+                                  (ob, targetfasta))
+            fw.close()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+            FastaIndexes.pop(componentfasta, None)
+            shutil.rmtree(tmpdir, ignore_errors=True)
 
     @property
     def graph(self):
@@ -646,6 +695,50 @@ def order_to_agp(object, ctgorder, sizes, fwagp, gapsize=100, gaptype="scaffold"
     o.write_AGP(fwagp, gapsize=gapsize, gaptype=gaptype, phases={})
 
 
+FastaIndexes = {}
+
+
+def build_object(args):
+    """
+    Stream one AGP object to `objectfasta`, wrapped at 60 columns. Lengths
+    are validated on the fly instead of on the assembled molecule. The
+    component index is loaded once per process.
+    """
+    object, lines, componentfasta, objectfasta, validate = args
+    if componentfasta not in FastaIndexes:
+        FastaIndexes[componentfasta] = FastaIndex(componentfasta)
+    f = FastaIndexes[componentfasta]
+    fw = open(objectfasta, "w")
+    print >> fw, ">{0}".format(object)
+
+    def chunks():
+        total_bp = 0
+        for line in lines:
+            if line.is_gap:
+                gap = line.gap_length
+                while gap > 0:
+                    size = min(gap, 10000000)
+                    gap -= size
+                    total_bp += size
+                    yield 'N' * size
+            else:
+                for seq in f.iter_chunks(line.component_id,
+                                         line.component_beg,
+                                         line.component_end,
+                                         line.orientation):
+                    total_bp += len(seq)
+                    yield seq
+
+            if validate:
+                assert total_bp == line.object_end, \
+                        "cumulative base pairs (%d) does not match (%d)" % \
+                        (total_bp, line.object_end)
+
+    total_bp = write_wrapped(fw, chunks())
+    fw.close()
+    return object, objectfasta, total_bp
+
+
 def trimNs(seq, line, newagp):
     """
     Test if the sequences contain dangling N's on both sides. This component
@@ -1175,6 +1268,7 @@ def liftover(args):
     %prog liftover agpfile bedfile
 
     Given coordinates in components, convert to the coordinates in chromosomes.
+    Features that span several components are split.
     """
     p = OptionParser(liftover.__doc__)
     p.add_option("--prefix", default=False, action="store_true",
@@ -1185,39 +1279,22 @@ def liftover(args):
         sys.exit(p.print_help())
 
     agpfile, bedfile = args
-    agp = AGP(agpfile).order
+    lo = LiftOver.from_agp(agpfile)
     bed = Bed(bedfile)
-    newbed = Bed()
-    for b in bed:
-        component = b.seqid
-        if component not in agp:
-            newbed.append(b)
-            continue
-
-        i, a = agp[component]
-
-        assert a.component_beg < a.component_end
-        arange = a.component_beg, a.component_end
-        assert b.start < b.end
-        brange = b.start, b.end
-
-        st = range_intersect(arange, brange)
-        if not st:
-            continue
-        start, end = st
-        assert start <= end
-
-        if a.orientation == '-':
-            d = a.object_end + a.component_beg
-            s, t = d - end, d - start
-        else:
-            d = a.object_beg - a.component_beg
-            s, t = d + start, d + end
+    passed = [b for b in bed if b.seqid not in lo]
+    bed = [b for b in bed if b.seqid in lo]
+    idx, objects, starts, ends, strands = \
+            lo.map([b.seqid for b in bed], [b.start - 1 for b in bed],
+                   [b.end for b in bed])
 
+    newbed = Bed()
+    newbed.extend(passed)
+    for i, object, s, t in zip(idx, objects, starts, ends):
+        b = bed[i]
         name = b.accn.replace(" ", "_")
         if opts.prefix:
-            name = component + "_" + name
-        bline = "\t".join(str(x) for x in (a.object, s - 1, t, name))
+            name = b.seqid + "_" + name
+        bline = "\t".join(str(x) for x in (object, s, t, name))
         newbed.append(BedLine(bline))
 
     newbed.print_to_file(sorted=True)
@@ -1722,6 +1799,7 @@ def build(args):
     p.add_option("--novalidate", dest="novalidate", default=False,
             action="store_true",
             help="Don't validate the agpfile [default: %default]")
+    p.set_cpus(cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 3:
@@ -1740,7 +1818,7 @@ def build(args):
 
     agp = AGP(agpfile, validate=validate, sorted=True)
     agp.build_all(componentfasta=componentfasta, targetfasta=targetfasta,
-            newagp=newagp)
+            newagp=newagp, cpus=opts.cpus)
     logging.debug("Target fasta written to `{0}`.".format(targetfasta))
 
     return newagpfile
@@ -9,13 +9,14 @@ import math
 import logging
 import numpy as np
 
+from copy import copy
 from collections import defaultdict
 from itertools import groupby
 
 from jcvi.formats.base import LineFile, must_open, is_number, get_number
 from jcvi.utils.iter import pairwise
 from jcvi.utils.cbook import SummaryStats, thousands, percentage
-from jcvi.utils.natsort import natsort_key
+from jcvi.utils.natsort import cached_natsort_key
 from jcvi.utils.range import Range, range_union, range_chain, \
             range_distance, range_intersect
 from jcvi.apps.base import OptionParser, ActionDispatcher, sh, \
@@ -31,7 +32,7 @@ class BedLine(object):
     def __init__(self, sline):
         args = sline.strip().split("\t")
         self.nargs = nargs = len(args)
-        self.seqid = args[0]
+        self.seqid = intern(args[0])
         self.start = int(args[1]) + 1
         self.end = int(args[2])
         assert self.start <= self.end, \
@@ -87,14 +88,21 @@ class BedLine(object):
 
 
 class Bed(LineFile):
-
+    """
+    Features are sorted by natural seqid order, start and accn (`nullkey`).
+    Sorting on `nullkey` ranks the distinct seqids once and compares integer
+    ranks; the container remembers that it is sorted until the list is
+    modified, so `sub_beds()` etc. don't sort again. Set `issorted = False`
+    after editing features in place.
+    """
     def __init__(self, filename=None, key=None, sorted=True, juncs=False):
         super(Bed, self).__init__(filename)
 
         # the sorting key provides some flexibility in ordering the features
         # for example, user might not like the lexico-order of seqid
-        self.nullkey = lambda x: (natsort_key(x.seqid), x.start, x.accn)
+        self.nullkey = lambda x: (cached_natsort_key(x.seqid), x.start, x.accn)
         self.key = key or self.nullkey
+        self.issorted = False
 
         if not filename:
             return
@@ -107,6 +115,41 @@ class Bed(LineFile):
         if sorted:
             self.sort(key=self.key)
 
+    def sort(self, key=None, reverse=False):
+        if key is not None and key is not self.nullkey:
+            super(Bed, self).sort(key=key, reverse=reverse)
+            self.issorted = False
+            return
+
+        if self.issorted and not reverse:
+            return
+        seqids = sorted(set(b.seqid for b in self), key=cached_natsort_key)
+        rank = dict((x, i) for i, x in enumerate(seqids))
+        super(Bed, self).sort(key=lambda x: (rank[x.seqid], x.start, x.accn),
+                              reverse=reverse)
+        self.issorted = not reverse
+
+    # Any change to the list invalidates the sorted flag
+    def _unsorted(method):
+        def wrapper(self, *args, **kwargs):
+            self.issorted = False
+            return method(self, *args, **kwargs)
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    append = _unsorted(list.append)
+    extend = _unsorted(list.extend)
+    insert = _unsorted(list.insert)
+    remove = _unsorted(list.remove)
+    pop = _unsorted(list.pop)
+    reverse = _unsorted(list.reverse)
+    __setitem__ = _unsorted(list.__setitem__)
+    __setslice__ = _unsorted(list.__setslice__)
+    __delitem__ = _unsorted(list.__delitem__)
+    __delslice__ = _unsorted(list.__delslice__)
+    __iadd__ = _unsorted(list.__iadd__)
+    del _unsorted
+
     def print_to_file(self, filename="stdout", sorted=False):
         if sorted:
             self.sort(key=self.key)
@@ -189,6 +232,240 @@ class Bed(LineFile):
             yield seqid, ranks[0][1], ranks[-1][1]
 
 
+def accn_keys(accns):
+    """
+    64-bit keys of the accessions, from the head of their md5 digests.
+    """
+    from hashlib import md5
+
+    digests = "".join(md5(x or "").digest()[:8] for x in accns)
+    return np.frombuffer(digests, dtype="<u8")
+
+
+class GeneOrder (object):
+    """
+    Gene order index over a BED file, as arrays cached next to the BED file
+    (`<bedfile>.order.npy`), memory-mapped on load and rebuilt when the BED
+    file is newer. `table` is a single record of contiguous columns: the
+    byte offset, seqid id and start of the features in the Bed() sort order,
+    and the sorted accession keys with the rank each belongs to. Accessions
+    are looked up by binary search on the keys and checked against the BED
+    text, which is memory-mapped as well; seqids map to rank ranges in
+    `seqid_offsets`. No BedLine is built for either, `bed` parses the
+    features on first use.
+
+    The object is a drop-in for `Bed.order`: `accn in order` and
+    `order[accn]` -> (rank, BedLine).
+    """
+    suffix = ".order.npy"
+    dtype = [("offset", "<i8"), ("seqid", "<i4"), ("start", "<i8"),
+             ("key", "<u8"), ("keyrank", "<i4")]
+    names = tuple(name for name, t in dtype)
+
+    def __init__(self, filename, cache=True):
+        self.filename = filename
+        self.mtime = op.getmtime(filename)
+        self.data = self.map(filename)
+        self._bed = self._seqid_offsets = None
+        self._ranks = {}
+        cachefile = filename + self.suffix
+        self.table = None
+        if cache and not need_update(filename, cachefile):
+            self.table = np.load(cachefile, mmap_mode="r")
+            if self.table.dtype.names != self.names:  # Older layout
+                self.table = None
+            else:
+                logging.debug("Load gene order index from `{0}`.".\
+                              format(cachefile))
+
+        if self.table is None:
+            self.table, self._bed = self.build(self.data, filename)
+            if cache:
+                try:
+                    np.save(cachefile, self.table)
+                    logging.debug("Gene order index written to `{0}`.".\
+                                  format(cachefile))
+                except (IOError, OSError):
+                    logging.debug("Cannot write `{0}`.".format(cachefile))
+
+        # Plain views of the mapped columns, cheaper to index than memmaps
+        self.offsets = np.asarray(self.table["offset"])
+        self.keys = np.asarray(self.table["key"])
+        self.keyranks = np.asarray(self.table["keyrank"])
+
+    @classmethod
+    def map(cls, filename):
+        """
+        The BED text, memory-mapped unless it is compressed or empty.
+        """
+        import mmap
+
+        fp = must_open(filename)
+        try:
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            return fp.read()
+
+    @classmethod
+    def build(cls, data, filename=None):
+        """
+        Sort the features, returns the index table and the sorted Bed.
+        """
+        items, offset = [], 0
+        for row in data[:].split("\n"):
+            if row and row[0] != "#":
+                items.append((BedLine(row), offset))
+            offset += len(row) + 1
+        seqids = sorted(set(b.seqid for b, o in items), key=cached_natsort_key)
+        rank = dict((x, i) for i, x in enumerate(seqids))
+        items.sort(key=lambda (b, o): (rank[b.seqid], b.start, b.accn))
+
+        n = len(items)
+        table = np.zeros((), dtype=[(name, t, (n,)) for name, t in cls.dtype])
+        table["offset"] = [o for b, o in items]
+        table["seqid"] = [rank[b.seqid] for b, o in items]
+        table["start"] = [b.start for b, o in items]
+        keys = accn_keys(b.accn for b, o in items)
+        order = np.lexsort((np.arange(len(keys)), keys))
+        table["key"] = keys[order]
+        table["keyrank"] = order
+
+        bed = Bed()
+        bed.filename = filename
+        bed[:] = [b for b, o in items]
+        bed.issorted = True
+        return table, bed
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, accn):
+        return self.find(accn) is not None
+
+    def __getitem__(self, accn):
+        i = self.rank(accn)
+        return i, self.bedline(i)
+
+    def __iter__(self):
+        seen = set()
+        for i in xrange(len(self)):
+            accn = self.accn_at(i)
+            if accn not in seen:
+                seen.add(accn)
+                yield accn
+
+    def get(self, accn, default=None):
+        i = self.find(accn)
+        return default if i is None else (i, self.bedline(i))
+
+    def line_at(self, offset):
+        e = self.data.find("\n", offset)
+        return self.data[offset: e] if e >= 0 else self.data[offset:]
+
+    def line(self, i):
+        return self.line_at(int(self.offsets[i]))
+
+    def accn_at(self, i):
+        args = self.line(i).strip().split("\t")
+        return args[3] if len(args) > 3 else None
+
+    def bedline(self, i):
+        return self._bed[i] if self._bed is not None \
+                    else BedLine(self.line(i))
+
+    def find(self, accn, key=None, i=None):
+        """
+        Rank of the accession, or None. Equal keys sit next to each other;
+        for duplicate accessions the last feature wins, as in `Bed.order`.
+        """
+        if accn in self._ranks:
+            return self._ranks[accn]
+
+        keys = self.keys
+        if key is None:
+            key = accn_keys([accn])[0]
+            i = keys.searchsorted(key)
+        found = None
+        while i < len(keys) and keys[i] == key:
+            r = int(self.keyranks[i])
+            if self.accn_at(r) == accn:
+                found = r
+            i += 1
+        self._ranks[accn] = found
+        return found
+
+    def rank(self, accn):
+        i = self.find(accn)
+        if i is None:
+            raise KeyError(accn)
+        return i
+
+    def ranks(self, accns, missing=-1):
+        """
+        Ranks for many accessions at once, `missing` for unknown ones.
+        """
+        accns = list(accns)
+        keys = accn_keys(accns)
+        idx = self.keys.searchsorted(keys)
+        ranks = np.empty(len(accns), dtype=int)
+        for j, (accn, key, i) in enumerate(zip(accns, keys, idx)):
+            r = self.find(accn, key=key, i=i)
+            ranks[j] = missing if r is None else r
+        return ranks
+
+    @property
+    def seqid_offsets(self):
+        """
+        Ordered dictionary of seqid -> (first rank, last rank + 1).
+        """
+        from collections import OrderedDict
+
+        if self._seqid_offsets is None:
+            seqids = self.table["seqid"]
+            nseqids = int(seqids[-1]) + 1 if len(seqids) else 0
+            bounds = seqids.searchsorted(np.arange(nseqids + 1)).tolist()
+            self._seqid_offsets = OrderedDict(
+                    (self.line(a).strip().split("\t")[0], (a, b))
+                    for a, b in pairwise(bounds))
+        return self._seqid_offsets
+
+    @property
+    def bed(self):
+        """
+        The features as a sorted Bed, materialized on first use without
+        resorting.
+        """
+        if self._bed is None:
+            bed = Bed()
+            bed.filename = self.filename
+            bed[:] = [BedLine(self.line_at(o)) \
+                        for o in self.offsets.tolist()]
+            bed.issorted = True
+            self._bed = bed
+        return self._bed
+
+
+GeneOrders = {}
+
+
+def get_gene_order(filename, cache=True):
+    """
+    Load the GeneOrder index once per process for a given BED file. Copies
+    share the arrays and the lookups made so far, but each call gets its own
+    Bed, since callers may modify the features in place.
+    """
+    go = GeneOrders.get(filename)
+    if go is None or go.mtime != op.getmtime(filename):
+        go = GeneOrder(filename, cache=cache)
+        GeneOrders[filename] = stored = copy(go)
+        stored._bed = None
+        return go
+
+    go = copy(go)
+    go._bed = None
+    return go
+
+
 class BedEvaluate (object):
 
     def __init__(self, TPbed, FPbed, FNbed, TNbed):
@@ -707,26 +984,227 @@ def uniq(args):
     return uniqbedfile
 
 
-def subtractbins(binfile1, binfile2):
-    from jcvi.graphics.landscape import BinFile
-
-    abin = BinFile(binfile1)
-    bbin = BinFile(binfile2)
+def read_intervals(bedfile, scores=False):
+    """
+    Features of a bed file per seqid, as arrays of 0-based starts, ends and
+    (if `scores`) the score column.
+    """
+    data = defaultdict(list)
+    for row in must_open(bedfile):
+        if row[0] == "#" or row.startswith("track"):
+            continue
+        args = row.split("\t", 5)
+        rec = [int(args[1]), int(args[2])]
+        if scores:
+            rec.append(float(args[4]))
+        data[args[0]].append(rec)
 
-    assert len(abin) == len(bbin)
+    intervals = {}
+    for seqid, recs in data.items():
+        a = np.array(recs, dtype=float if scores else int)
+        starts, ends = a[:, 0].astype(int), a[:, 1].astype(int)
+        intervals[seqid] = (starts, ends, a[:, 2] if scores else None)
+    return intervals
 
-    fw = open(binfile1, "w")
 
-    for a, b in zip(abin, bbin):
-        assert a.chr == b.chr
-        assert a.binlen == b.binlen
+def merge_intervals(starts, ends, scores=None):
+    """
+    Merge overlapping or book-ended intervals (same as mergeBed), scores are
+    the median within each merged interval.
+
+    >>> starts, ends = np.array([30, 0, 10, 50]), np.array([40, 15, 20, 60])
+    >>> [x.tolist() for x in merge_intervals(starts, ends)[:2]]
+    [[0, 30, 50], [20, 40, 60]]
+    >>> merge_intervals(starts, ends, np.array([1., 2., 4., 3.]))[2].tolist()
+    [3.0, 1.0, 3.0]
+    """
+    if not len(starts):
+        return starts, ends, scores
+
+    order = np.lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > reach[:-1]
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(starts)) - 1
+    mstarts, mends = starts[first], reach[last]
+    if scores is None:
+        return mstarts, mends, None
+
+    group = np.cumsum(new) - 1
+    s = scores[order][np.lexsort((scores[order], group))]
+    n = last - first + 1
+    return mstarts, mends, (s[first + (n - 1) / 2] + s[first + n / 2]) / 2
+
+
+def subtract_intervals(starts, ends, sstarts, sends, scores=None):
+    """
+    Remove bases covered by the second set of intervals, both merged and
+    sorted. Split pieces keep the score of their interval (same as
+    intersectBed against the complement).
+
+    >>> starts, ends = np.array([0, 50]), np.array([40, 60])
+    >>> pieces = subtract_intervals(starts, ends, np.array([10, 45]),
+    ...                             np.array([20, 70]), np.array([1., 2.]))
+    >>> [x.tolist() for x in pieces]
+    [[0, 20], [10, 40], [1.0, 1.0]]
+    >>> [x.tolist() for x in subtract_intervals(np.array([10]),
+    ...                 np.array([20]), np.array([0]), np.array([30]))[:2]]
+    [[], []]
+    """
+    if not len(starts) or not len(sstarts):
+        return starts, ends, scores
+
+    points = np.unique(np.concatenate((starts, ends, sstarts, sends)))
+    a, b = points[:-1], points[1:]
+    i = np.searchsorted(starts, a, side="right") - 1
+    j = np.searchsorted(sstarts, a, side="right") - 1
+    keep = (i >= 0) & (ends[np.maximum(i, 0)] > a)
+    keep &= (j < 0) | (sends[np.maximum(j, 0)] <= a)
+    a, b, i = a[keep], b[keep], i[keep]
+    if not len(a):  # All masked
+        return a, b, None if scores is None else scores[:0]
+
+    # Rejoin adjacent pieces of the same interval
+    new = np.ones(len(a), dtype=bool)
+    new[1:] = (a[1:] != b[:-1]) | (i[1:] != i[:-1])
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(a)) - 1
+    i = i[first]
+    return a[first], b[last], None if scores is None else scores[i]
+
+
+def bin_intervals(starts, ends, size, binsize, mode="span", scores=None):
+    """
+    Accumulate intervals into consecutive windows of a sequence of `size`,
+    either bases covered (span), number of features overlapping (count) or
+    sum of their scores (score).
+
+    >>> starts, ends = np.array([5, 95]), np.array([15, 250])
+    >>> bin_intervals(starts, ends, 210, 100).tolist()
+    [15.0, 100.0, 10.0]
+    >>> bin_intervals(starts, ends, 210, 100, mode="count").tolist()
+    [2, 1, 1]
+    >>> bin_intervals(starts[:0], ends[:0], 210, 100).tolist()
+    [0.0, 0.0, 0.0]
+    """
+    nbins = (size + binsize - 1) / binsize
+    values = np.zeros(nbins, dtype=int if mode == "count" else float)
+    ok = (starts < size) & (ends > starts)
+    starts, ends = starts[ok], np.minimum(ends[ok], size)
+    if not len(starts):
+        return values
+
+    # One entry for every (interval, bin) overlap
+    sb = starts / binsize
+    nb = (ends - 1) / binsize - sb + 1
+    total = nb.sum()
+    offsets = np.repeat(np.cumsum(nb) - nb, nb)
+    idx = np.repeat(sb, nb) + np.arange(total) - offsets
+
+    if mode == "span":
+        lo = np.maximum(np.repeat(starts, nb), idx * binsize)
+        hi = np.minimum(np.repeat(ends, nb), (idx + 1) * binsize)
+        np.add.at(values, idx, hi - lo)
+    elif mode == "score":
+        np.add.at(values, idx, np.repeat(scores[ok], nb))
+    else:
+        np.add.at(values, idx, 1)
 
-        a.subtract(b)
-        print >> fw, a
+    return values
 
-    fw.close()
 
-    return binfile1
+class Bins (object):
+    """
+    Feature span/count/score and number of bases in consecutive windows of
+    `binsize`, as arrays per seqid in `mapping`. Results are cached in an .npz
+    file next to the bedfile, named after the bedfile and fastafile, and
+    recomputed when any of the inputs change. With `subtract`, masked bases
+    are removed from the features; the bases column stays the window size.
+    """
+    version = 2  # Part of the cache key, bump when the arrays change
+
+    def __init__(self, bedfile, fastafile, binsize=100000, mode="span",
+                 subtract=None):
+        self.filename = bedfile
+        self.binsize = binsize
+        self.mode = mode
+        self.subtract = subtract
+
+        fastapf = op.basename(fastafile).rsplit(".", 1)[0]
+        pf = "{0}.{1}.{2}.{3}".format(bedfile, fastapf, binsize, mode)
+        if subtract:
+            pf += ".{0}".format(op.basename(subtract).rsplit(".", 1)[0])
+        self.npzfile = pf + ".npz"
+        self.key = str((self.version, bedfile, fastafile, binsize, mode,
+                        subtract))
+
+        deps = [bedfile, fastafile] + ([subtract] if subtract else [])
+        if not need_update(deps, self.npzfile) and self.load():
+            return
+        self.compute(fastafile)
+        self.save()
+
+    def compute(self, fastafile):
+        from collections import OrderedDict
+        from jcvi.formats.sizes import Sizes
+
+        binsize, mode = self.binsize, self.mode
+        sizes = Sizes(fastafile).mapping
+        intervals = read_intervals(self.filename, scores=(mode == "score"))
+        masked = read_intervals(self.subtract) if self.subtract else {}
+
+        self.mapping = OrderedDict()
+        empty = np.zeros(0, dtype=int)
+        for seqid, size in sorted(sizes.items()):
+            starts, ends, scores = intervals.get(seqid, (empty, empty, None))
+            starts, ends, scores = merge_intervals(starts, ends, scores)
+            bases = np.zeros((size + binsize - 1) / binsize, dtype=int)
+            bases[:] = binsize
+            if len(bases):
+                bases[-1] = size - (len(bases) - 1) * binsize
+
+            if seqid in masked:
+                sstarts, sends, _ = merge_intervals(*masked[seqid])
+                starts, ends, scores = subtract_intervals(starts, ends,
+                                                    sstarts, sends, scores)
+
+            values = bin_intervals(starts, ends, size, binsize,
+                                   mode=mode, scores=scores)
+            self.mapping[seqid] = (values, bases)
+
+    def load(self):
+        from collections import OrderedDict
+
+        data = np.load(self.npzfile)
+        if str(data["key"]) != self.key:
+            return False
+
+        self.mapping = OrderedDict()
+        offsets = data["offsets"]
+        values, bases = data["values"], data["bases"]
+        for seqid, a, b in zip(data["seqids"], offsets[:-1], offsets[1:]):
+            self.mapping[str(seqid)] = (values[a:b], bases[a:b])
+        logging.debug("Bins loaded from `{0}`".format(self.npzfile))
+        return True
+
+    def save(self):
+        seqids = self.mapping.keys()
+        values = [v for v, b in self.mapping.values()]
+        offsets = np.cumsum([0] + [len(v) for v in values])
+        np.savez(self.npzfile, key=np.array(self.key),
+                 seqids=np.array(seqids), offsets=offsets,
+                 values=np.concatenate(values),
+                 bases=np.concatenate([b for v, b in self.mapping.values()]))
+        logging.debug("Bins saved to `{0}`".format(self.npzfile))
+
+    def print_to_file(self, filename="stdout"):
+        fw = must_open(filename, "w")
+        for seqid, (values, bases) in self.mapping.items():
+            for xa, xb in zip(values, bases):
+                print >> fw, "\t".join(str(x) for x in (seqid, xa, xb))
+        fw.close()
 
 
 def bins(args):
@@ -736,10 +1214,6 @@ def bins(args):
     Bin bed lengths into each consecutive window. Use --subtract to remove bases
     from window, e.g. --subtract gaps.bed ignores the gap sequences.
     """
-    import numpy as np
-
-    from jcvi.formats.sizes import Sizes
-
     p = OptionParser(bins.__doc__)
     p.add_option("--binsize", default=100000, type="int",
                  help="Size of the bins [default: %default]")
@@ -764,70 +1238,9 @@ def bins(args):
     if not need_update(bedfile, binfile):
         return binfile
 
-    sz = Sizes(fastafile)
-    sizesfile = sz.filename
-    sizes = sz.mapping
-    fw = open(binfile, "w")
-    scores = "median" if mode == "score" else None
-    bedfile = mergeBed(bedfile, nms=True, scores=scores)
-    if subtract:
-        subtractmerge = mergeBed(subtract)
-        subtract_complement = complementBed(subtractmerge, sizesfile)
-        bedfile = intersectBed(bedfile, subtract_complement)
-
-    bedfile = sort([bedfile, "-i"])
-
-    bed = Bed(bedfile)
-    sbdict = dict(bed.sub_beds())
-    for chr, chr_len in sorted(sizes.items()):
-        chr_len = sizes[chr]
-        subbeds = sbdict.get(chr, [])
-        nbins = chr_len / binsize
-        last_bin = chr_len % binsize
-        if last_bin:
-            nbins += 1
-
-        a = np.zeros(nbins)  # values
-        b = np.zeros(nbins, dtype="int")  # bases
-        c = np.zeros(nbins, dtype="int")  # count
-        b[:-1] = binsize
-        b[-1] = last_bin
-
-        for bb in subbeds:
-
-            start, end = bb.start, bb.end
-            startbin = start / binsize
-            endbin = end / binsize
-
-            assert startbin <= endbin
-            c[startbin:endbin + 1] += 1
-
-            if mode == "score":
-                a[startbin:endbin + 1] += float(bb.score)
-
-            elif mode == "span":
-                if startbin == endbin:
-                    a[startbin] += end - start + 1
-
-                if startbin < endbin:
-                    firstsize = (startbin + 1) * binsize - start + 1
-                    lastsize = end - endbin * binsize
-                    a[startbin] += firstsize
-                    if startbin + 1 < endbin:
-                        a[startbin + 1:endbin] += binsize
-                    a[endbin] += lastsize
-
-        if mode == "count":
-            a = c
-
-        for xa, xb in zip(a, b):
-            print >> fw, "\t".join(str(x) for x in (chr, xa, xb))
-
-    fw.close()
-
-    if subtract:
-        subtractbinfile = bins([subtract, fastafile, "--binsize={0}".format(binsize)])
-        binfile = subtractbins(binfile, subtractbinfile)
+    bb = Bins(bedfile, fastafile, binsize=binsize, mode=mode,
+              subtract=subtract)
+    bb.print_to_file(binfile)
 
     return binfile
 
@@ -1259,6 +1672,132 @@ def sizes(args):
     return sizesfile
 
 
+Orientations = ("++", "+-", "-+", "--")
+
+
+class MatePairs (object):
+    """
+    Reads from BED rows paired up by their names, after the last `rclip` chars
+    are trimmed. Trimmed names are hashed to integer pair ids, ranked in name
+    order, and a stable argsort on the ids puts the two reads of a pair next to
+    each other. Names seen once or more than twice count as fragments.
+
+    Columns of read a and read b are kept as arrays, seqids are coded as
+    indices into `seqids`.
+    """
+    def __init__(self, rows, rclip=1, keeplines=False):
+        seqidx, pids = {}, {}
+        sid, pid, starts, ends, minus, accns, lines = [], [], [], [], [], [], []
+        for row in rows:
+            if row[0] == "#":
+                continue
+            atoms = row.strip().split("\t")
+            accn = atoms[3]
+            name = accn[:-rclip] if rclip else accn
+            pid.append(pids.setdefault(name, len(pids)))
+            sid.append(seqidx.setdefault(atoms[0], len(seqidx)))
+            starts.append(int(atoms[1]) + 1)
+            ends.append(int(atoms[2]))
+            minus.append(len(atoms) > 5 and atoms[5] == '-')
+            accns.append(accn)
+            if keeplines:
+                lines.append(row.strip())
+
+        self.seqids = sorted(seqidx, key=seqidx.get)
+
+        # Rank the ids in name order
+        rank = np.empty(len(pids), dtype=int)
+        for i, name in enumerate(sorted(pids)):
+            rank[pids[name]] = i
+        pid = rank[np.array(pid, dtype=int)]
+
+        order = np.argsort(pid, kind="mergesort")
+        spid = pid[order]
+        n = len(spid)
+        boundary = np.ones(n, dtype=bool)
+        boundary[1:] = spid[1:] != spid[:-1]
+        gstarts = np.flatnonzero(boundary)
+        sizes = np.diff(np.append(gstarts, n))
+        ispair = sizes == 2
+        self.nfragments = int(sizes[~ispair].sum())
+
+        ia = order[gstarts[ispair]]
+        ib = order[gstarts[ispair] + 1]
+        self.npairs = len(ia)
+
+        sid, starts, ends = np.array(sid, dtype=int), \
+                np.array(starts, dtype=int), np.array(ends, dtype=int)
+        minus = np.array(minus, dtype=bool)
+        accns = np.array(accns, dtype=object)
+        self.aseqid, self.bseqid = sid[ia], sid[ib]
+        self.astart, self.bstart = starts[ia], starts[ib]
+        self.aend, self.bend = ends[ia], ends[ib]
+        self.aminus, self.bminus = minus[ia], minus[ib]
+        self.aaccn, self.baccn = accns[ia], accns[ib]
+        if keeplines:
+            lines = np.array(lines, dtype=object)
+            self.alines, self.blines = lines[ia], lines[ib]
+
+    def distances(self, distmode="ss"):
+        """
+        Vectorized `range_distance()` over all pairs. Returns distances (-1
+        across seqids) and orientations as indices into `Orientations`.
+        """
+        assert distmode in ("ss", "ee")
+
+        swap = self.astart > self.bstart
+        amin = np.where(swap, self.bstart, self.astart)
+        amax = np.where(swap, self.bend, self.aend)
+        bmin = np.where(swap, self.astart, self.bstart)
+        bmax = np.where(swap, self.aend, self.bend)
+        if distmode == "ss":
+            dists = bmax - amin + 1
+        else:
+            dists = bmin - amax - 1
+        dists[self.aseqid != self.bseqid] = -1
+
+        aminus = np.where(swap, self.bminus, self.aminus)
+        bminus = np.where(swap, self.aminus, self.bminus)
+        orientations = 2 * aminus.astype(int) + bminus.astype(int)
+
+        return dists, orientations
+
+
+def iter_mate_pairs(bedfile, rclip=1, nrows=None, blocksize=1000000):
+    """
+    Stream `MatePairs` from a BED file sorted by read names in blocks of about
+    `blocksize` rows. Reads with the same name as the last read of a block are
+    held back for the next block, so that pairs are never split.
+    """
+    def key(row):
+        accn = row.split("\t", 4)[3].rstrip("\r\n")
+        return accn[:-rclip] if rclip else accn
+
+    rows = []
+    fp = must_open(bedfile)
+    for i, row in enumerate(fp):
+        if nrows is not None and i >= nrows:
+            break
+        if row[0] == "#":
+            continue
+        rows.append(row)
+        if len(rows) < blocksize:
+            continue
+
+        name = key(rows[-1])
+        j = len(rows) - 1
+        while j > 0 and key(rows[j - 1]) == name:
+            j -= 1
+        if j == 0:
+            continue
+
+        yield MatePairs(rows[:j], rclip=rclip)
+        rows = rows[j:]
+
+    if rows:
+        yield MatePairs(rows, rclip=rclip)
+
+
 def analyze_dists(dists, cutoff=1000, alpha=.1):
     """
     The dists can show bimodal distribution if they come from a mate-pair
@@ -1266,8 +1805,9 @@ def analyze_dists(dists, cutoff=1000, alpha=.1):
     on the percentage in each peak, we can decide if it is indeed one peak or
     two peaks, and report the median respectively.
     """
-    peak0 = [d for d in dists if d < cutoff]
-    peak1 = [d for d in dists if d >= cutoff]
+    dists = np.asarray(dists)
+    peak0 = dists[dists < cutoff]
+    peak1 = dists[dists >= cutoff]
     c0, c1 = len(peak0), len(peak1)
     logging.debug("Component counts: {0} {1}".format(c0, c1))
     if c0 == 0 or c1 == 0 or float(c1) / len(dists) < alpha:
@@ -1284,79 +1824,61 @@ def analyze_dists(dists, cutoff=1000, alpha=.1):
 
 
 def report_pairs(data, cutoff=0, mateorientation=None,
-        pairsfile=None, insertsfile=None, rclip=1, ascii=False, bins=20,
+        pairsfile=None, insertsfile=None, ascii=False, bins=20,
         distmode="ss", mpcutoff=1000):
     """
     This subroutine is used by the pairs function in blast.py and cas.py.
-    Reports number of fragments and pairs as well as linked pairs
+    Reports number of fragments and pairs as well as linked pairs. `data` is a
+    `MatePairs`, or an iterable of them such as `iter_mate_pairs()`.
     """
-    allowed_mateorientations = ("++", "--", "+-", "-+")
-
     if mateorientation:
-        assert mateorientation in allowed_mateorientations
+        assert mateorientation in Orientations
 
-    num_fragments, num_pairs = 0, 0
+    if isinstance(data, MatePairs):
+        data = [data]
 
-    all_dist = []
-    linked_dist = []
+    num_fragments, num_pairs = 0, 0
     # +- (forward-backward) is `innie`, -+ (backward-forward) is `outie`
-    orientations = defaultdict(int)
-
-    # clip how many chars from end of the read name to get pair name
-    key = (lambda x: x.accn[:-rclip]) if rclip else (lambda x: x.accn)
-    data.sort(key=key)
-
-    if pairsfile:
-        pairsfw = open(pairsfile, "w")
-    if insertsfile:
-        insertsfw = open(insertsfile, "w")
-
-    for pe, lines in groupby(data, key=key):
-        lines = list(lines)
-        if len(lines) != 2:
-            num_fragments += len(lines)
-            continue
-
-        num_pairs += 1
-        a, b = lines
-
-        asubject, astart, astop = a.seqid, a.start, a.end
-        bsubject, bstart, bstop = b.seqid, b.start, b.end
-
-        aquery, bquery = a.accn, b.accn
-        astrand, bstrand = a.strand, b.strand
-
-        dist, orientation = range_distance(\
-                (asubject, astart, astop, astrand),
-                (bsubject, bstart, bstop, bstrand),
-                distmode=distmode)
-
-        if dist >= 0:
-            all_dist.append((dist, orientation, aquery, bquery))
+    all_dists, all_orientations, aqueries, bqueries = [], [], [], []
+    for mp in data:
+        num_fragments += mp.nfragments
+        num_pairs += mp.npairs
+
+        dists, orientations = mp.distances(distmode=distmode)
+        keep = dists >= 0
+        # select only pairs with certain orientations - e.g. innies, outies, etc.
+        if mateorientation:
+            keep &= orientations == Orientations.index(mateorientation)
+
+        all_dists.append(dists[keep])
+        all_orientations.append(orientations[keep])
+        if pairsfile:
+            aqueries.append(mp.aaccn[keep])
+            bqueries.append(mp.baccn[keep])
 
-    # select only pairs with certain orientations - e.g. innies, outies, etc.
-    if mateorientation:
-        all_dist = [x for x in all_dist if x[1] == mateorientation]
+    dists = np.concatenate(all_dists or [np.zeros(0, dtype=int)])
+    orientations = np.concatenate(all_orientations or [np.zeros(0, dtype=int)])
 
     # try to infer cutoff as twice the median until convergence
     if cutoff <= 0:
-        dists = np.array([x[0] for x in all_dist], dtype="int")
         p0 = analyze_dists(dists, cutoff=mpcutoff)
         cutoff = int(2 * p0)  # initial estimate
         cutoff = int(math.ceil(cutoff / bins)) * bins
         logging.debug("Insert size cutoff set to {0}, ".format(cutoff) +
             "use '--cutoff' to override")
 
-    for dist, orientation, aquery, bquery in all_dist:
-        if dist > cutoff:
-            continue
-        if cutoff > 2 * mpcutoff and dist < mpcutoff:
-            continue
+    linked = dists <= cutoff
+    if cutoff > 2 * mpcutoff:
+        linked &= dists >= mpcutoff
+    linked_dist = dists[linked]
 
-        linked_dist.append(dist)
-        if pairsfile:
+    if pairsfile:
+        pairsfw = open(pairsfile, "w")
+        aqueries = np.concatenate(aqueries)[linked]
+        bqueries = np.concatenate(bqueries)[linked]
+        for aquery, bquery, dist in zip(aqueries, bqueries, linked_dist):
             print >> pairsfw, "{0}\t{1}\t{2}".format(aquery, bquery, dist)
-        orientations[orientation] += 1
+        pairsfw.close()
 
     print >>sys.stderr, "{0} fragments, {1} pairs ({2} total)".\
                 format(num_fragments, num_pairs, num_fragments + num_pairs * 2)
@@ -1376,7 +1898,10 @@ def report_pairs(data, cutoff=0, mateorientation=None,
     print >>sys.stderr, "\nOrientations:"
 
     orientation_summary = []
-    for orientation, count in sorted(orientations.items()):
+    counts = np.bincount(orientations[linked], minlength=len(Orientations))
+    for orientation, count in sorted(zip(Orientations, counts)):
+        if not count:
+            continue
         o = "{0}:{1}".format(orientation, \
                 percentage(count, num_links, mode=1))
         orientation_summary.append(o.split()[0])
@@ -1385,6 +1910,7 @@ def report_pairs(data, cutoff=0, mateorientation=None,
     if insertsfile:
         from jcvi.graphics.histogram import histogram
 
+        insertsfw = open(insertsfile, "w")
         print >>insertsfw, "\n".join(str(x) for x in linked_dist)
         insertsfw.close()
         prefix = insertsfile.rsplit(".", 1)[0]
@@ -1422,14 +1948,12 @@ def pairs(args):
     else:
         bedfile = sortedbedfile
 
-    fp = open(bedfile)
-    data = [BedLine(row) for i, row in enumerate(fp) if i < opts.nrows]
+    data = iter_mate_pairs(bedfile, rclip=opts.rclip, nrows=opts.nrows)
 
     ascii = not opts.pdf
     return bedfile, report_pairs(data, opts.cutoff, opts.mateorientation,
            pairsfile=opts.pairsfile, insertsfile=insertsfile,
-           rclip=opts.rclip, ascii=ascii, bins=opts.bins,
-           distmode=opts.distmode)
+           ascii=ascii, bins=opts.bins, distmode=opts.distmode)
 
 
 def summary(args):
@@ -1537,8 +2061,7 @@ def mates(args):
     bedfile, = args
     rclip = opts.rclip
 
-    key = (lambda x: x.accn[:-rclip]) if rclip else (lambda x: x.accn)
-    bed = Bed(bedfile, key=key)
+    mp = MatePairs(must_open(bedfile), rclip=rclip, keeplines=True)
 
     pf = bedfile.rsplit(".", 1)[0]
     matesfile = pf + ".mates"
@@ -1554,36 +2077,31 @@ def mates(args):
         print >> fw, "\t".join(str(x) for x in \
                 ("library", pf, mindist, maxdist))
 
-    num_fragments = num_pairs = 0
-    matesbedfile = matesfile + ".bed"
-    fwm = open(matesbedfile, "w")
-    for pe, lines in groupby(bed, key=key):
-        lines = list(lines)
-        if len(lines) != 2:
-            num_fragments += len(lines)
-            continue
-
-        a, b = lines
+    keep = np.ones(mp.npairs, dtype=bool)
+    if opts.nointra:
+        keep &= mp.aseqid != mp.bseqid
 
-        if opts.nointra and a.seqid == b.seqid:
-            continue
-
-        # Use --prefix to limit the links between seqids with the same prefix
-        # For example, contigs of the same BAC, mth2-23j10_001, mth-23j10_002
-        if opts.prefix:
-            aprefix = a.seqid.split("_")[0]
-            bprefix = b.seqid.split("_")[0]
-            if aprefix != bprefix:
-                continue
+    # Use --prefix to limit the links between seqids with the same prefix
+    # For example, contigs of the same BAC, mth2-23j10_001, mth-23j10_002
+    if opts.prefix:
+        prefixes = {}
+        prefix = np.array([prefixes.setdefault(x.split("_")[0], len(prefixes)) \
+                            for x in mp.seqids], dtype=int)
+        keep &= prefix[mp.aseqid] == prefix[mp.bseqid]
 
+    num_fragments = mp.nfragments
+    num_pairs = 0
+    matesbedfile = matesfile + ".bed"
+    fwm = open(matesbedfile, "w")
+    for i in np.flatnonzero(keep):
         num_pairs += 1
-        pair = [a.accn, b.accn]
+        pair = [mp.aaccn[i], mp.baccn[i]]
         if lib:
             pair.append(lib)
         print >> fw, "\t".join(pair)
 
-        print >> fwm, a
-        print >> fwm, b
+        print >> fwm, mp.alines[i]
+        print >> fwm, mp.blines[i]
 
     logging.debug("Discard {0} frags and write {1} pairs to `{2}` and `{3}`.".\
             format(num_fragments, num_pairs, matesfile, matesbedfile))
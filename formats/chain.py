@@ -24,9 +24,12 @@ alignment size of the last block.
 
 import os.path as op
 import sys
+import string
 import logging
 
-from jcvi.formats.base import BaseFile, read_block
+import numpy as np
+
+from jcvi.formats.base import BaseFile, read_block, must_open
 from jcvi.apps.base import OptionParser, ActionDispatcher, sh, need_update, \
             which
 
@@ -75,6 +78,233 @@ class Chain (BaseFile):
             yield ChainLine(chain, lines)
 
 
+class LiftOver (object):
+    """
+    Coordinate mapping compiled into sorted block arrays per source seqid,
+    from AGP (component => object) or chain (target => query) files.
+    Coordinates are 0-based half-open. Intervals are mapped in batches with
+    binary search, and intervals spanning several blocks are split.
+    """
+    complement = string.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+    def __init__(self):
+        self.raw = {}     # source seqid => list of blocks
+        self.blocks = {}  # source seqid => sorted arrays
+
+    @classmethod
+    def from_agp(cls, agpfile):
+        from jcvi.formats.agp import AGP
+
+        lo = cls()
+        for a in AGP(agpfile):
+            if a.is_gap:
+                continue
+            strand = -1 if a.orientation == '-' else 1
+            lo.add(a.component_id, a.component_beg - 1, a.component_end,
+                   a.object, a.object_beg - 1, strand)
+        lo.compile()
+        return lo
+
+    @classmethod
+    def from_chain(cls, chainfile):
+        lo = cls()
+        fp = must_open(chainfile)
+        for row in fp:
+            atoms = row.split()
+            if not atoms or row[0] == '#':
+                continue
+            if atoms[0] == "chain":
+                tName, tStart = atoms[2], int(atoms[5])
+                qName, qSize, qStrand, qStart = atoms[7], int(atoms[8]), \
+                                                atoms[9], int(atoms[10])
+                tp, qp = tStart, qStart
+                continue
+            size = int(atoms[0])
+            if qStrand == '-':
+                lo.add(tName, tp, tp + size, qName, qSize - qp - size, -1)
+            else:
+                lo.add(tName, tp, tp + size, qName, qp, 1)
+            if len(atoms) == 3:
+                tp += size + int(atoms[1])
+                qp += size + int(atoms[2])
+        fp.close()
+        lo.compile()
+        return lo
+
+    @classmethod
+    def from_file(cls, filename):
+        if filename.endswith(".agp"):
+            return cls.from_agp(filename)
+        return cls.from_chain(filename)
+
+    def add(self, src, start, end, dst, dst_start, strand):
+        self.raw.setdefault(src, []).append((start, end, dst, dst_start,
+                                             strand))
+
+    def compile(self):
+        for src, blocks in self.raw.items():
+            blocks.sort()
+            start, end, dst, dst_start, strand = zip(*blocks)
+            end = np.array(end, dtype=np.int64)
+            self.blocks[src] = (np.array(start, dtype=np.int64), end,
+                                np.maximum.accumulate(end),
+                                np.array(dst, dtype=object),
+                                np.array(dst_start, dtype=np.int64),
+                                np.array(strand, dtype=int))
+        self.raw = {}
+        logging.debug("Compiled {0} blocks on {1} source seqids.".\
+                      format(sum(len(x[0]) for x in self.blocks.values()),
+                             len(self.blocks)))
+
+    def __contains__(self, seqid):
+        return seqid in self.blocks
+
+    def map_seqid(self, seqid, starts, ends):
+        """
+        Map intervals on one source seqid. Returns the input index of each
+        mapped piece, with the destination seqid, start, end and strand.
+        """
+        bs, be, maxend, bd, bds, bst = self.blocks[seqid]
+        first = np.searchsorted(maxend, starts, side="right")
+        last = np.searchsorted(bs, ends, side="left") - 1
+        n = np.maximum(last - first + 1, 0)
+        idx = np.repeat(np.arange(len(starts)), n)
+        blk = np.repeat(first, n) + np.arange(n.sum()) - \
+              np.repeat(np.cumsum(n) - n, n)
+        cs = np.maximum(starts[idx], bs[blk])
+        ce = np.minimum(ends[idx], be[blk])
+        ok = cs < ce  # Only needed if blocks overlap on the source
+        idx, blk, cs, ce = idx[ok], blk[ok], cs[ok], ce[ok]
+        strand = bst[blk]
+        ds = np.where(strand > 0, bds[blk] + cs - bs[blk],
+                                  bds[blk] + be[blk] - ce)
+        return idx, bd[blk], ds, ds + (ce - cs), strand
+
+    def map(self, seqids, starts, ends):
+        """
+        Map intervals on many seqids, results are in input order. Inputs on
+        unknown seqids or outside all blocks are absent from the results.
+        """
+        seqids = np.asarray(seqids, dtype=object)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        results = []
+        for seqid in set(seqids):
+            if seqid not in self.blocks:
+                continue
+            where = np.flatnonzero(seqids == seqid)
+            idx, dst, ds, de, strand = self.map_seqid(seqid, starts[where],
+                                                      ends[where])
+            results.append((where[idx], dst, ds, de, strand))
+        if not results:
+            empty = np.array([], dtype=np.int64)
+            return empty, np.array([], dtype=object), empty, empty, empty
+        idx, dst, ds, de, strand = [np.concatenate(x) for x in zip(*results)]
+        order = np.argsort(idx, kind="mergesort")
+        return idx[order], dst[order], ds[order], de[order], strand[order]
+
+    def revcomp(self, seq):
+        return seq.translate(self.complement)[::-1]
+
+    def lift_rows(self, rows, format="bed"):
+        """
+        Lift a batch of BED/GFF/VCF rows (already split into fields). Yields
+        (input index, lifted fields).
+        """
+        seqids = [x[0] for x in rows]
+        if format == "bed":
+            starts = [int(x[1]) for x in rows]
+            ends = [int(x[2]) for x in rows]
+            strandcol = 5
+        elif format == "gff":
+            starts = [int(x[3]) - 1 for x in rows]
+            ends = [int(x[4]) for x in rows]
+            strandcol = 6
+        else:  # vcf
+            starts = [int(x[1]) - 1 for x in rows]
+            ends = [int(x[1]) - 1 + len(x[3]) for x in rows]
+            strandcol = None
+
+        idx, dst, ds, de, strand = self.map(seqids, starts, ends)
+        for i, d, s, e, o in zip(idx, dst, ds, de, strand):
+            row = rows[i][:]
+            row[0] = d
+            if format == "bed":
+                row[1], row[2] = str(s), str(e)
+            elif format == "gff":
+                row[3], row[4] = str(s + 1), str(e)
+            else:
+                if e - s != ends[i] - starts[i]:  # Split alleles are dropped
+                    continue
+                row[1] = str(s + 1)
+                if o < 0:
+                    row[3] = self.revcomp(row[3])
+                    row[4] = ",".join(x if x[0] in "<*." else self.revcomp(x)
+                                      for x in row[4].split(","))
+            if o < 0 and strandcol and len(row) > strandcol:
+                row[strandcol] = {"+": "-", "-": "+"}.get(row[strandcol],
+                                                          row[strandcol])
+            yield i, row
+
+    def lift_file(self, filename, fw, format="bed", unmapped=None,
+                  chunksize=1000000):
+        """
+        Stream BED/GFF/VCF records from `filename` to `fw` in batches.
+        Header and comment lines are passed through in place, and so is
+        everything from the `##FASTA` line of a GFF. Records that are not
+        mapped are written to `unmapped` if given.
+        """
+        fp = must_open(filename)
+        nrows = nlifted = 0
+        rows, comments = [], []
+        fasta = False
+        for line in fp:
+            if line[0] == '#' or line.startswith("track") or not line.strip():
+                if format == "gff" and line.strip() == "##FASTA":
+                    fasta = True
+                    break
+                comments.append((len(rows), line))
+                continue
+            rows.append(line.rstrip("\n").split("\t"))
+            if len(rows) >= chunksize:
+                nlifted += self._write_lifted(rows, comments, fw, format,
+                                              unmapped)
+                nrows += len(rows)
+                rows, comments = [], []
+        nlifted += self._write_lifted(rows, comments, fw, format, unmapped)
+        nrows += len(rows)
+        if fasta:
+            fw.write(line)
+            for line in fp:
+                fw.write(line)
+        fp.close()
+        logging.debug("Lifted {0} records into {1} records.".\
+                      format(nrows, nlifted))
+
+    def _write_lifted(self, rows, comments, fw, format, unmapped):
+        """
+        Write lifted `rows`, with `comments` (number of rows before, line)
+        put back at their place.
+        """
+        mapped = set()
+        n = 0
+        comments = comments[::-1]
+        lifted = self.lift_rows(rows, format=format) if rows else []
+        for i, row in lifted:
+            while comments and comments[-1][0] <= i:
+                fw.write(comments.pop()[1])
+            mapped.add(i)
+            print >> fw, "\t".join(row)
+            n += 1
+        while comments:
+            fw.write(comments.pop()[1])
+        if unmapped:
+            for i, row in enumerate(rows):
+                if i not in mapped:
+                    print >> unmapped, "\t".join(row)
+        return n
+
+
 def main():
 
     actions = (
@@ -82,6 +312,7 @@ def main():
         ('last', 'generate PSL file using LAST'),
         ('frompsl', 'generate chain file from PSL format'),
         ('fromagp', 'generate chain file from AGP format'),
+        ('liftover', 'lift BED/GFF/VCF coordinates through AGP or chain file'),
         ('summary', 'provide stats of the chain file'),
             )
     p = ActionDispatcher(actions)
@@ -182,6 +413,41 @@ def fromagp(args):
     logging.debug("File written to `{0}`.".format(chainfile))
 
 
+def liftover(args):
+    """
+    %prog liftover mapping.{agp,chain} input.{bed,gff,vcf} > output
+
+    Lift coordinates from components to objects (AGP) or from target to query
+    (chain). Features that span several blocks are split.
+    """
+    supported_formats = ("bed", "gff", "vcf")
+    p = OptionParser(liftover.__doc__)
+    p.add_option("--format", choices=supported_formats,
+                 help="Input format, guess from extension if not given")
+    p.add_option("--unmapped", help="Write unmapped records to file")
+    p.set_outfile()
+    opts, args = p.parse_args(args)
+
+    if len(args) != 2:
+        sys.exit(not p.print_help())
+
+    mappingfile, infile = args
+    format = opts.format
+    if not format:
+        ext = infile.replace(".gz", "").rsplit(".", 1)[-1]
+        format = "gff" if ext in ("gff", "gff3", "gtf") else ext
+        assert format in supported_formats, \
+                "Cannot guess format of `{0}`, use --format".format(infile)
+
+    lo = LiftOver.from_file(mappingfile)
+    fw = must_open(opts.outfile, "w")
+    unmapped = must_open(opts.unmapped, "w") if opts.unmapped else None
+    lo.lift_file(infile, fw, format=format, unmapped=unmapped)
+    fw.close()
+    if unmapped:
+        unmapped.close()
+
+
 def faToTwoBit(fastafile):
     twobitfile = fastafile.rsplit(".", 1)[0] + ".2bit"
     cmd = "faToTwoBit {0} {1}".format(fastafile, twobitfile)
@@ -9,6 +9,7 @@ import os.path as op
 import shutil
 import logging
 import string
+import numpy as np
 
 from itertools import groupby, izip_longest
 
@@ -18,12 +19,13 @@ from Bio.SeqRecord import SeqRecord
 from Bio.SeqUtils.CheckSum import seguid
 
 from hashlib import md5
+from zlib import crc32, adler32
 
 from jcvi.formats.base import BaseFile, DictFile, must_open
 from jcvi.formats.bed import Bed
 from jcvi.utils.table import write_csv
 from jcvi.apps.console import red, green
-from jcvi.apps.base import OptionParser, ActionDispatcher, need_update
+from jcvi.apps.base import OptionParser, ActionDispatcher, need_update, sh
 
 
 class Fasta (BaseFile, dict):
@@ -85,12 +87,12 @@ class Fasta (BaseFile, dict):
             yield rec.description, rec
 
     def iterkeys_ordered(self):
-        for k, rec in self.iteritems_ordered():
-            yield k
+        for rec in iter_fasta_raw(self.filename):
+            yield rec.id
 
     def itersizes_ordered(self):
-        for k, rec in self.iteritems_ordered():
-            yield k, len(rec)
+        for rec in iter_fasta_raw(self.filename):
+            yield rec.id, len(rec)
 
     def tostring(self):
         d = {}
@@ -165,6 +167,471 @@ class Fasta (BaseFile, dict):
         return seq
 
 
+class FastaIndex (object):
+    """
+    Byte-offset index of a FASTA file, same as the `.fai` from `samtools
+    faidx` (name, length, offset, line bases, line width). Slices are read
+    directly from disk, so that sequences are never loaded as a whole.
+    """
+    complement = string.maketrans("ACGTRYKMSWBDHVNacgtrykmswbdhvn",
+                                  "TGCAYRMKSWVHDBNtgcayrmkswvhdbn")
+
+    def __init__(self, filename):
+        self.filename = filename
+        faifile = filename + ".fai"
+        if need_update(filename, faifile):
+            self.build(filename, faifile)
+
+        self.load(faifile)
+        if not self.consistent():
+            logging.debug("Index `{0}` is inconsistent, rebuild.".\
+                          format(faifile))
+            self.build(filename, faifile)
+            self.load(faifile)
+        self.fp = open(filename, "rb")
+
+    def load(self, faifile):
+        self.index = {}
+        self.names = []
+        for row in open(faifile):
+            name, size, offset, linebases, linewidth = row.split()[:5]
+            self.index[name] = (int(size), int(offset), int(linebases),
+                                int(linewidth))
+            self.names.append(name)
+
+    def consistent(self):
+        """
+        Check that the index covers a non-empty file and that every
+        sequence lies within the file.
+        """
+        filesize = op.getsize(self.filename)
+        if not self.index:
+            return filesize == 0
+        for size, offset, linebases, linewidth in self.index.values():
+            if size and not 0 < linebases <= linewidth:
+                return False
+            nlines = (size - 1) / linebases if size else 0
+            if offset + nlines * linewidth + size - nlines * linebases \
+                    > filesize:
+                return False
+        return True
+
+    @classmethod
+    def build(cls, filename, faifile):
+        assert not filename.endswith(".gz"), \
+                "Cannot index compressed file `{0}`".format(filename)
+        fp = open(filename, "rb")
+        tmpfile = faifile + ".tmp"
+        fw = open(tmpfile, "w")
+        try:
+            cls.write_index(fp, fw)
+        except AssertionError:
+            fw.close()
+            os.remove(tmpfile)
+            raise
+        finally:
+            fp.close()
+        fw.close()
+        os.rename(tmpfile, faifile)
+        logging.debug("FASTA index written to `{0}`.".format(faifile))
+
+    @classmethod
+    def write_index(cls, fp, fw):
+        name = None
+        offset = 0
+        for row in fp:
+            rowlen = len(row)
+            if row[0] == '>':
+                if name is not None:
+                    print >> fw, "\t".join(str(x) for x in (name, size,
+                                    seqoffset, linebases, linewidth))
+                atoms = row[1:].split()
+                assert atoms, "Empty FASTA header at byte {0}".format(offset)
+                name = atoms[0]
+                seqoffset = offset + rowlen
+                size = linebases = linewidth = 0
+                lastshort = False
+            else:
+                bases = len(row.rstrip())
+                if bases:
+                    assert not lastshort, \
+                        "Different line length in `{0}`".format(name)
+                    if not linebases:
+                        linebases, linewidth = bases, rowlen
+                    lastshort = bases < linebases
+                    assert bases <= linebases, \
+                        "Different line length in `{0}`".format(name)
+                    size += bases
+            offset += rowlen
+        if name is not None:
+            print >> fw, "\t".join(str(x) for x in (name, size,
+                                    seqoffset, linebases, linewidth))
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def size(self, name):
+        return self.index[name][0]
+
+    def itersizes(self):
+        for name in self.names:
+            yield name, self.size(name)
+
+    def fetch(self, name, start=1, stop=None):
+        """
+        Sequence slice, start and stop are 1-based inclusive.
+        """
+        size, offset, linebases, linewidth = self.index[name]
+        start = max(start, 1) - 1
+        stop = size if stop is None else min(stop, size)
+        if stop <= start:
+            return ""
+
+        pos = lambda x: offset + x / linebases * linewidth + x % linebases
+        a, b = pos(start), pos(stop)
+        self.fp.seek(a)
+        seq = self.fp.read(b - a)
+        return seq.replace("\n", "").replace("\r", "")
+
+    def iter_chunks(self, name, start=1, stop=None, strand=None,
+                    chunksize=10000000):
+        """
+        Same as fetch() but yields the slice in chunks of bounded size. For
+        reverse strand, the chunks are reverse complemented.
+        """
+        size = self.index[name][0]
+        stop = size if stop is None else min(stop, size)
+        reverse = strand in (-1, '-1', '-')
+        starts = range(start, stop + 1, chunksize)
+        if reverse:
+            starts = starts[::-1]
+        for a in starts:
+            seq = self.fetch(name, a, min(a + chunksize - 1, stop))
+            if reverse:
+                seq = seq.translate(self.complement)[::-1]
+            yield seq
+
+    def sequence(self, f, asstring=True):
+        """
+        Same interface as Fasta.sequence().
+        """
+        assert 'chr' in f, "`chr` field required"
+        name = f['chr']
+        assert name in self, "feature: %s not in `%s`" % \
+                (f, self.filename)
+
+        seq = "".join(self.iter_chunks(name, f.get('start') or 1,
+                            f.get('stop'), f.get('strand')))
+        return seq if asstring else Seq(seq)
+
+
+def write_wrapped(fw, chunks, width=60):
+    """
+    Write sequence chunks wrapped at `width`, without joining them first.
+    Returns the total number of bases written.
+    """
+    total = 0
+    carry = ""
+    for chunk in chunks:
+        s = carry + chunk
+        total += len(chunk)
+        n = len(s) / width * width
+        if n:
+            fw.write("\n".join(s[i:i + width] for i in xrange(0, n, width)))
+            fw.write("\n")
+        carry = s[n:]
+    if carry:
+        fw.write(carry + "\n")
+    return total
+
+
+class FastaRecord (object):
+    """
+    Raw FASTA record: the header line (without '>') and the sequence lines.
+    Parsing and writing follow SeqIO (id is the first word of the header,
+    sequence wrapped at 60 columns), without building Bio objects.
+    """
+    __slots__ = ("header", "lines")
+
+    def __init__(self, header, lines):
+        self.header = header
+        self.lines = lines
+
+    @property
+    def id(self):
+        atoms = self.header.split(None, 1)
+        return atoms[0] if atoms else ""
+
+    name = id
+
+    @property
+    def description(self):
+        return self.header
+
+    @property
+    def seq(self):
+        return "".join(self.lines)
+
+    def __len__(self):
+        return sum(len(x) for x in self.lines)
+
+    def upper(self):
+        return FastaRecord(self.header, [x.upper() for x in self.lines])
+
+    def lower(self):
+        return FastaRecord(self.header, [x.lower() for x in self.lines])
+
+    def subseq(self, start=None, stop=None, strand=None):
+        """
+        Same as Fasta.subseq(), returns a string.
+        """
+        size = len(self)
+        start = start - 1 if start is not None else 0
+        stop = stop if stop is not None else size
+        if start < 0:
+            logging.error("start ({0}) must > 0 of `{1}`. Reset to 1".\
+                          format(start + 1, self.id))
+            start = 0
+        if stop > size:
+            logging.error("stop ({0}) must be <= length of `{1}` ({2}). "
+                          "Reset to {2}.".format(stop, self.id, size))
+            stop = size
+
+        seq = self.seq[start:stop]
+        if strand in (-1, '-1', '-'):
+            seq = seq.translate(FastaIndex.complement)[::-1]
+        return seq
+
+    def write(self, fw, id=None, description=None, width=60):
+        """
+        Write record as SeqIO.write() does. `id` and `description` default to
+        the ones parsed from the header.
+        """
+        if id is None and description is None:
+            title = self.header.replace("\r", " ")
+        else:
+            id = self.id if id is None else id
+            description = self.description if description is None \
+                            else description
+            title = fasta_title(id, description)
+        fw.write(">" + title + "\n")
+
+        lines = self.lines
+        # Fast path: lines already wrapped at the right width
+        if all(len(x) == width for x in lines[:-1]) and \
+                (not lines or 0 < len(lines[-1]) <= width):
+            if lines:
+                fw.write("\n".join(lines))
+                fw.write("\n")
+        else:
+            write_wrapped(fw, [x for x in lines if x], width=width)
+
+
+def fasta_title(id, description):
+    """
+    FASTA header from id and description, same rules as SeqIO.
+    """
+    id = id.replace("\n", " ").replace("\r", " ")
+    description = description.replace("\n", " ").replace("\r", " ")
+    if description and description.split(None, 1)[0] == id:
+        return description
+    elif description:
+        return "{0} {1}".format(id, description)
+    return id
+
+
+def iter_fasta_raw(fastafile):
+    """
+    Iterate FastaRecords in file order, from a filename or a file handle.
+    """
+    fp = must_open(fastafile) if isinstance(fastafile, basestring) \
+            else fastafile
+    header = None
+    lines = []
+    for row in fp:
+        if row[0] == '>':
+            if header is not None:
+                yield FastaRecord(header, lines)
+            header = row[1:].rstrip()
+            lines = []
+        elif header is not None:
+            row = row.rstrip()
+            if ' ' in row or '\r' in row:
+                row = row.replace(" ", "").replace("\r", "")
+            lines.append(row)
+    if header is not None:
+        yield FastaRecord(header, lines)
+
+
+NUCLEOTIDE_CODES = np.array([4] * 256, dtype=np.uint8)
+NUCLEOTIDE_CODES[np.fromstring("ACGT", dtype=np.uint8)] = range(4)
+
+
+def codon_codes(seq, frame, symbols, base):
+    """
+    Codons in `frame` as integers, with `symbols` mapping each byte to a
+    digit in `base`.
+    """
+    n = (len(seq) - frame) / 3
+    if n <= 0:
+        return np.zeros(0, dtype=int)
+    digits = symbols[np.fromstring(seq[frame: frame + 3 * n],
+                                   dtype=np.uint8)].astype(int)
+    digits = digits.reshape(-1, 3)
+    return (digits[:, 0] * base + digits[:, 1]) * base + digits[:, 2]
+
+
+def codon_lookup(codons, dtype):
+    """
+    Boolean lookup over codon_codes() with NUCLEOTIDE_CODES.
+    """
+    lookup = np.zeros(125, dtype=dtype)
+    for c in codons:
+        lookup[codon_codes(c.upper(), 0, NUCLEOTIDE_CODES, 5)] = True
+    return lookup
+
+
+class CodonTable (object):
+    """
+    Translate with a lookup over all codons of IUPAC nucleotide symbols,
+    filled from Biopython once per translation table. Sequences with other
+    symbols, or codons Biopython cannot translate, return None so that the
+    caller can fall back to Biopython.
+    """
+    alphabet = "ACGTURYKMSWBDHVN"
+    tables = {}
+
+    def __init__(self, table=1):
+        self.table = table
+        k = len(self.alphabet)
+        symbols = np.array([255] * 256, dtype=np.uint8)
+        for i, c in enumerate(self.alphabet):
+            symbols[ord(c)] = symbols[ord(c.lower())] = i
+        self.symbols = symbols
+        self.base = k
+
+        codons = ["".join((a, b, c)) for a in self.alphabet \
+                    for b in self.alphabet for c in self.alphabet]
+        aa = []
+        for c in codons:
+            try:
+                aa.append(str(Seq(c).translate(table=table)))
+            except Exception:
+                aa.append("\0")  # Not translatable
+        self.lookup = np.fromstring("".join(aa), dtype=np.uint8)
+
+    @classmethod
+    def get(cls, table=1):
+        if table not in cls.tables:
+            cls.tables[table] = cls(table)
+        return cls.tables[table]
+
+    def translate(self, seq, frame=0):
+        codes = codon_codes(seq, frame, self.symbols, self.base)
+        if codes.size and codes.max() >= len(self.lookup):
+            return None
+        aa = self.lookup[codes]
+        if (aa == 0).any():
+            return None
+        return aa.tostring()
+
+
+def translate_cds(seq, table=1):
+    """
+    Translate in the three frames and keep the peptide with the longest
+    stretch before a stop codon, labeling the translation as in translate().
+    """
+    codontable = CodonTable.get(table)
+    cds = seq
+    peplen = len(cds) / 3
+    pep = ""
+    for i in xrange(3):
+        newcds = cds[i: i + peplen * 3]
+        newpep = codontable.translate(newcds)
+        if newpep is None:
+            newpep = str(Seq(newcds).translate(table=table))
+        if len(newpep.split("*")[0]) > len(pep.split("*")[0]):
+            pep = newpep
+
+    labels = []
+    if "*" in pep.rstrip("*"):
+        labels.append("cannot_translate")
+    contains_start = pep.startswith("M")
+    contains_stop = pep.endswith("*")
+    if not contains_start:
+        labels.append("five_prime_missing")
+    if not contains_stop:
+        labels.append("three_prime_missing")
+    if "X" in pep:
+        labels.append("contain_ns")
+    if contains_start and contains_stop:
+        labels.append("complete")
+    if pep.startswith("X"):
+        labels.append("start_ns")
+    if pep.endswith("X"):
+        labels.append("end_ns")
+
+    return pep, labels
+
+
+def translate_chunk(args):
+    """
+    Pool worker: translate a chunk of (header, seq).
+    """
+    records, table = args
+    return [(header,) + translate_cds(seq, table=table) \
+                for header, seq in records]
+
+
+def longestorf_chunk(records):
+    """
+    Pool worker: longest ORF for a chunk of (header, seq).
+    """
+    results = []
+    for header, seq in records:
+        orf = ORFFinder(seq)
+        results.append((header, len(seq), orf.get_longest_orf(), orf.info))
+    return results
+
+
+def iter_record_chunks(fastafile, chunksize=1000000):
+    """
+    Group (header, seq) of the FASTA file into chunks of about `chunksize`
+    bases, for the process pool.
+    """
+    chunk, size = [], 0
+    for rec in iter_fasta_raw(fastafile):
+        seq = rec.seq
+        chunk.append((rec.header, seq))
+        size += len(seq)
+        if size >= chunksize:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def imap_chunks(func, jobs, cpus=1):
+    """
+    Run func over jobs in a pool of `cpus` workers, results in input order.
+    """
+    from multiprocessing import Pool
+
+    if cpus <= 1:
+        for job in jobs:
+            yield func(job)
+        return
+
+    pool = Pool(cpus)
+    for result in pool.imap(func, jobs):
+        yield result
+    pool.close()
+    pool.join()
+
+
 """
 Class derived from https://gist.github.com/933737
 Original code written by David Winter (https://github.com/dwinter)
@@ -181,7 +648,7 @@ class ORFFinder (object):
     is printed
     """
     def __init__(self, seq, start=[], stop=["TAG", "TAA", "TGA"]):
-        self.seq = seq.tostring().upper()
+        self.seq = str(seq).upper()
         self.start = start
         self.stop = stop
         # strand, frame, start, end, length; coordinates are 1-based
@@ -202,29 +669,31 @@ class ORFFinder (object):
         strand, frame, start, end, length = self.result
         return "\t".join(str(x) for x in (strand, frame, start, end))
 
-    def codons(self, frame):
-        """ A generator that yields DNA in one codon blocks
-        "frame" counts for 0. This function yields a tuple (triplet, index) with
-        index relative to the original DNA sequence
-        """
-        start = frame
-        while start + 3 <= self.size:
-            yield self.sequence[start : start + 3], start
-            start += 3
-
     def scan_sequence(self, frame, direction):
-        """ Search in one reading frame """
-        orf_start = None
-        for c, index in self.codons(frame):
-            if (c not in self.stop and (c in self.start or not self.start)
-                and orf_start is None):
-                orf_start = index
-            elif c in self.stop and orf_start is not None:
-                self._update_longest(orf_start, index + 3, direction, frame)
-                orf_start = None
-
-        if orf_start is not None:
-            self._update_longest(orf_start, index + 3, direction, frame)
+        """ Search in one reading frame, all codons at once """
+        codes = codon_codes(self.sequence, frame, NUCLEOTIDE_CODES, 5)
+        n = len(codes)
+        if not n:
+            return
+
+        isstop = codon_lookup(self.stop, bool)[codes]
+        stops = np.flatnonzero(isstop)
+        isstart = ~isstop
+        if self.start:
+            isstart &= codon_lookup(self.start, bool)[codes]
+        # ORF begins at the first start codon after each stop
+        starts = np.flatnonzero(isstart)
+        if not len(starts):
+            return
+
+        segment = np.cumsum(isstop)[starts]
+        segment, first = np.unique(segment, return_index=True)
+        starts = starts[first]
+        # ... and ends after the next stop codon, or the last codon
+        ends = np.append(stops, n - 1)[segment] + 1
+        i = np.argmax(ends - starts)
+        self._update_longest(int(frame + 3 * starts[i]),
+                             int(frame + 3 * ends[i]), direction, frame)
 
     def _update_longest(self, orf_start, index, direction, frame):
         orf_end = index
@@ -451,6 +920,7 @@ def longestorf(args):
     p = OptionParser(longestorf.__doc__)
     p.add_option("--ids", action="store_true",
                  help="Generate table with ORF info [default: %default]")
+    p.set_cpus(cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
@@ -464,21 +934,17 @@ def longestorf(args):
         idsfile = pf + ".orf.ids"
         fwids = open(idsfile, "w")
 
-    f = Fasta(fastafile, lazy=True)
     fw = must_open(orffile, "w")
     before, after = 0, 0
-    for name, rec in f.iteritems_ordered():
-        cds = rec.seq
-        before += len(cds)
-        # Try all six frames
-        orf = ORFFinder(cds)
-        lorf = orf.get_longest_orf()
-        newcds = Seq(lorf)
-        after += len(newcds)
-        newrec = SeqRecord(newcds, id=name, description=rec.description)
-        SeqIO.write([newrec], fw, "fasta")
-        if idsfile:
-            print >> fwids, "\t".join((name, orf.info))
+    chunks = iter_record_chunks(fastafile)
+    for results in imap_chunks(longestorf_chunk, chunks, cpus=opts.cpus):
+        for header, size, lorf, info in results:
+            newrec = FastaRecord(header, [lorf])
+            before += size
+            after += len(lorf)
+            newrec.write(fw)
+            if idsfile:
+                print >> fwids, "\t".join((newrec.id, info))
 
     fw.close()
     if idsfile:
@@ -567,19 +1033,15 @@ def iter_canonical_fasta(fastafile):
 
 
 def fancyprint(fw, seq, width=60, chunk=10):
-    from jcvi.utils.iter import grouper
-
     assert width % chunk == 0
-    nchunks = width / chunk
+    seq = str(seq)
     seqlen = len(seq)
     maxchar = len(str(seqlen))
 
-    s = ["".join(x) for x in grouper(seq, chunk, fillvalue="")]
-    s = [" ".join(x) for x in grouper(s, nchunks, fillvalue="")]
-    for a, b in zip(range(1, len(seq), width), s):
-        b = b.rstrip()
-        a = str(a).rjust(maxchar, " ")
-        print >> fw, "  ".join((a, b))
+    for a in xrange(0, seqlen, width):
+        b = " ".join(seq[i: i + chunk] for i in \
+                     xrange(a, min(a + width, seqlen), chunk))
+        print >> fw, "  ".join((str(a + 1).rjust(maxchar, " "), b))
 
 
 def clean(args):
@@ -636,6 +1098,7 @@ def translate(args):
                  help="Find the longest ORF from each input CDS [default: %default]")
     p.add_option("--table", default=1, choices=transl_tables,
             help="Specify translation table to use [default: %default]")
+    p.set_cpus(cpus=1)
     p.set_outfile()
 
     opts, args = p.parse_args(args)
@@ -645,9 +1108,8 @@ def translate(args):
 
     cdsfasta, = args
     if opts.longest:
-        cdsfasta = longestorf([cdsfasta])
+        cdsfasta = longestorf([cdsfasta, "--cpus={0}".format(opts.cpus)])
 
-    f = Fasta(cdsfasta, lazy=True)
     outfile = opts.outfile
     fw = must_open(outfile, "w")
 
@@ -660,55 +1122,28 @@ def translate(args):
     five_prime_missing = three_prime_missing = 0
     contain_ns = complete = cannot_translate = total = 0
 
-    for name, rec in f.iteritems_ordered():
-        cds = rec.seq
-        cdslen = len(cds)
-        peplen = cdslen / 3
-        total += 1
-
-        # Try all three frames
-        pep = ""
-        for i in xrange(3):
-            newcds = cds[i: i + peplen * 3]
-            newpep = newcds.translate(table=opts.table)
-            if len(newpep.split("*")[0]) > len(pep.split("*")[0]):
-                pep = newpep
-
-        labels = []
-        if "*" in pep.rstrip("*"):
-            logging.error("{0} cannot translate".format(name))
-            cannot_translate += 1
-            labels.append("cannot_translate")
-
-        contains_start = pep.startswith("M")
-        contains_stop = pep.endswith("*")
-        contains_ns = "X" in pep
-        start_ns = pep.startswith("X")
-        end_ns = pep.endswith("X")
-
-        if not contains_start:
-            five_prime_missing += 1
-            labels.append("five_prime_missing")
-        if not contains_stop:
-            three_prime_missing += 1
-            labels.append("three_prime_missing")
-        if contains_ns:
-            contain_ns += 1
-            labels.append("contain_ns")
-        if contains_start and contains_stop:
-            complete += 1
-            labels.append("complete")
-        if start_ns:
-            labels.append("start_ns")
-        if end_ns:
-            labels.append("end_ns")
-
-        if ids:
-            print >> ids, "\t".join((name, ",".join(labels)))
-
-        peprec = SeqRecord(pep, id=name, description=rec.description)
-        SeqIO.write([peprec], fw, "fasta")
-        fw.flush()
+    chunks = ((x, int(opts.table)) for x in iter_record_chunks(cdsfasta))
+    for results in imap_chunks(translate_chunk, chunks, cpus=opts.cpus):
+        for header, pep, labels in results:
+            peprec = FastaRecord(header, [pep])
+            name = peprec.id
+            total += 1
+            if "cannot_translate" in labels:
+                logging.error("{0} cannot translate".format(name))
+                cannot_translate += 1
+            if "five_prime_missing" in labels:
+                five_prime_missing += 1
+            if "three_prime_missing" in labels:
+                three_prime_missing += 1
+            if "contain_ns" in labels:
+                contain_ns += 1
+            if "complete" in labels:
+                complete += 1
+
+            if ids:
+                print >> ids, "\t".join((name, ",".join(labels)))
+
+            peprec.write(fw)
 
     print >> sys.stderr, "Complete gene models: {0}".\
                         format(percentage(complete, total))
@@ -750,10 +1185,8 @@ def filter(args):
     except ValueError:
         sys.exit(not p.print_help())
 
-    f = Fasta(fastafile, lazy=True)
-
     fw = must_open(opts.outfile, "w")
-    for name, rec in f.iteritems_ordered():
+    for rec in iter_fasta_raw(fastafile):
 
         if opts.less and len(rec) >= cutoff:
             continue
@@ -761,7 +1194,7 @@ def filter(args):
         if (not opts.less) and len(rec) < cutoff:
             continue
 
-        SeqIO.write([rec], fw, "fasta")
+        rec.write(fw)
         fw.flush()
 
     return fw.name
@@ -1061,57 +1494,55 @@ def format(args):
     if annotfile:
         annotation = DictFile(annotfile, delimiter="\t")
 
-    fp = SeqIO.parse(must_open(infasta), "fasta")
     fw = must_open(outfasta, "w")
-    for i, rec in enumerate(fp):
-        origid = rec.id
+    for i, rec in enumerate(iter_fasta_raw(must_open(infasta))):
+        origid = id = rec.id
         description = rec.description.replace(origid, "").strip()
         if sep:
-            rec.id = rec.description.split(sep)[idx].strip()
+            id = rec.description.split(sep)[idx].strip()
         if gb:
             # gi|262233616|gb|GU123895.1| Coffea arabica clone BAC
-            atoms = rec.id.split("|")
+            atoms = id.split("|")
             if len(atoms) >= 3:
-                rec.id = atoms[3]
+                id = atoms[3]
             elif len(atoms) == 2:
-                rec.id = atoms[1]
+                id = atoms[1]
         if pairs:
-            id = "/1" if (i % 2 == 0) else "/2"
-            rec.id += id
+            id += "/1" if (i % 2 == 0) else "/2"
         if noversion:
-            rec.id = rec.id.rsplit(".", 1)[0]
+            id = id.rsplit(".", 1)[0]
         if sequential:
-            rec.id = "{0:0{1}d}".format(sequentialoffset, opts.pad0)
+            id = "{0:0{1}d}".format(sequentialoffset, opts.pad0)
             if sequential == "prefix":
-                rec.id = "{0}-{1}".format(rec.id, origid)
+                id = "{0}-{1}".format(id, origid)
             elif sequential == "suffix":
-                rec.id = "{0}-{1}".format(origid, rec.id)
+                id = "{0}-{1}".format(origid, id)
             sequentialoffset += 1
         if opts.template:
             template, dir, lib = [x.split("=")[-1] for x in
                     rec.description.split()[1:4]]
-            rec.id = "{0}-{1}/{2}".format(lib, template, dir)
+            id = "{0}-{1}/{2}".format(lib, template, dir)
         if mapfile:
             if origid in mapping:
-                rec.id = mapping[origid]
+                id = mapping[origid]
             else:
                 logging.error("{0} not found in `{1}`. ID unchanged.".\
                         format(origid, mapfile))
         if prefix:
-            rec.id = prefix + rec.id
+            id = prefix + id
         if suffix:
-            rec.id += suffix
+            id += suffix
         if annotfile:
-            rec.description = annotation.get(origid, "") if not mapfile \
-                    else annotation.get(rec.id, "")
+            description = annotation.get(origid, "") if not mapfile \
+                    else annotation.get(id, "")
         else:
-            rec.description = description if desc else ""
+            description = description if desc else ""
         if idsfile:
-            print >> idsfile, "\t".join((origid, rec.id))
+            print >> idsfile, "\t".join((origid, id))
         if upper:
-            rec.seq = rec.seq.upper()
+            rec = rec.upper()
 
-        SeqIO.write(rec, fw, "fasta")
+        rec.write(fw, id=id, description=description)
 
     if idsfile:
         logging.debug("Conversion table written to `{0}`.".\
@@ -1253,26 +1684,47 @@ def diff(args):
 
 def hash_fasta(seq, ignore_case=False, ignore_N=False, ignore_stop=False, checksum="MD5"):
     """
-    Generates checksum of input sequence element
+    Generates checksum of input sequence element. CRC is a fast
+    non-cryptographic checksum (CRC32, Adler32 and length).
     """
     if ignore_stop:
         seq = seq.rstrip("*")
     if ignore_case:
         seq = seq.upper()
     if ignore_N:
-        if not all(c.upper() in 'ATGCN' for c in seq):
-            seq = re.sub('X', '', seq)
+        if seq.translate(None, "ATGCNatgcn"):  # Not all nucleotides
+            seq = seq.translate(None, "X")
         else:
-            seq = re.sub('N', '', seq)
+            seq = seq.translate(None, "N")
 
     if checksum == "MD5":
         hashed = md5(seq).hexdigest()
     elif checksum == "GCG":
         hashed = seguid(seq)
+    elif checksum == "CRC":
+        hashed = "{0:08x}{1:08x}{2:x}".format(crc32(seq) & 0xffffffff,
+                                              adler32(seq) & 0xffffffff,
+                                              len(seq))
 
     return hashed
 
 
+def hash_chunk(args):
+    """
+    Pool worker: hash a chunk of (header, seq) from one file, returns lines
+    of hash, file index, record index, name (and sequence).
+    """
+    records, fileidx, first, hashopts, keepseq = args
+    lines = []
+    for i, (header, seq) in enumerate(records):
+        name = header.split(None, 1)[0] if header.strip() else ""
+        row = [hash_fasta(seq, **hashopts), str(fileidx), str(first + i), name]
+        if keepseq:
+            row.append(seq)
+        lines.append("\t".join(row))
+    return lines
+
+
 def identical(args):
     """
     %prog identical *.fasta
@@ -1284,6 +1736,10 @@ def identical(args):
     If there are duplicates within a given fasta file, they will all be
     listed out in the same row separated by a comma.
 
+    Records are hashed in a pool of workers and the hashes are sorted on
+    disk with unix `sort`, so that memory stays flat for many large files.
+    Rows are ordered by checksum, names in input order.
+
     Example output:
     ---------------------------
 	       tta1.fsa    tta2.fsa
@@ -1296,9 +1752,9 @@ def identical(args):
 	t6         1281         470
 	t7         3367          na
     """
-    from jcvi.utils.cbook import AutoVivification
+    from tempfile import mkstemp
 
-    allowed_checksum = ["MD5", "GCG"]
+    allowed_checksum = ["MD5", "GCG", "CRC"]
 
     p = OptionParser(identical.__doc__)
     p.add_option("--ignore_case", default=False, action="store_true",
@@ -1312,6 +1768,8 @@ def identical(args):
                  " [default: %default]")
     p.add_option("--checksum", default="MD5", choices=allowed_checksum,
             help="specify checksum method [default: %default]")
+    p.set_cpus(cpus=1)
+    p.set_tmpdir()
     p.set_outfile()
 
     opts, args = p.parse_args(args)
@@ -1319,24 +1777,36 @@ def identical(args):
     if len(args) == 0:
         sys.exit(not p.print_help())
 
-    d = AutoVivification()
-    files = []
-    for fastafile in args:
-        f = Fasta(fastafile)
-        pf = fastafile.rsplit(".", 1)[0]
-        files.append(pf)
-
-        logging.debug("Hashing individual elements of {0}".format(fastafile))
-        for name, rec in f.iteritems_ordered():
-            seq = re.sub(' ', '', str(rec.seq))
-            hashed = hash_fasta(seq, ignore_case=opts.ignore_case, ignore_N=opts.ignore_N, \
-                ignore_stop=opts.ignore_stop, checksum=opts.checksum)
-            if not d[hashed]:
-                d[hashed]['seq'] = seq
-                d[hashed]['count'] = 0
-            if not d[hashed]['names'][pf]:
-                d[hashed]['names'][pf] = set()
-            d[hashed]['names'][pf].add(name)
+    hashopts = dict(ignore_case=opts.ignore_case, ignore_N=opts.ignore_N,
+                    ignore_stop=opts.ignore_stop, checksum=opts.checksum)
+    keepseq = opts.output_uniq
+    files = [x.rsplit(".", 1)[0] for x in args]
+
+    def iter_jobs():
+        for fileidx, fastafile in enumerate(args):
+            logging.debug("Hashing individual elements of {0}".\
+                          format(fastafile))
+            first = 0
+            for chunk in iter_record_chunks(fastafile):
+                yield chunk, fileidx, first, hashopts, keepseq
+                first += len(chunk)
+
+    fd, hashfile = mkstemp(suffix=".hashes", dir=opts.tmpdir or ".")
+    fwh = os.fdopen(fd, "w")
+    for lines in imap_chunks(hash_chunk, iter_jobs(), cpus=opts.cpus):
+        for line in lines:
+            print >> fwh, line
+    fwh.close()
+
+    cmd = "LC_ALL=C sort -t $'\\t' -k1,1 -k2,2n -k3,3n"
+    if opts.tmpdir:
+        cmd += " -T {0}".format(opts.tmpdir)
+    cmd += " {0} -o {0}".format(hashfile)
+    retcode = sh(cmd)
+    if retcode:
+        os.remove(hashfile)
+    assert retcode == 0, "Sorting `{0}` failed (returncode={1})".\
+                            format(hashfile, retcode)
 
     fw = must_open(opts.outfile, "w")
     if opts.output_uniq:
@@ -1345,23 +1815,24 @@ def identical(args):
 
     header = "\t".join(str(x) for x in (args))
     print >> fw, "\t".join(str(x) for x in ("", header))
-    for idx, hashed in enumerate(d.keys()):
-        line = []
-        line.append("t{0}".format(idx))
-        for fastafile in files:
-            if fastafile in d[hashed]['names'].keys():
-                line.append(",".join(d[hashed]['names'][fastafile]))
-                if opts.output_uniq:
-                    d[hashed]['count'] += len(d[hashed]['names'][fastafile])
-            else:
-                line.append("na")
+    fp = open(hashfile)
+    rows = (x.rstrip("\n").split("\t") for x in fp)
+    for idx, (hashed, group) in enumerate(groupby(rows, key=lambda x: x[0])):
+        group = list(group)
+        names = [[] for x in files]
+        for row in group:
+            names[int(row[1])].append(row[3])
+        line = ["t{0}".format(idx)]
+        line += [",".join(x) if x else "na" for x in names]
         print >> fw, "\t".join(line)
 
         if opts.output_uniq:
-            seqid = "\t".join(str(x) for x in ("t{0}".format(idx), d[hashed]['count']))
-            rec = SeqRecord(Seq(d[hashed]['seq']), id=seqid, description="")
-            SeqIO.write([rec], uniqfw, "fasta")
+            seqid = "\t".join(str(x) for x in ("t{0}".format(idx), len(group)))
+            rec = FastaRecord(None, [group[0][4]])
+            rec.write(uniqfw, id=seqid, description="")
 
+    fp.close()
+    os.remove(hashfile)
     fw.close()
     if opts.output_uniq:
         logging.debug("Uniq sequences written to `{0}`".format(uniqfile))
@@ -1419,7 +1890,7 @@ def some(args):
         outqualhandle = open(outqualfile, "w")
         parser = iter_fasta_qual(fastafile, qualfile)
     else:
-        parser = SeqIO.parse(fastafile, "fasta")
+        parser = iter_fasta_raw(fastafile)
 
     num_records = 0
     for rec in parser:
@@ -1434,9 +1905,11 @@ def some(args):
             if name not in names:
                 continue
 
-        SeqIO.write([rec], outfastahandle, "fasta")
         if qualfile:
+            SeqIO.write([rec], outfastahandle, "fasta")
             SeqIO.write([rec], outqualhandle, "qual")
+        else:
+            rec.write(outfastahandle)
 
         num_records += 1
 
@@ -1709,21 +2182,22 @@ def extract(args):
     fw = must_open(opts.outfile, "w")
 
     if include or exclude:
-        f = Fasta(fastafile, lazy=True)
-        fi = f.iteritems_ordered if opts.idonly else f.iterdescriptions_ordered
-        for k, rec in fi():
+        for rec in iter_fasta_raw(fastafile):
+            k = rec.id if opts.idonly else rec.description
             if include and key not in k:
                 continue
             if exclude and key in k:
                 continue
 
-            seq = Fasta.subseq(rec, start, stop, strand)
             newid = rec.id
+            if start is None and strand == "+":
+                rec.write(fw, id=newid, description=k)
+                continue
+
             if start is not None:
                 newid += ":{0}-{1}:{2}".format(start, stop, strand)
-
-            rec = SeqRecord(seq, id=newid, description=k)
-            SeqIO.write([rec], fw, "fasta")
+            seq = rec.subseq(start, stop, strand)
+            FastaRecord(None, [seq]).write(fw, id=newid, description=k)
     else:
         f = Fasta(fastafile)
         try:
@@ -1740,11 +2214,11 @@ def extract(args):
 
 def _uniq_rec(fastafile, seq=False):
     """
-    Returns unique records
+    Returns unique records. Sequences are compared by their MD5 digest.
     """
     seen = set()
-    for rec in SeqIO.parse(fastafile, "fasta"):
-        name = str(rec.seq) if seq else rec.id
+    for rec in iter_fasta_raw(fastafile):
+        name = md5(rec.seq).digest() if seq else rec.id
         if name in seen:
             logging.debug("ignore {0}".format(rec.id))
             continue
@@ -1775,8 +2249,9 @@ def uniq(args):
 
     for rec in _uniq_rec(fastafile, seq=seq):
         if opts.trimname:
-            rec.description = ""
-        SeqIO.write([rec], fw, "fasta")
+            rec.write(fw, id=rec.id, description="")
+        else:
+            rec.write(fw)
 
 
 def random(args):
@@ -2078,32 +2553,105 @@ def tidy(args):
     return tidyfastafile
 
 
-def write_gaps_worker(rec):
-    start = 0
-    seq = rec.seq.upper()
-    output = []
-    for gap, seq in groupby(seq, lambda x: x == 'N'):
-        seq = "".join(seq)
-        current_length = len(seq)
-        object_beg = start + 1
-        object_end = start + current_length
-        if gap:
-            s = "\t".join(str(x) for x in (rec.id,
-                object_beg - 1, object_end))
-            output.append(s)
-        start += current_length
+def find_gaps(buf, mask=None):
+    """
+    Runs of N/n in a byte buffer (NumPy uint8 array), as 0-based half-open
+    start and end arrays. `mask` keeps only the sequence bytes.
+    """
+    if mask is not None:
+        buf = buf[mask]
+    isgap = (buf == ord('N')) | (buf == ord('n'))
+    d = np.diff(np.concatenate(([0], isgap.view(np.int8), [0])))
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1), len(buf)
 
-    return "\n".join(output)
+
+MemoryMaps = {}
+
+
+def write_gaps_worker(args):
+    """
+    Pool worker: gaps in bases [a, b) of one sequence, read from the
+    memory-mapped FASTA through the .fai offsets.
+    """
+    fastafile, name, offset, linebases, linewidth, a, b = args
+    if fastafile not in MemoryMaps:
+        MemoryMaps[fastafile] = np.memmap(fastafile, dtype=np.uint8, mode="r")
+    mm = MemoryMaps[fastafile]
+    pos = lambda x: offset + x / linebases * linewidth + x % linebases
+    buf = mm[pos(a): pos(b - 1) + 1]
+    mask = (buf != ord('\n')) & (buf != ord('\r')) \
+                if linewidth > linebases else None
+    starts, ends, size = find_gaps(buf, mask)
+    assert size == b - a, "Inconsistent .fai for `{0}`".format(name)
+    return name, a, b, starts + a, ends + a
+
+
+def iter_gap_ranges(fastafile, windowsize=10000000):
+    """
+    Work units for write_gaps_worker(), long sequences are split into
+    windows aligned to lines.
+    """
+    f = FastaIndex(fastafile)
+    for name in f.names:
+        size, offset, linebases, linewidth = f.index[name]
+        step = max(windowsize / linebases, 1) * linebases if linebases \
+                else size
+        for a in xrange(0, size, step):
+            yield fastafile, name, offset, linebases, linewidth, \
+                  a, min(a + step, size)
+
+
+def iter_gaps(inputfasta, cpus=1):
+    """
+    Yield (seqid, size, starts, ends) of the N-runs per sequence. Sequences
+    are read from the memory-mapped file when it can be indexed, in a pool
+    of `cpus` workers; otherwise they are streamed.
+    """
+    try:
+        assert not inputfasta.endswith(".gz")
+        jobs = list(iter_gap_ranges(inputfasta))
+    except AssertionError:
+        logging.debug("Cannot index `{0}`, streaming records.".\
+                      format(inputfasta))
+        for rec in iter_fasta_raw(inputfasta):
+            buf = np.fromstring(rec.seq, dtype=np.uint8)
+            starts, ends, size = find_gaps(buf)
+            yield rec.id, size, starts, ends
+        return
+
+    results = imap_chunks(write_gaps_worker, jobs, cpus=cpus)
+    for name, windows in groupby(results, key=lambda x: x[0]):
+        allstarts, allends = [], []
+        for name, a, size, starts, ends in windows:
+            # Merge the gap that runs across the window boundary
+            if allends and len(allends[-1]) and allends[-1][-1] == a \
+                    and len(starts) and starts[0] == a:
+                allends[-1] = allends[-1][:-1]
+                starts = starts[1:]
+            allstarts.append(starts)
+            allends.append(ends)
+        yield name, size, np.concatenate(allstarts), np.concatenate(allends)
 
 
 def write_gaps_bed(inputfasta, prefix, mingap, cpus):
-    from jcvi.apps.grid import WriteJobs
     from jcvi.formats.bed import sort
 
     bedfile = prefix + ".gaps.bed"
-    recs = list(SeqIO.parse(inputfasta, "fasta"))
-    pool = WriteJobs(write_gaps_worker, recs, bedfile, cpus=cpus)
-    pool.run()
+    statsfile = prefix + ".gaps.stats"
+    fw = open(bedfile, "w")
+    fws = open(statsfile, "w")
+    print >> fws, "\t".join(("#seqid", "size", "gaps", "gap_bp", "N_bp"))
+    for name, size, starts, ends in iter_gaps(inputfasta, cpus=cpus):
+        for s, e in zip(starts, ends):
+            print >> fw, "\t".join((name, str(s), str(e)))
+        spans = ends - starts
+        big = spans[spans >= mingap]
+        print >> fws, "\t".join(str(x) for x in \
+                (name, size, len(big), big.sum(), spans.sum()))
+    fw.close()
+    fws.close()
+    logging.debug("Gap stats per sequence written to `{0}`.".\
+                  format(statsfile))
 
     sort([bedfile, "-i"])
 
@@ -2128,7 +2676,8 @@ def gaps(args):
     """
     %prog gaps fastafile
 
-    Print out a list of gaps in BED format (.gaps.bed).
+    Print out a list of gaps in BED format (.gaps.bed), and the number and
+    length of gaps per sequence (.gaps.stats).
     """
     from jcvi.formats.sizes import agp
     from jcvi.formats.agp import mask, build
@@ -17,7 +17,7 @@ from jcvi.formats.fasta import Fasta, SeqIO
 from jcvi.formats.bed import Bed, BedLine
 from jcvi.annotation.reformat import atg_name
 from jcvi.utils.iter import flatten
-from jcvi.utils.orderedcollections import DefaultOrderedDict, parse_qs
+from jcvi.utils.orderedcollections import DefaultOrderedDict
 from jcvi.apps.base import OptionParser, OptionGroup, ActionDispatcher, mkdir, \
             need_update, sh
 
@@ -53,7 +53,13 @@ safechars = " /:?~#+!$'@()*[]|"
 class GffLine (object):
     """
     Specification here (http://www.sequenceontology.org/gff3.shtml)
+
+    The attributes column is only parsed on first access of `attributes`.
     """
+    __slots__ = ("seqid", "source", "type", "start", "end", "score",
+                 "strand", "phase", "attributes_text", "_attributes",
+                 "key", "gff3", "keep_attr_order", "idx", "sign")
+
     def __init__(self, sline, key="ID", gff3=True, line_index=None,
                  append_source=False, score_attrib=False,
                  keep_attr_order=True, compute_signature=False):
@@ -71,7 +77,8 @@ class GffLine (object):
         assert self.phase in Valid_phases, \
                 "phase must be one of {0}".format(Valid_phases)
         self.attributes_text = "" if len(args) <= 8 else args[8].strip()
-        self.attributes = make_attributes(self.attributes_text, gff3=gff3, keep_attr_order=keep_attr_order)
+        self._attributes = None
+        self.keep_attr_order = keep_attr_order
         # key is not in the gff3 field, this indicates the conversion to accn
         self.key = key  # usually it's `ID=xxxxx;`
         self.gff3 = gff3
@@ -102,6 +109,17 @@ class GffLine (object):
     def __getitem__(self, key):
         return getattr(self, key)
 
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            self._attributes = make_attributes(self.attributes_text,
+                        gff3=self.gff3, keep_attr_order=self.keep_attr_order)
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, value):
+        self._attributes = value
+
     def __str__(self):
         return "\t".join(str(x) for x in (self.seqid, self.source, self.type,
                 self.start, self.end, self.score, self.strand, self.phase,
@@ -270,9 +288,203 @@ class Gff (LineFile):
                         score_attrib=self.score_attrib, keep_attr_order=self.keep_attr_order, \
                         compute_signature=self.compute_signature, gff3=self.gff3)
 
+    def iter_columns(self):
+        """
+        Fast iterator for callers that never look at the attributes, yields
+        tuples of (seqid, source, type, start, end, score, strand, phase).
+        """
+        if self.make_gff_store:
+            for g in self.gffstore:
+                yield (g.seqid, g.source, g.type, g.start, g.end,
+                       g.score, g.strand, g.phase)
+            return
+
+        fp = must_open(self.filename)
+        for row in fp:
+            if row[0] == '#':
+                if row.strip() == FastaTag:
+                    break
+                continue
+            args = row.strip().split("\t", 8)
+            if len(args) < 8:
+                continue
+            args[3], args[4] = int(args[3]), int(args[4])
+            yield tuple(args[:8])
+        if fp is not sys.stdin:
+            fp.close()
+
     @property
     def seqids(self):
-        return set(x.seqid for x in self)
+        return set(x[0] for x in self.iter_columns())
+
+
+class GffIndex (object):
+    """
+    Parent-child graph of a GFF file built in one streaming pass. Features
+    (unique accns) are integer nodes, parent -> children edges are kept as
+    CSR arrays, and each record is kept as a byte offset into the file so
+    that selected records are read back by seeking. Input that can't be
+    seeked (stdin, .gz, .bz2) keeps the rows in memory instead. Records of
+    the same feature (e.g. CDS segments sharing an ID) map to the same node.
+    """
+    def __init__(self, filename, key="ID"):
+        import numpy as np
+
+        gff = Gff(filename, key=key)
+        self.filename = filename
+        self.key = key
+        self.gff3 = gff.gff3
+        self.nodes = nodes = {}   # accn => node id
+        self.accns = accns = []
+        rec_node, rec_offset, rec_index = [], [], []
+        parents, childs = [], []
+        fp = must_open(filename)
+        self.rows = None if self.seekable(filename, fp) else []
+        offset = 0
+        for idx, row in enumerate(fp):
+            start, offset = offset, offset + len(row)
+            row = row.strip()
+            if not row:
+                continue
+            if row[0] == '#':
+                if row == FastaTag:
+                    break
+                continue
+            if self.rows is not None:
+                start = len(self.rows)
+                self.rows.append(row)
+            g = GffLine(row, key=key, line_index=idx, gff3=self.gff3)
+            accn = g.accn
+            if accn not in nodes:
+                nodes[accn] = len(accns)
+                accns.append(accn)
+            node = nodes[accn]
+            rec_node.append(node)
+            rec_offset.append(start)
+            rec_index.append(idx)
+            for parent in g.attributes.get("Parent", []):
+                if parent not in nodes:
+                    nodes[parent] = len(accns)
+                    accns.append(parent)
+                parents.append(nodes[parent])
+                childs.append(node)
+        if fp is not sys.stdin:
+            fp.close()
+
+        n = len(accns)
+        self.rec_node = np.array(rec_node, dtype=int)
+        self.rec_offset = np.array(rec_offset, dtype=np.int64)
+        self.rec_index = np.array(rec_index, dtype=int)
+        self.has_parent = np.zeros(n, dtype=bool)
+        self.has_parent[childs] = True
+        # Records grouped by node, stable so that file order is kept
+        order = np.argsort(self.rec_node, kind="mergesort")
+        self.node_records = order
+        self.node_indptr = np.concatenate(([0],
+                    np.cumsum(np.bincount(self.rec_node, minlength=n))))
+        # Unique parent -> child edges in order of appearance
+        edges = np.array(zip(parents, childs), dtype=int).reshape(-1, 2)
+        codes = edges[:, 0] * n + edges[:, 1]
+        ucodes, first = np.unique(codes, return_index=True)
+        edges = edges[np.sort(first)]
+        order = np.argsort(edges[:, 0], kind="mergesort")
+        self.children_indices = edges[order, 1]
+        self.children_indptr = np.concatenate(([0],
+                    np.cumsum(np.bincount(edges[:, 0], minlength=n))))
+        logging.debug("Indexed {0} records, {1} features and {2} edges in `{3}`."\
+                      .format(len(rec_node), n, len(edges), filename))
+
+    @staticmethod
+    def seekable(filename, fp):
+        if filename in ("-", "stdin"):
+            return False
+        try:
+            fp.tell()
+        except IOError:
+            return False
+        return True
+
+    def node_children(self, node):
+        ip = self.children_indptr
+        return self.children_indices[ip[node]:ip[node + 1]]
+
+    def records_of(self, node):
+        ip = self.node_indptr
+        return self.node_records[ip[node]:ip[node + 1]]
+
+    def descendants(self, accns, depth=None):
+        """
+        All features below the given accns (excluding themselves unless
+        reached again), breadth first, up to `depth` levels.
+        """
+        nodes = self.nodes
+        frontier = [nodes[x] for x in accns if x in nodes]
+        seen = set(frontier)
+        result = []
+        level = 0
+        while frontier and (depth is None or level < depth):
+            level += 1
+            nxt = []
+            for node in frontier:
+                for c in self.node_children(node):
+                    if c in seen:
+                        continue
+                    seen.add(c)
+                    nxt.append(c)
+            result.extend(nxt)
+            frontier = nxt
+        return result
+
+    def topo_order(self):
+        """
+        Top level features in file order, each followed by its descendants.
+        """
+        emitted = set()
+        rec_node = self.rec_node
+        for node in rec_node[~self.has_parent[rec_node]]:
+            if node in emitted:
+                continue
+            emitted.add(node)
+            yield node
+            for c in self.descendants([self.accns[node]]):
+                if c in emitted:
+                    continue
+                emitted.add(c)
+                yield c
+
+    def iter_records(self, records):
+        """
+        Read back the given records by seeking into the file.
+        """
+        rows = self.rows
+        fp = open(self.filename) if rows is None else None
+        for r in records:
+            if rows is None:
+                fp.seek(self.rec_offset[r])
+                row = fp.readline().strip()
+            else:
+                row = rows[self.rec_offset[r]]
+            g = GffLine(row, key=self.key, line_index=self.rec_index[r],
+                        gff3=self.gff3)
+            g.accn  # Records without ID get one assigned, as in Gff()
+            yield g
+        if fp:
+            fp.close()
+
+    def children(self, accn, level=1):
+        """
+        Records of the children of a feature, `level` levels down.
+        """
+        if accn not in self.nodes:
+            return []
+        nodes = self.descendants([accn], depth=level)
+        if level > 1:  # Keep the lowest level only
+            upper = set(self.descendants([accn], depth=level - 1))
+            nodes = [x for x in nodes if x not in upper]
+        records = []
+        for node in nodes:
+            records.extend(self.records_of(node))
+        return list(self.iter_records(records))
 
 
 class GffFeatureTracker (object):
@@ -319,14 +531,26 @@ def make_attributes(s, gff3=True, keep_attr_order=True):
     """
     if gff3:
         """
-        hack: temporarily replace the '+' sign in the attributes column
-        with the string 'PlusSign' to prevent urlparse.parse_qsl() from
-        replacing the '+' sign with a space
+        Single pass over `key=value` pairs, same rules as urlparse.parse_qsl()
+        (pairs separated by ';' or '&', no value means no pair) except that
+        '+' is kept as is. The first value of each key is also stripped of
+        quotes and unquoted twice, as before.
         """
-        s = s.replace('+', 'PlusSign')
-        d = parse_qs(s, keep_attr_order=keep_attr_order)
-        for key in d.iterkeys():
-            d[key][0] = unquote(d[key][0].replace('PlusSign', '+').replace('"', ''))
+        d = DefaultOrderedDict(list) if keep_attr_order else defaultdict(list)
+        for pair in s.replace('&', ';').split(';'):
+            key, eq, val = pair.partition('=')
+            if not val:
+                continue
+            if '%' in key:
+                key = unquote(key)
+            if '%' in val:
+                val = unquote(val)
+            if key not in d:
+                val = val.replace('"', '')
+                if '%' in val:
+                    val = unquote(val)
+            d[key].extend(val.split(","))
+        return d
     else:
         attributes = s.split(";")
         d = DefaultOrderedDict(list) if keep_attr_order else defaultdict(list)
@@ -414,10 +638,17 @@ def summary(args):
 
     gff = Gff(gff_file)
     beds = defaultdict(list)
-    for g in gff:
-        if ids and not (g.id in ids or g.name in ids or g.parent in ids):
-            continue
-        beds[g.type].append(g.bedline)
+    if ids:
+        for g in gff:
+            if not (g.id in ids or g.name in ids or g.parent in ids):
+                continue
+            beds[g.type].append(g.bedline)
+    else:
+        # Only the coordinates are needed
+        for seqid, source, type, start, end, score, strand, phase \
+                in gff.iter_columns():
+            row = "\t".join((seqid, str(start - 1), str(end)))
+            beds[type].append(BedLine(row))
 
     table = {}
     for type, bb in sorted(beds.items()):
@@ -1159,16 +1390,26 @@ def liftover(args):
 
     Adjust gff coordinates based on tile number. For example,
     "gannotation.asmbl.000095.7" is the 8-th tile on asmbl.000095.
+    With --mapping, lift coordinates through an AGP or chain file instead.
     """
+    from jcvi.formats.chain import LiftOver
+
     p = OptionParser(liftover.__doc__)
     p.add_option("--tilesize", default=50000, type="int",
                  help="The size for each tile [default: %default]")
+    p.add_option("--mapping",
+                 help="Lift through AGP or chain file [default: %default]")
     opts, args = p.parse_args(args)
 
     if len(args) != 1:
         sys.exit(not p.print_help())
 
     gffile, = args
+    if opts.mapping:
+        lo = LiftOver.from_file(opts.mapping)
+        lo.lift_file(gffile, sys.stdout, format="gff")
+        return
+
     gff = Gff(gffile)
     for g in gff:
         seqid = g.seqid
@@ -1438,36 +1679,18 @@ def uniq(args):
 def populate_children(outfile, ids, gffile, iter="2"):
     fw = must_open(outfile, "w")
     logging.debug("A total of {0} features selected.".format(len(ids)))
-    logging.debug("Populate children. Iteration 1..")
-    gff = Gff(gffile)
-    children = set()
-    for g in gff:
-        if "Parent" not in g.attributes:
-            continue
-        for parent in g.attributes["Parent"]:
-            if parent in ids:
-                children.add(g.accn)
-
-    if iter == "2":
-        logging.debug("Populate grand children. Iteration 2..")
-        gff = Gff(gffile)
-        for g in gff:
-            if "Parent" not in g.attributes:
-                continue
-            for parent in g.attributes["Parent"]:
-                if parent in children:
-                    children.add(g.accn)
+    depth = None if iter == "2" else 1
+    logging.debug("Populate children (depth={0})..".format(depth or "all"))
+    index = GffIndex(gffile)
+    selected = set(index.nodes[x] for x in ids if x in index.nodes)
+    selected |= set(index.descendants(ids, depth=depth))
 
     logging.debug("Filter gff file..")
-    gff = Gff(gffile)
-    seen = set()
-    for g in gff:
-        accn = g.accn
-        if accn in seen:
-            continue
-        if (accn in ids) or (accn in children):
-            seen.add(accn)
-            print >> fw, g
+    # First record of each selected feature, in file order
+    records = [index.records_of(x)[0] for x in selected \
+                    if len(index.records_of(x))]
+    for g in index.iter_records(sorted(records)):
+        print >> fw, g
     fw.close()
 
 
@@ -1508,52 +1731,15 @@ def sort(args):
             sortedgff = None
         sh(cmd, outfile=sortedgff)
     else:
-        toplvl, gffdict = [], {}
-        gff = Gff(gffile)
-        for g in gff:
-            id = g.accn
-            parent = g.get_attr("Parent", first=False)
-            gffdict = _sort_init_dict(gffdict, id)
-            gffdict[id]['gffline'] = g
-            if parent:
-                for pp in parent:
-                    gffdict = _sort_init_dict(gffdict, pp)
-                    if pp not in gffdict[id]['parents']:
-                        gffdict[id]['parents'].append(pp)
-                    if id not in gffdict[pp]['children']:
-                        gffdict[pp]['children'].append(id)
-            else:
-                toplvl.append(id)
+        index = GffIndex(gffile)
+        records = []
+        for node in index.topo_order():
+            records.extend(index.records_of(node))
 
         fw = must_open(sortedgff, "w")
-        for id in toplvl:
-            print >> fw, gffdict[id]['gffline']
-            children = [x for x in gffdict[id]['children']]
-            children = _sort_retr_child(gffdict, children)
-            for child in children:
-                print >> fw, gffdict[child]['gffline']
-
-
-def _sort_init_dict(gffdict, id):
-    if id not in gffdict:
-        gffdict[id] = DefaultOrderedDict(list)
-        for reln in ('parents', 'children'):
-            if reln not in gffdict[id]:
-                gffdict[id][reln] = list()
-    return gffdict
-
-
-def _sort_retr_child(gffdict, children):
-    chldrn = children
-    for child in chldrn:
-        if len(gffdict[child]['children']) > 0:
-            for sub_child in gffdict[child]['children']:
-                if sub_child not in children:
-                    children.append(sub_child)
-    if len(chldrn) != len(children):
-        return _sort_retr_child(gffdict, children)
-    else:
-        return children
+        for g in index.iter_records(records):
+            print >> fw, g
+        fw.close()
 
 
 def fromgtf(args):
@@ -2190,7 +2376,7 @@ def load(args):
     desc_attr = opts.desc_attribute
     sep = opts.sep
 
-    g = make_index(gff_file)
+    g = GffIndex(gff_file)
     f = Fasta(fasta_file, index=False)
     seqlen = {}
     for seqid, size in f.itersizes():
@@ -2241,9 +2427,9 @@ def load(args):
             children = []
             if not skipChildren:
                 for c in g.children(feat.id, 1):
-                    if c.featuretype not in children_list:
+                    if c.type not in children_list:
                         continue
-                    child = f.sequence(dict(chr=c.chrom, start=c.start, stop=c.stop,
+                    child = f.sequence(dict(chr=c.seqid, start=c.start, stop=c.end,
                         strand=c.strand))
                     children.append((child, c))
 
@@ -2315,13 +2501,13 @@ def get_upstream_coords(uSite, uLen, seqlen, feat, children_list, gffdb):
     """
     Subroutine takes upstream site, length, reference sequence length,
     parent mRNA feature (GffLine object), list of child feature types
-    and a GFFutils.GFFDB object as the input
+    and a GffIndex object as the input
 
     If upstream of TSS is requested, use the parent feature coords
     to extract the upstream sequence
 
     If upstream of TrSS is requested,  iterates through all the
-    children (CDS features stored in the sqlite GFFDB) and use child
+    children (CDS features found in the GffIndex) and use child
     feature coords to extract the upstream sequence
 
     If success, returns the upstream start and stop coordinates
@@ -2338,9 +2524,9 @@ def get_upstream_coords(uSite, uLen, seqlen, feat, children_list, gffdb):
         children = []
         for c in gffdb.children(feat.id, 1):
 
-            if c.featuretype not in children_list:
+            if c.type not in children_list:
                 continue
-            children.append((c.start, c.stop))
+            children.append((c.start, c.end))
 
         if not children:
             print >>sys.stderr, "[warning] %s has no children with type %s" \
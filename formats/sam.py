@@ -11,7 +11,9 @@ import logging
 
 from itertools import groupby
 
-from jcvi.formats.base import LineFile
+import numpy as np
+
+from jcvi.formats.base import LineFile, must_open
 from jcvi.formats.fasta import Fasta
 from jcvi.formats.sizes import Sizes
 from jcvi.utils.cbook import fill
@@ -96,6 +98,99 @@ class GenomeCoverageFile (LineFile):
             yield seqid, counts * 1. / length
 
 
+def rle(a):
+    """
+    Run-length encode array `a`, returns the start and value of each run.
+    """
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(a)) + 1))
+    return starts, a[starts]
+
+
+def get_regions(bamfile, window=10000000):
+    """
+    Split contigs in the BAM header into windows, each can then be fetched
+    through the BAM index independently.
+    """
+    from pysam import Samfile
+
+    s = Samfile(bamfile, "rb")
+    regions = []
+    for seqid, length in zip(s.references, s.lengths):
+        for start in xrange(0, length, window):
+            regions.append((seqid, length, start, min(start + window, length)))
+    s.close()
+    return regions
+
+
+def depth_chunk(job, batchsize=100000):
+    """
+    Depth runs within one window of a BAM file. Aligned blocks of each read
+    (split at deletions and introns) are clipped to the window and added to a
+    difference array, every `batchsize` blocks, whose cumulative sum is the
+    per-base depth. Secondary and supplementary alignments (flag 0x900) are
+    skipped. Fragments (unpaired reads or first mates) are counted in the
+    window they start in.
+    """
+    from pysam import Samfile
+
+    bamfile, seqid, length, start, end = job
+    size = end - start
+    diff = np.zeros(size + 1, dtype=np.int32)
+
+    def flush(bstarts, bends):
+        bstarts = np.clip(np.array(bstarts, dtype=int) - start, 0, size)
+        bends = np.clip(np.array(bends, dtype=int) - start, 0, size)
+        keep = bstarts < bends
+        np.add.at(diff, bstarts[keep], 1)
+        np.add.at(diff, bends[keep], -1)
+
+    s = Samfile(bamfile, "rb")
+    bstarts, bends = [], []
+    nfrags = 0
+    for r in s.fetch(seqid, start, end):
+        if r.is_unmapped or r.flag & 0x900:
+            continue
+        if r.pos >= start and (not r.is_paired or r.is_read1):
+            nfrags += 1
+        for a, b in r.get_blocks():
+            bstarts.append(a)
+            bends.append(b)
+        if len(bstarts) >= batchsize:
+            flush(bstarts, bends)
+            bstarts, bends = [], []
+    s.close()
+    if bstarts:
+        flush(bstarts, bends)
+
+    starts, depths = rle(np.cumsum(diff[:-1]))
+
+    return seqid, length, starts + start, depths, nfrags
+
+
+def iter_depth(bamfile, cpus=1, window=10000000):
+    """
+    Yield seqid, length, run starts, run ends, run depths and number of
+    fragments for each contig in the BAM header. BAM file must be sorted and
+    indexed, windows are processed in parallel.
+    """
+    from jcvi.formats.fasta import imap_chunks
+
+    jobs = ((bamfile,) + x for x in get_regions(bamfile, window=window))
+    results = imap_chunks(depth_chunk, jobs, cpus=cpus)
+    for seqid, chunks in groupby(results, key=lambda x: x[0]):
+        chunks = list(chunks)
+        length = chunks[0][1]
+        starts = np.concatenate([x[2] for x in chunks])
+        depths = np.concatenate([x[3] for x in chunks])
+        nfrags = sum(x[4] for x in chunks)
+
+        # Join runs that continue across window boundaries
+        keep = np.concatenate(([True], depths[1:] != depths[:-1]))
+        starts, depths = starts[keep], depths[keep]
+        ends = np.append(starts[1:], length)
+        yield seqid, length, starts, ends, depths, nfrags
+
+
 def get_prefix(readfile, dbfile):
     rdpf = op.basename(readfile).replace(".gz", "").rsplit(".", 1)[0]
     dbpf = op.basename(dbfile).split(".")[0]
@@ -239,12 +334,15 @@ def coverage(args):
     """
     %prog coverage fastafile bamfile
 
-    Calculate coverage for BAM file. BAM file must be sorted.
+    Calculate coverage for BAM file. BAM file must be sorted and indexed.
     """
     p = OptionParser(coverage.__doc__)
     p.add_option("--format", default="bigwig",
                  choices=("bedgraph", "bigwig", "coverage"),
                  help="Output format")
+    p.add_option("--window", default=10000000, type="int",
+                 help="Size of BAM regions processed in parallel")
+    p.set_cpus(cpus=1)
     opts, args = p.parse_args(args)
 
     if len(args) != 2:
@@ -253,28 +351,30 @@ def coverage(args):
     fastafile, bamfile = args
     format = opts.format
     pf = bamfile.rsplit(".", 2)[0]
-    sizesfile = Sizes(fastafile).filename
-    cmd = "genomeCoverageBed -ibam {0} -g {1}".format(bamfile, sizesfile)
+    depths = iter_depth(bamfile, cpus=opts.cpus, window=opts.window)
     if format in ("bedgraph", "bigwig"):
-        cmd += " -bg"
         bedgraphfile = pf + ".bedgraph"
-        sh(cmd, outfile=bedgraphfile)
+        fw = open(bedgraphfile, "w")
+        for seqid, length, starts, ends, depth, nfrags in depths:
+            nz = depth > 0
+            for a, b, d in zip(starts[nz].tolist(), ends[nz].tolist(),
+                               depth[nz].tolist()):
+                print >> fw, "\t".join((seqid, str(a), str(b), str(d)))
+        fw.close()
+        logging.debug("Depth intervals written to `{0}`.".format(bedgraphfile))
 
         if format == "bedgraph":
             return bedgraphfile
 
+        sizesfile = Sizes(fastafile).filename
         bigwigfile = pf + ".bigwig"
         cmd = "bedGraphToBigWig {0} {1} {2}".\
                     format(bedgraphfile, sizesfile, bigwigfile)
         sh(cmd)
         return bigwigfile
 
-    coveragefile = pf + ".coverage"
-    if need_update(fastafile, coveragefile):
-        sh(cmd, outfile=coveragefile)
-
-    gcf = GenomeCoverageFile(coveragefile)
-    for seqid, cov in gcf.iter_coverage_seqid():
+    for seqid, length, starts, ends, depth, nfrags in depths:
+        cov = ((ends - starts) * depth).sum() * 1. / length
         print "\t".join((seqid, "{0:.1f}".format(cov)))
 
 
@@ -282,9 +382,13 @@ def fpkm(args):
     """
     %prog fpkm fastafile *.bam
 
-    Calculate FPKM values from BAM file.
+    Calculate FPKM values from BAM file. Fragments (unpaired reads or read
+    pairs) on each contig are normalized by contig length in kb and by the
+    total number of mapped fragments in millions.
     """
     p = OptionParser(fpkm.__doc__)
+    p.set_cpus(cpus=1)
+    p.set_outfile()
     opts, args = p.parse_args(args)
 
     if len(args) < 2:
@@ -292,19 +396,26 @@ def fpkm(args):
 
     fastafile = args[0]
     bamfiles = args[1:]
-    # Create a DUMMY gff file for cuffdiff
-    gffile = fastafile.rsplit(".", 1)[0] + ".gff"
-    if need_update(fastafile, gffile):
-        fw = open(gffile, "w")
-        f = Fasta(fastafile, lazy=True)
-        for key, size in f.itersizes_ordered():
-            print >> fw, "\t".join(str(x) for x in (key, "dummy", "transcript",\
-                1, size, ".", ".", ".", "ID=" + key))
-        fw.close()
-        logging.debug("Dummy GFF created: {0}".format(gffile))
+    sizes = Sizes(fastafile)
+    fw = must_open(opts.outfile, "w")
+    print >> fw, "\t".join(["#seqid", "length"] + \
+                            [op.basename(x) for x in bamfiles])
 
-    cmd = "cuffdiff {0} {1}".format(gffile, " ".join(bamfiles))
-    sh(cmd)
+    counts = []
+    for bamfile in bamfiles:
+        c = dict((seqid, nfrags) for seqid, length, starts, ends, depth, nfrags \
+                    in iter_depth(bamfile, cpus=opts.cpus))
+        logging.debug("A total of {0} fragments mapped in `{1}`.".\
+                        format(sum(c.values()), bamfile))
+        counts.append(c)
+
+    totals = [sum(c.values()) or 1 for c in counts]
+    for seqid, length in zip(sizes.ctgs, sizes.sizes):
+        fpkms = [c.get(seqid, 0) * 1e9 / (length * total) \
+                    for c, total in zip(counts, totals)]
+        print >> fw, "\t".join([seqid, str(length)] + \
+                                ["{0:.3f}".format(x) for x in fpkms])
+    fw.close()
 
 
 def pairs(args):
@@ -23,10 +23,11 @@ from jcvi.formats.blast import BlastLine
 from jcvi.formats.sizes import Sizes
 from jcvi.formats.bed import Bed, BedLine
 from jcvi.apps.base import OptionParser
-from jcvi.graphics.base import plt, Rectangle, set_human_base_axis, savefig
+from jcvi.graphics.base import plt, cm, Rectangle, set_human_base_axis, savefig
+from jcvi.graphics.dotplot import DotRaster
 
 
-DotStyles = ("line", "circle", "dot")
+DotStyles = ("line", "circle", "dot", "raster")
 
 
 def rename_seqid(seqid):
@@ -44,8 +45,11 @@ def rename_seqid(seqid):
 def blastplot(ax, blastfile, qsizes, ssizes, qbed, sbed,
         style="dot", proportional=False, sampleN=None,
         baseticks=False, insetLabels=False, stripNames=False,
-        highlights=None):
-
+        highlights=None, dpi=None, batchsize=1000000):
+    """
+    The "raster" style bins all hits into pixels at `dpi`, showing the max
+    bitscore in each pixel.
+    """
     assert style in DotStyles
     fp = open(blastfile)
 
@@ -53,6 +57,11 @@ def blastplot(ax, blastfile, qsizes, ssizes, qbed, sbed,
     sorder = sbed.order if sbed else None
 
     data = []
+    xsize, ysize = qsizes.totalsize, ssizes.totalsize
+    raster = (style == "raster")
+    if raster:
+        dr = DotRaster(ax, xsize, ysize, dpi or ax.figure.dpi)
+        scores = []
 
     for row in fp:
         b = BlastLine(row)
@@ -87,19 +96,31 @@ def blastplot(ax, blastfile, qsizes, ssizes, qbed, sbed,
 
         if None in (qi, si):
             continue
+        if raster:
+            data.append((qi, si))
+            scores.append(b.score)
+            if len(data) >= batchsize:
+                dr.add(*zip(*data), v=scores)
+                data, scores = [], []
+            continue
         data.append(((qi, qj), (si, sj)))
 
-    if sampleN:
+    if raster and data:
+        dr.add(*zip(*data), v=scores)
+    elif sampleN:
         if len(data) > sampleN:
             data = sample(data, sampleN)
 
-    if not data:
+    if not (len(dr) if raster else data):
         return logging.error("no blast data imported")
 
-    xsize, ysize = qsizes.totalsize, ssizes.totalsize
     logging.debug("xsize=%d ysize=%d" % (xsize, ysize))
 
-    if style == "line":
+    if raster:
+        logging.debug("Rasterize {0} hits into {1}x{2} pixels".\
+                      format(len(dr), *dr.shape))
+        dr.draw(ax, cmap=cm.copper_r, vmin=0)
+    elif style == "line":
         for a, b in data:
             ax.plot(a, b, 'ro-', mfc="w", mec="r", ms=3)
     else:
@@ -243,7 +264,8 @@ if __name__ == "__main__":
     p.add_option("--stripNames", default=False, action="store_true",
             help="Remove trailing .? from gene names [default: %default]")
     p.add_option("--nmax", default=None, type="int",
-            help="Only plot maximum of N dots [default: %default]")
+            help="Only plot maximum of N dots, except with --dotstyle=raster "
+                 "[default: %default]")
     opts, args, iopts = p.set_image_options(figsize="8x8", style="dark", dpi=150)
 
     qsizes, ssizes = opts.qsizes, opts.ssizes
@@ -290,7 +312,8 @@ if __name__ == "__main__":
 
     blastplot(ax, blastfile, qsizes, ssizes, qbed, sbed,
             style=opts.dotstyle, proportional=proportional, sampleN=opts.nmax,
-            baseticks=True, stripNames=opts.stripNames, highlights=highlights)
+            baseticks=True, stripNames=opts.stripNames, highlights=highlights,
+            dpi=iopts.dpi)
 
     # add genome names
     to_ax_label = lambda fname: op.basename(fname).split(".")[0]
@@ -21,39 +21,67 @@ from jcvi.apps.base import OptionParser, glob
 
 
 class XYtrack (object):
-
-    def __init__(self, ax, datafile, color=None, ymax=40):
+    """
+    Coverage track as sorted position and value arrays. With `cache`, the
+    parsed data is kept in `datafile.npy` and reused while it is newer than
+    the datafile.
+    """
+    def __init__(self, ax, datafile, color=None, ymax=40, cache=False):
         self.ax = ax
-        self.xy = []
-        fp = open(datafile)
-        for row in fp:
-            atoms = row.split()
-            self.xy.append([int(atoms[0]), float(atoms[1])])
-        fp.close()
-
-        self.x, self.y = zip(*self.xy)
+        xy = self.load(datafile, cache=cache)
+        order = np.lexsort((xy[:, 1], xy[:, 0]))
+        self.x = xy[order, 0].astype(int)
+        self.y = xy[order, 1]
         logging.debug("File `{0}` imported (records={1})."\
                         .format(datafile, len(self.x)))
         self.color = color or "k"
         self.ymax = ymax
 
+    def load(self, datafile, cache=False):
+        from jcvi.apps.base import need_update
+
+        npyfile = datafile + ".npy"
+        if cache and not need_update(datafile, npyfile):
+            return np.load(npyfile)
+
+        fp = open(datafile)
+        ncols = len(fp.readline().split())
+        fp.seek(0)
+        xy = np.fromstring(fp.read(), sep=" ").reshape((-1, ncols))[:, :2]
+        fp.close()
+        if cache:
+            np.save(npyfile, xy)
+        return xy
+
     @property
     def mapping(self):
         return dict(zip(self.x, self.y))
 
+    def lookup(self, pos, x=None, y=None):
+        """
+        Values at the given positions (0 where there is no data), the last
+        record wins when a position is repeated.
+        """
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        i = np.searchsorted(x, pos, side="right") - 1
+        found = (i >= 0) & (x[np.maximum(i, 0)] == pos)
+        return np.where(found, y[np.maximum(i, 0)], 0)
+
     def interpolate(self, maxsize, unit=10000):
         maxsize = int(maxsize)
-        for pos in range(unit, maxsize + unit, unit):
-            if pos in self.x:
-                continue
-            self.xy.append([pos, 0])
-        self.xy.sort()
-        self.x, self.y = zip(*self.xy)
+        pos = np.arange(unit, maxsize + unit, unit)
+        i = np.minimum(np.searchsorted(self.x, pos), len(self.x) - 1)
+        if len(self.x):
+            pos = pos[self.x[i] != pos]
+        x = np.concatenate((self.x, pos))
+        y = np.concatenate((self.y, np.zeros(len(pos))))
+        order = np.lexsort((y, x))
+        self.x, self.y = x[order], y[order]
         logging.debug("After interpolate: {0}".format(len(self.x)))
 
     def cap(self, ymax):
-        self.xy = [[a, 0] if b > ymax else [a, b] for a, b in self.xy]
-        self.x, self.y = zip(*self.xy)
+        self.y = np.where(self.y > ymax, 0, self.y)
 
     def draw(self):
         ax = self.ax
@@ -67,7 +95,8 @@ class XYtrack (object):
         rr, gg = diverge
         fp = open(hlfile)
         imported = 0
-        mapping = self.mapping
+        # Values before any region is masked
+        mapping = self.x, self.y.copy()
         for row in fp:
             if row.strip() == "":
                 continue
@@ -85,14 +114,17 @@ class XYtrack (object):
                         format(imported, hlfile))
 
     def highlight(self, mapping, start, end, color="r", unit=10000, zorder=10):
+        """
+        Draw region in a different color, with values looked up from the
+        (x, y) arrays in `mapping`.
+        """
         ax = self.ax
-        x = range(start, end + unit, unit)
-        y = [mapping[z] for z in x]
+        x = np.arange(start, end + unit, unit)
+        y = self.lookup(x, *mapping)
         # Mask the highlight region so that they don't appear in background
-        for a in self.xy:
-            if start <= a[0] <= end:
-                a[1] = 0
-        self.x, self.y = zip(*self.xy)
+        lo = np.searchsorted(self.x, start)
+        hi = np.searchsorted(self.x, end, side="right")
+        self.y[lo:hi] = 0
         ax.plot(x, y, lw=0)
         ax.fill_between(x, y, color=color, lw=0, zorder=zorder)
 
@@ -107,12 +139,14 @@ class Coverage (object):
                  order=None, hlsuffix=None, palette=None, cap=50,
                  gauge="bottom", plot_label=True, plot_chr_label=True,
                  gauge_step=5000000, vlines=None, labels_dict={},
-                 diverge=('r', 'g')):
+                 diverge=('r', 'g'), cache=False):
         x, y, w, h = canvas
         p = .01
         root.add_patch(Rectangle((x - p, y - p), w + 2 * p, h + 2 * p, lw=1,
                         fill=False, ec="darkslategray", zorder=10))
         datafiles = glob(op.join(datadir, chr + "*"))
+        # Skip the .npy caches that XYtrack keeps next to the tracks
+        datafiles = [z for z in datafiles if not z.endswith(".npy")]
 
         if order:
             datafiles = [z for z in datafiles if z.split(".")[1] in order]
@@ -151,7 +185,7 @@ class Coverage (object):
             yy -= yinterval
             yys.append(yy)
             ax = fig.add_axes([x, yy, w, yinterval * .9])
-            xy = XYtrack(ax, datafile, color=c)
+            xy = XYtrack(ax, datafile, color=c, cache=cache)
             xy.interpolate(end)
             xy.cap(ymax=cap)
             if vlines:
@@ -182,6 +216,8 @@ def main():
     p = OptionParser(__doc__)
     p.add_option("--order",
                 help="The order to plot the tracks, comma-separated")
+    p.add_option("--cache", default=False, action="store_true",
+                help="Keep parsed track data in .npy files [default: %default]")
     opts, args, iopts = p.set_image_options()
 
     if len(args) != 3:
@@ -198,7 +234,7 @@ def main():
     canvas = (.12, .35, .8, .35)
     chr_size = sizes.get_size(chr)
     Coverage(fig, root, canvas, chr, (0, chr_size), datadir,
-                 order=order, hlsuffix=hlsuffix)
+                 order=order, hlsuffix=hlsuffix, cache=opts.cache)
 
     root.set_xlim(0, 1)
     root.set_ylim(0, 1)
@@ -24,14 +24,15 @@ import os.path as op
 import sys
 import logging
 import string
+import numpy as np
 
 from random import sample
 
 from jcvi.compara.synteny import AnchorFile, batch_scan, check_beds
 from jcvi.utils.cbook import seqid_parse, thousands
 from jcvi.apps.base import OptionParser
-from jcvi.graphics.base import plt, Rectangle, cm, set_human_axis, savefig, \
-            draw_cmap, TextHandler, latex
+from jcvi.graphics.base import mpl, plt, Rectangle, cm, set_human_axis, \
+            savefig, draw_cmap, TextHandler, latex
 
 
 class Palette (dict):
@@ -58,6 +59,66 @@ class Palette (dict):
             self[k] = self.colors[v]
 
 
+class DotRaster (object):
+    """
+    Dots binned into the pixels of the axes as they are read, keeping the
+    number of dots and the max, min or mean of their values in each pixel.
+    All dots are shown and memory is bounded by the image size.
+    """
+    def __init__(self, ax, xsize, ysize, dpi, agg="max"):
+        assert agg in ("max", "min", "mean")
+        w, h = ax.get_position().size * ax.figure.get_size_inches() * dpi
+        self.shape = h, w = max(int(round(h)), 1), max(int(round(w)), 1)
+        self.xsize, self.ysize = xsize, ysize
+        self.agg = agg
+        self.counts = np.zeros(h * w, dtype=int)
+        self.values = np.zeros(h * w) if agg == "mean" else \
+                      np.repeat(-np.inf, h * w)
+
+    def __len__(self):
+        return self.counts.sum()
+
+    def add(self, x, y, v=None):
+        h, w = self.shape
+        x = np.asarray(x, dtype=float) * w / self.xsize
+        y = np.asarray(y, dtype=float) * h / self.ysize
+        idx = np.clip(y.astype(int), 0, h - 1) * w + \
+              np.clip(x.astype(int), 0, w - 1)
+        self.counts += np.bincount(idx, minlength=h * w)
+        if v is None:
+            return
+
+        v = np.asarray(v, dtype=float)
+        if self.agg == "mean":
+            self.values += np.bincount(idx, weights=v, minlength=h * w)
+            return
+        if self.agg == "min":
+            v = -v
+        # Last of each pixel after sorting on (pixel, value) is the max
+        order = np.lexsort((v, idx))
+        idx, v = idx[order], v[order]
+        last = np.flatnonzero(np.append(idx[1:] != idx[:-1], True))
+        idx, v = idx[last], v[last]
+        self.values[idx] = np.maximum(self.values[idx], v)
+
+    def image(self, values=True):
+        counts = self.counts.reshape(self.shape)
+        if not values:
+            img = counts
+        elif self.agg == "mean":
+            img = self.values.reshape(self.shape) / np.maximum(counts, 1)
+        else:
+            img = self.values.reshape(self.shape)
+            if self.agg == "min":
+                img = -img
+        return np.ma.masked_where(counts == 0, img)
+
+    def draw(self, ax, values=True, **kwargs):
+        ax.imshow(self.image(values=values), origin="upper",
+                  extent=(0, self.xsize, self.ysize, 0),
+                  interpolation="nearest", aspect="auto", **kwargs)
+
+
 def draw_box(clusters, ax, color="b"):
 
     for cluster in clusters:
@@ -70,7 +131,8 @@ def draw_box(clusters, ax, color="b"):
 
 def dotplot_main(anchorfile, qbed, sbed, image_name, iopts, vmin=0, vmax=1,
         is_self=False, synteny=False, cmap_text=None, genomenames=None,
-        sample_number=10000, minfont=5, palette=None, chrlw=.01, title=None):
+        sample_number=10000, minfont=5, palette=None, chrlw=.01, title=None,
+        raster=False):
 
     fig = plt.figure(1, (iopts.w, iopts.h))
     root = fig.add_axes([0, 0, 1, 1])  # the whole canvas
@@ -79,7 +141,8 @@ def dotplot_main(anchorfile, qbed, sbed, image_name, iopts, vmin=0, vmax=1,
     dotplot(anchorfile, qbed, sbed, fig, root, ax, vmin=vmin, vmax=vmax,
         is_self=is_self, synteny=synteny, cmap_text=cmap_text,
         genomenames=genomenames, sample_number=sample_number,
-        minfont=minfont, palette=palette, chrlw=chrlw, title=title)
+        minfont=minfont, palette=palette, chrlw=chrlw, title=title,
+        raster=raster, dpi=iopts.dpi)
 
     savefig(image_name, dpi=iopts.dpi, iopts=iopts)
 
@@ -87,8 +150,11 @@ def dotplot_main(anchorfile, qbed, sbed, image_name, iopts, vmin=0, vmax=1,
 def dotplot(anchorfile, qbed, sbed, fig, root, ax, vmin=0, vmax=1,
         is_self=False, synteny=False, cmap_text=None, genomenames=None,
         sample_number=10000, minfont=5, palette=None, chrlw=.01, title=None,
-        sepcolor="gainsboro"):
-
+        sepcolor="gainsboro", raster=False, dpi=None, batchsize=1000000):
+    """
+    With `raster`, all anchors are binned into pixels at `dpi`, instead of
+    plotting a random sample of `sample_number` of them.
+    """
     fp = open(anchorfile)
 
     qorder = qbed.order
@@ -98,10 +164,22 @@ def dotplot(anchorfile, qbed, sbed, fig, root, ax, vmin=0, vmax=1,
     if cmap_text:
         logging.debug("Normalize values to [%.1f, %.1f]" % (vmin, vmax))
 
+    if raster:
+        # The least value is plotted on top, as in the sampled plot
+        colors = ["k"] + sorted(palette.colors.values()) if palette else None
+        codes = dict((c, i) for i, c in enumerate(colors or []))
+        dr = DotRaster(ax, len(qbed), len(sbed), dpi or fig.dpi,
+                       agg="max" if palette else "min")
+
+        def flush(data):
+            x, y, c = zip(*data)
+            dr.add(x, y, [codes[v] for v in c] if palette else c)
+
+    # Rows carry the color of the block they follow
     block_id = 0
+    block_color = palette.get(block_id, "k") if palette else None
     for row in fp:
         atoms = row.split()
-        block_color = None
         if row[0] == "#":
             block_id += 1
             if palette:
@@ -137,10 +215,21 @@ def dotplot(anchorfile, qbed, sbed, fig, root, ax, vmin=0, vmax=1,
         data.append((qi, si, nv))
         if is_self:  # Mirror image
             data.append((si, qi, nv))
+        if raster and not synteny and len(data) >= batchsize:
+            flush(data)
+            data = []
+
+    if raster:
+        if data:
+            flush(data)
+        npairs = len(dr)
+        logging.debug("Rasterize {0} data points into {1}x{2} pixels".\
+                      format(npairs, *dr.shape))
+    else:
+        npairs = len(data)
 
-    npairs = len(data)
     # Only show random subset
-    if npairs > sample_number:
+    if not raster and npairs > sample_number:
         logging.debug("Showing a random subset of {0} data points (total {1}) " \
                       "for clarity.".format(sample_number, npairs))
         data = sample(data, sample_number)
@@ -151,12 +240,19 @@ def dotplot(anchorfile, qbed, sbed, fig, root, ax, vmin=0, vmax=1,
         data.sort(key=lambda x: -x[2])
 
     default_cm = cm.copper
-    x, y, c = zip(*data)
+    if raster:
+        if palette:
+            dr.draw(ax, cmap=mpl.colors.ListedColormap(colors),
+                    vmin=0, vmax=len(colors) - 1)
+        else:
+            dr.draw(ax, cmap=default_cm, vmin=vmin, vmax=vmax)
 
-    if palette:
+    elif palette:
+        x, y, c = zip(*data)
         ax.scatter(x, y, c=c, edgecolors="none", s=2, lw=0)
 
     else:
+        x, y, c = zip(*data)
         ax.scatter(x, y, c=c, edgecolors="none", s=2, lw=0, cmap=default_cm,
                 vmin=vmin, vmax=vmax)
 
@@ -282,6 +378,8 @@ if __name__ == "__main__":
             "eg. \"Vitis vinifera_Oryza sativa\"")
     p.add_option("--nmax", dest="sample_number", type="int", default=10000,
             help="Maximum number of data points to plot [default: %default]")
+    p.add_option("--raster", default=False, action="store_true",
+            help="Bin all data points into pixels instead of sampling --nmax")
     p.add_option("--minfont", type="int", default=4,
             help="Do not render labels with size smaller than")
     p.add_option("--colormap",
@@ -326,4 +424,4 @@ if __name__ == "__main__":
             vmin=opts.vmin, vmax=opts.vmax, is_self=is_self,
             synteny=opts.synteny, cmap_text=opts.cmaptext,
             genomenames=opts.genomenames, sample_number=opts.sample_number,
-            minfont=opts.minfont, palette=palette)
+            minfont=opts.minfont, palette=palette, raster=opts.raster)
@@ -23,12 +23,14 @@ e, 0, 1, athaliana.grape.4x1.simple
 import sys
 import string
 
+import numpy as np
+
 from jcvi.apps.base import OptionParser
 from jcvi.compara.synteny import SimpleFile
 from jcvi.formats.bed import Bed
 from jcvi.graphics.chromosome import HorizontalChromosome
 from jcvi.graphics.glyph import TextCircle
-from jcvi.graphics.synteny import Shade
+from jcvi.graphics.synteny import draw_shades, get_pixel
 from jcvi.graphics.base import mpl, plt, savefig, markup, AbstractLayout
 
 
@@ -115,8 +117,9 @@ class Track (object):
         # Rotation transform
         x = (self.xstart + self.xend) / 2
         y = self.y
-        self.tr = mpl.transforms.Affine2D().\
-                    rotate_deg_around(x, y, self.rotation) + ax.transAxes
+        self.rot = mpl.transforms.Affine2D().\
+                    rotate_deg_around(x, y, self.rotation)
+        self.tr = self.rot + ax.transAxes
         self.inv = ax.transAxes.inverted()
 
         nseqids = len(self.seqids)
@@ -205,52 +208,70 @@ class Track (object):
 
         return [x, y]
 
+    def get_coords_array(self, genes):
+        """
+        Coordinates of many genes in one transform, NaN for the genes on
+        seqids that are not drawn.
+        """
+        order_in_chr = self.order_in_chr
+        xs = []
+        for gene in genes:
+            seqid, i, f = order_in_chr[gene]
+            xs.append(self.offsets[seqid] + self.ratio * i \
+                      if seqid in self.offsets else np.nan)
+        xy = np.column_stack((xs, np.repeat(self.y, len(xs))))
+        return self.rot.transform(xy)
+
 
 class ShadeManager (object):
 
-    def __init__(self, ax, tracks, layout, heightpad=0):
+    def __init__(self, ax, tracks, layout, heightpad=0, pixel=None):
         for i, j, blocks in layout.edges:
             # if same track (duplication shades), shall we draw above or below?
             samearc = "above" if i == j and i == 0 else "below"
             self.draw_blocks(ax, blocks, tracks[i], tracks[j],
-                             samearc=samearc, heightpad=heightpad)
+                             samearc=samearc, heightpad=heightpad,
+                             pixel=pixel)
 
     def draw_blocks(self, ax, blocks, atrack, btrack,
-                    samearc="below", heightpad=0):
-        for a, b, c, d, score, orientation, highlight in blocks:
-            p = atrack.get_coords(a), atrack.get_coords(b)
-            q = btrack.get_coords(c), btrack.get_coords(d)
-            if p[0] is None or q[0] is None:
-                continue
+                    samearc="below", heightpad=0, pixel=None):
+        if not blocks:
+            return
+
+        a, b, c, d, score, orientation, highlight = zip(*blocks)
+        p = np.stack((atrack.get_coords_array(a),
+                      atrack.get_coords_array(b)), axis=1)
+        q = np.stack((btrack.get_coords_array(c),
+                      btrack.get_coords_array(d)), axis=1)
+        ok = ~(np.isnan(p).any(axis=(1, 2)) | np.isnan(q).any(axis=(1, 2)))
+        p, q = p[ok], q[ok]
+        highlight = [h for h, x in zip(highlight, ok) if x]
+
+        ymid = np.repeat((atrack.y + btrack.y) / 2, len(p))
+        px, qx = p[:, 0, 0], q[:, 0, 0]
+        xdist = np.where((px != 0) & (qx != 0), np.abs(px - qx), .5)
+        pad = .09 * xdist / .5
+        if atrack.y == btrack.y:
+            if samearc == "below":
+                ymid = atrack.y - pad
+            else:
+                ymid = atrack.y + pad
+        if heightpad:
+            if atrack.y < btrack.y:
+                p[:, :, 1] = atrack.y + heightpad
+                q[:, :, 1] = btrack.y - heightpad
+            else:
+                p[:, :, 1] = atrack.y - heightpad
+                q[:, :, 1] = btrack.y + heightpad
 
-            ymid = (atrack.y + btrack.y) / 2
-            px, qx = p[0][0], q[0][0]
-            xdist = abs(px - qx) if px and qx else .5
-            pad = .09 * xdist / .5
-            if atrack.y == btrack.y:
-                if samearc == "below":
-                    ymid = atrack.y - pad
-                else:
-                    ymid = atrack.y + pad
-            if heightpad:
-                if atrack.y < btrack.y:
-                    p[0][1] = p[1][1] = atrack.y + heightpad
-                    q[0][1] = q[1][1] = btrack.y - heightpad
-                else:
-                    p[0][1] = p[1][1] = atrack.y - heightpad
-                    q[0][1] = q[1][1] = btrack.y + heightpad
-
-            zorder = 2 if highlight else 1
-            lw = 1 if highlight else 0
-            Shade(ax, p, q, ymid, highlight=highlight, alpha=1, fc="gainsboro",
-                        ec="gainsboro", lw=lw, zorder=zorder)
+        draw_shades(ax, p, q, ymid, pixel=pixel, highlight=highlight)
 
 
 class Karyotype (object):
 
     def __init__(self, fig, root, seqidsfile, layoutfile, gap=.01,
                  height=.01, lw=1, generank=True, sizes=None, heightpad=0,
-                 roundrect=False, plot_label=True):
+                 roundrect=False, plot_label=True, dpi=300):
 
         layout = Layout(layoutfile, generank=generank)
 
@@ -280,7 +301,8 @@ class Karyotype (object):
             tr = Track(root, lo, gap=gap, height=height, lw=lw, draw=False)
             tracks.append(tr)
 
-        ShadeManager(root, tracks, layout, heightpad=heightpad)
+        ShadeManager(root, tracks, layout, heightpad=heightpad,
+                     pixel=get_pixel(root, dpi))
 
         for tr in tracks:
             tr.draw(roundrect=roundrect, plot_label=plot_label)  # this time for real
@@ -301,7 +323,7 @@ def main():
     fig = plt.figure(1, (iopts.w, iopts.h))
     root = fig.add_axes([0, 0, 1, 1])
 
-    Karyotype(fig, root, seqidsfile, layoutfile)
+    Karyotype(fig, root, seqidsfile, layoutfile, dpi=iopts.dpi)
 
     root.set_xlim(0, 1)
     root.set_ylim(0, 1)
@@ -13,11 +13,9 @@ import logging
 
 import numpy as np
 
-from collections import defaultdict
-
 from jcvi.formats.sizes import Sizes
-from jcvi.formats.base import LineFile, DictFile
-from jcvi.formats.bed import Bed, bins
+from jcvi.formats.base import DictFile
+from jcvi.formats.bed import Bed, Bins
 from jcvi.algorithms.matrix import moving_sum
 from jcvi.graphics.base import plt, Rectangle, CirclePolygon, savefig, \
             ticker, human_readable_base
@@ -38,36 +36,6 @@ Registration = {"Gypsy": "LTR-RT/Gypsy",
                 "Exons": "Genes (exons)"}
 
 
-class BinLine (object):
-
-    def __init__(self, row):
-        args = row.split()
-        self.chr = args[0]
-        self.len = float(args[1])
-        self.binlen = int(args[2])
-
-    def __str__(self):
-        return "\t".join(str(x) for x in (self.chr, self.len, self.binlen))
-
-    def subtract(self, o):
-        self.binlen -= o.len
-
-
-class BinFile (LineFile):
-
-    def __init__(self, filename):
-        super(BinFile, self).__init__(filename)
-        self.mapping = defaultdict(list)
-
-        fp = open(filename)
-        for row in fp:
-            b = BinLine(row)
-            self.append(b)
-            chr, len, binlen = b.chr, b.len, b.binlen
-            self.mapping[chr].append((len, binlen))
-        fp.close()
-
-
 def main():
 
     actions = (
@@ -111,8 +79,7 @@ def get_nbins(clen, shift):
 
 
 def linearray(binfile, chr, window, shift):
-    mn = binfile.mapping[chr]
-    m, n = zip(*mn)
+    m, n = binfile.mapping[chr]
 
     m = np.array(m, dtype="float")
     w = window / shift
@@ -410,19 +377,14 @@ def draw_gauge(ax, margin, maxl, rightmargin=None, optimal=7):
 
 
 def get_binfiles(bedfiles, fastafile, shift, mode="span", subtract=None):
-    binopts = ["--binsize={0}".format(shift)]
-    binopts.append("--mode={0}".format(mode))
-    if subtract:
-        binopts.append("--subtract={0}".format(subtract))
-    binfiles = [bins([x, fastafile] + binopts) for x in bedfiles if op.exists(x)]
-    binfiles = [BinFile(x) for x in binfiles]
+    binfiles = [Bins(x, fastafile, binsize=shift, mode=mode,
+                     subtract=subtract) for x in bedfiles if op.exists(x)]
 
     return binfiles
 
 
 def stackarray(binfile, chr, window, shift):
-    mn = binfile.mapping[chr]
-    m, n = zip(*mn)
+    m, n = binfile.mapping[chr]
 
     m = np.array(m, dtype="float")
     n = np.array(n, dtype="float")
@@ -479,7 +441,7 @@ def stack(args):
 
     stacks = opts.stacks.split(",")
     bedfiles = get_beds(stacks)
-    binfiles = get_binfiles(bedfiles, fastafile, shift, subtract)
+    binfiles = get_binfiles(bedfiles, fastafile, shift, subtract=subtract)
 
     sizes = Sizes(fastafile)
     s = list(sizes.iter_sizes())[:top]
@@ -25,7 +25,7 @@ from jcvi.formats.base import DictFile
 from jcvi.utils.cbook import human_size
 from jcvi.apps.base import OptionParser
 
-from jcvi.graphics.glyph import Glyph, RoundLabel
+from jcvi.graphics.glyph import RoundLabel
 from jcvi.graphics.base import mpl, plt, savefig, markup, \
             Path, PathPatch, AbstractLayout
 
@@ -104,25 +104,101 @@ class Shade (object):
         ax.add_patch(pp)
 
 
+def shade_polygons(a, b, ymid, npoints=16):
+    """
+    Outlines of many shades at once, as in `Shade`, with the bezier curves
+    flattened to `npoints` each. `a` and `b` are arrays of shape (n, 2, 2)
+    holding the two end points of each side, `ymid` is scalar or per shade.
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    ymid = np.broadcast_to(ymid, (len(a), ))[:, None]
+    t = np.linspace(0, 1, npoints)[None, :, None]
+    c = np.array([(1 - t) ** 3, 3 * (1 - t) ** 2 * t,
+                  3 * (1 - t) * t ** 2, t ** 3])
+
+    def curve(p0, p3):
+        p1 = np.column_stack((p0[:, 0:1], ymid))
+        p2 = np.column_stack((p3[:, 0:1], ymid))
+        return c[0] * p0[:, None] + c[1] * p1[:, None] + \
+               c[2] * p2[:, None] + c[3] * p3[:, None]
+
+    return np.concatenate((curve(a[:, 0], b[:, 0]),
+                           curve(b[:, 1], a[:, 1])), axis=1)
+
+
+def get_pixel(ax, dpi):
+    """
+    Size of one pixel in axes coordinates (the smaller of x and y).
+    """
+    w, h = ax.get_position().size * ax.figure.get_size_inches()
+    return 1. / (max(w, h) * dpi)
+
+
+def cull_subpixel(coords, widths, pixel):
+    """
+    Level of detail: mask out the features narrower than a pixel that land on
+    the same pixels as an earlier one, as they would be drawn over each other.
+    """
+    keep = np.ones(len(coords), dtype=bool)
+    small = np.flatnonzero(np.abs(widths) < pixel)
+    if len(small) > 1:
+        q = np.round(coords[small].reshape(len(small), -1) / pixel)
+        _, first = np.unique(q, axis=0, return_index=True)
+        keep[small] = False
+        keep[small[first]] = True
+    return keep
+
+
+def draw_shades(ax, a, b, ymid, pixel=None, highlight=None, fc="gainsboro",
+                alpha=1, zorder=1):
+    """
+    Draw shades between the gene pairs as two PolyCollections, the plain
+    ones below and the highlighted ones (colors in `highlight`) on top.
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    ymid = np.broadcast_to(ymid, (len(a), ))
+    if not len(a):
+        return
+
+    hl = np.array([bool(x) for x in highlight]) if highlight is not None \
+            else np.zeros(len(a), dtype=bool)
+    plain = ~hl
+    if pixel:
+        widths = np.maximum(np.abs(a[:, 1, 0] - a[:, 0, 0]),
+                            np.abs(b[:, 1, 0] - b[:, 0, 0]))
+        coords = np.column_stack((a.reshape(-1, 4), b.reshape(-1, 4), ymid))
+        plain &= cull_subpixel(coords, np.where(hl, np.inf, widths), pixel)
+
+    if plain.any():
+        verts = shade_polygons(a[plain], b[plain], ymid[plain])
+        ax.add_collection(mpl.collections.PolyCollection(verts,
+                          facecolors=fc, edgecolors=fc, linewidths=0,
+                          alpha=alpha, zorder=zorder), autolim=False)
+    if hl.any():
+        colors = [x for x in highlight if x]
+        verts = shade_polygons(a[hl], b[hl], ymid[hl])
+        ax.add_collection(mpl.collections.PolyCollection(verts,
+                          facecolors=colors, edgecolors=colors, linewidths=1,
+                          alpha=alpha, zorder=zorder + 1), autolim=False)
+
+
 class Region (object):
 
     def __init__(self, ax, ext, layout, bed, scale, switch=None, chr_label=True,
-                 pad=.04, vpad=.012):
+                 pad=.04, vpad=.012, pixel=None):
         x, y = layout.x, layout.y
         ratio = layout.ratio
         scale /= ratio
         self.y = y
         lr = layout.rotation
-        tr = mpl.transforms.Affine2D().\
-                    rotate_deg_around(x, y, lr) + ax.transAxes
-        inv = ax.transAxes.inverted()
+        rot = mpl.transforms.Affine2D().rotate_deg_around(x, y, lr)
+        tr = rot + ax.transAxes
 
         start, end, si, ei, chr, orientation, span = ext
         flank = span / scale / 2
         xstart, xend = x - flank, x + flank
         self.xstart, self.xend = xstart, xend
 
-        cv = lambda t: xstart + abs(t - startbp) / scale
         hidden = layout.hidden
 
         # Chromosome
@@ -141,25 +217,36 @@ class Region (object):
                           human_size(endbp, target="Mb")))
 
         height = .012
-        self.gg = {}
-        # Genes
-        for g in genes:
-            gstart, gend = g.start, g.end
-            strand = g.strand
-            if strand == '-':
-                gstart, gend = gend, gstart
-            if orientation == '-':
-                strand = "+" if strand == "-" else "-"
-
-            x1, x2 = cv(gstart), cv(gend)
-            a, b = tr.transform((x1, y)), tr.transform((x2, y))
-            a, b = inv.transform(a), inv.transform(b)
-            self.gg[g.accn] = (a, b)
-
-            color = "b" if strand == "+" else "g"
-            if not hidden:
-                gp = Glyph(ax, x1, x2, y, height, gradient=False, fc=color, zorder=3)
-                gp.set_transform(tr)
+        # Genes, all rotated in one go
+        n = len(genes)
+        gstart = np.array([g.start for g in genes], dtype=float)
+        gend = np.array([g.end for g in genes], dtype=float)
+        minus = np.array([g.strand == '-' for g in genes], dtype=bool)
+        gstart, gend = np.where(minus, gend, gstart), np.where(minus, gstart, gend)
+        if orientation == '-':
+            minus = ~minus
+
+        x1 = xstart + np.abs(gstart - startbp) / scale
+        x2 = xstart + np.abs(gend - startbp) / scale
+        ends = rot.transform(np.column_stack((np.concatenate((x1, x2)),
+                                              np.repeat(y, 2 * n))))
+        self.gg = dict(zip((g.accn for g in genes), zip(ends[:n], ends[n:])))
+
+        if not hidden and n:
+            keep = np.ones(n, dtype=bool)
+            if pixel:
+                for m in (minus, ~minus):
+                    keep[m] = cull_subpixel(np.column_stack((x1, x2))[m],
+                                            (x2 - x1)[m], pixel)
+            x1, x2, minus = x1[keep], x2[keep], minus[keep]
+            ylo, yhi = y - .5 * height, y + .5 * height
+            verts = np.empty((len(x1), 4, 2))
+            verts[:, :, 0] = np.column_stack((x1, x2, x2, x1))
+            verts[:, :, 1] = (ylo, ylo, yhi, yhi)
+            colors = np.where(minus, "g", "b")
+            ax.add_collection(mpl.collections.PolyCollection(verts,
+                              facecolors=colors, linewidths=0, zorder=3,
+                              transform=tr), autolim=False)
 
         ha, va = layout.ha, layout.va
 
@@ -198,7 +285,7 @@ class Region (object):
 class Synteny (object):
 
     def __init__(self, fig, root, datafile, bedfile, layoutfile,
-                 switch=None, tree=None, chr_label=True, pad=.04):
+                 switch=None, tree=None, chr_label=True, pad=.04, dpi=300):
 
         w, h = fig.get_figwidth(), fig.get_figheight()
         bed = Bed(bedfile)
@@ -219,24 +306,27 @@ class Synteny (object):
         self.rr = []
         ymids = []
         vpad = .012 * w / h
+        pixel = get_pixel(root, dpi)
         for i in xrange(bf.ncols):
             ext = exts[i]
-            r = Region(root, ext, lo[i], bed, scale, switch, chr_label=chr_label, vpad=vpad)
+            r = Region(root, ext, lo[i], bed, scale, switch, chr_label=chr_label,
+                       vpad=vpad, pixel=pixel)
             self.rr.append(r)
             # Use tid and accn to store gene positions
             gg.update(dict(((i, k), v) for k, v in r.gg.items()))
             ymids.append(r.y)
 
         for i, j in lo.edges:
-            for ga, gb, h in bf.iter_pairs(i, j):
-                a, b = gg[(i, ga)], gg[(j, gb)]
-                ymid = (ymids[i] + ymids[j]) / 2
-                Shade(root, a, b, ymid, fc="gainsboro", lw=0, alpha=1)
+            ymid = (ymids[i] + ymids[j]) / 2
+            pairs = list(bf.iter_pairs(i, j))
+            a = [gg[(i, ga)] for ga, gb, h in pairs]
+            b = [gg[(j, gb)] for ga, gb, h in pairs]
+            draw_shades(root, a, b, ymid, pixel=pixel)
 
-            for ga, gb, h in bf.iter_pairs(i, j, highlight=True):
-                a, b = gg[(i, ga)], gg[(j, gb)]
-                ymid = (ymids[i] + ymids[j]) / 2
-                Shade(root, a, b, ymid, alpha=1, highlight=h, zorder=2)
+            pairs = list(bf.iter_pairs(i, j, highlight=True))
+            a = [gg[(i, ga)] for ga, gb, h in pairs]
+            b = [gg[(j, gb)] for ga, gb, h in pairs]
+            draw_shades(root, a, b, ymid, highlight=[h for ga, gb, h in pairs])
 
         if tree:
             from jcvi.graphics.tree import draw_tree, read_trees
@@ -284,7 +374,7 @@ def main():
     root = fig.add_axes([0, 0, 1, 1])
 
     Synteny(fig, root, datafile, bedfile, layoutfile,
-            switch=switch, tree=tree)
+            switch=switch, tree=tree, dpi=iopts.dpi)
 
     root.set_xlim(0, 1)
     root.set_ylim(0, 1)
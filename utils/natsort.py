@@ -225,6 +225,24 @@ def natsort_key(s, number_type=int, signed=False, exp=False):
                              "parameter '{0}'' invalid".format(str(exp)))
 
 
+natsort_keys = {}
+
+
+def cached_natsort_key(s):
+    """\
+    Memoized natsort_key() with the default options, for sorting many items
+    that share few distinct strings (e.g. seqids).
+
+        >>> cached_natsort_key('chr10') == natsort_key('chr10')
+        True
+    """
+    try:
+        return natsort_keys[s]
+    except KeyError:
+        natsort_keys[s] = key = natsort_key(s)
+        return key
+
+
 def natsorted(seq, key=lambda x: x, number_type=float, signed=True, exp=True):
     """\
     Sorts a sequence naturally (alphabetically and numerically),
@@ -21,115 +21,13 @@
 #     OTHER DEALINGS IN THE SOFTWARE.
 
 
+import sys
 import urlparse
 
-from collections import Callable, defaultdict
+from collections import Callable, defaultdict, OrderedDict
 from UserDict import DictMixin
 
-
-class OrderedDict(dict, DictMixin):
-
-    def __init__(self, *args, **kwds):
-        if len(args) > 1:
-            raise TypeError('expected at most 1 arguments, got %d' % len(args))
-        try:
-            self.__end
-        except AttributeError:
-            self.clear()
-        self.update(*args, **kwds)
-
-    def clear(self):
-        self.__end = end = []
-        end += [None, end, end]         # sentinel node for doubly linked list
-        self.__map = {}                 # key --> [key, prev, next]
-        dict.clear(self)
-
-    def __setitem__(self, key, value):
-        if key not in self:
-            end = self.__end
-            curr = end[1]
-            curr[2] = end[1] = self.__map[key] = [key, curr, end]
-        dict.__setitem__(self, key, value)
-
-    def __delitem__(self, key):
-        dict.__delitem__(self, key)
-        key, prev, next = self.__map.pop(key)
-        prev[2] = next
-        next[1] = prev
-
-    def __iter__(self):
-        end = self.__end
-        curr = end[2]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[2]
-
-    def __reversed__(self):
-        end = self.__end
-        curr = end[1]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[1]
-
-    def popitem(self, last=True):
-        if not self:
-            raise KeyError('dictionary is empty')
-        if last:
-            key = reversed(self).next()
-        else:
-            key = iter(self).next()
-        value = self.pop(key)
-        return key, value
-
-    def __reduce__(self):
-        items = [[k, self[k]] for k in self]
-        tmp = self.__map, self.__end
-        del self.__map, self.__end
-        inst_dict = vars(self).copy()
-        self.__map, self.__end = tmp
-        if inst_dict:
-            return (self.__class__, (items,), inst_dict)
-        return self.__class__, (items,)
-
-    def keys(self):
-        return list(self)
-
-    setdefault = DictMixin.setdefault
-    update = DictMixin.update
-    pop = DictMixin.pop
-    values = DictMixin.values
-    items = DictMixin.items
-    iterkeys = DictMixin.iterkeys
-    itervalues = DictMixin.itervalues
-    iteritems = DictMixin.iteritems
-
-    def __repr__(self):
-        if not self:
-            return '%s()' % (self.__class__.__name__,)
-        return '%s(%r)' % (self.__class__.__name__, self.items())
-
-    def copy(self):
-        return self.__class__(self)
-
-    @classmethod
-    def fromkeys(cls, iterable, value=None):
-        d = cls()
-        for key in iterable:
-            d[key] = value
-        return d
-
-    def __eq__(self, other):
-        if isinstance(other, OrderedDict):
-            if len(self) != len(other):
-                return False
-            for p, q in  zip(self.items(), other.items()):
-                if p != q:
-                    return False
-            return True
-        return dict.__eq__(self, other)
-
-    def __ne__(self, other):
-        return not self == other
+from jcvi.apps.base import OptionParser, ActionDispatcher
 
 
 """
@@ -144,12 +42,7 @@ class DefaultOrderedDict(OrderedDict):
         OrderedDict.__init__(self, *a, **kw)
         self.default_factory = default_factory
 
-    def __getitem__(self, key):
-        try:
-            return OrderedDict.__getitem__(self, key)
-        except KeyError:
-            return self.__missing__(key)
-
+    # dict.__getitem__ calls __missing__ on subclasses, no need to override
     def __missing__(self, key):
         if self.default_factory is None:
             raise KeyError(key)
@@ -161,7 +54,7 @@ class DefaultOrderedDict(OrderedDict):
             args = tuple()
         else:
             args = self.default_factory,
-        return type(self), args, None, None, self.items()
+        return type(self), args, None, None, self.iteritems()
 
     def copy(self):
         return self.__copy__()
@@ -173,6 +66,7 @@ class DefaultOrderedDict(OrderedDict):
         import copy
         return type(self)(self.default_factory,
                           copy.deepcopy(self.items()))
+
     def __repr__(self):
         return 'OrderedDefaultDict(%s, %s)' % (self.default_factory,
                                         OrderedDict.__repr__(self))
@@ -396,3 +290,171 @@ class SortedCollection(object):
         if i != len(self):
             return self._items[i]
         raise ValueError('No item found with key above: %r' % (k,))
+
+
+class LinkedOrderedDict(dict, DictMixin):
+    """
+    The former pure-Python OrderedDict (DictMixin and a doubly linked list),
+    kept only as the baseline of benchmark(). Pickling, comparison and repr
+    are left out.
+    """
+    def __init__(self, *args, **kwds):
+        self.clear()
+        self.update(*args, **kwds)
+
+    def clear(self):
+        self.__end = end = []
+        end += [None, end, end]         # sentinel node for doubly linked list
+        self.__map = {}                 # key --> [key, prev, next]
+        dict.clear(self)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            end = self.__end
+            curr = end[1]
+            curr[2] = end[1] = self.__map[key] = [key, curr, end]
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        key, prev, next = self.__map.pop(key)
+        prev[2] = next
+        next[1] = prev
+
+    def __iter__(self):
+        end = self.__end
+        curr = end[2]
+        while curr is not end:
+            yield curr[0]
+            curr = curr[2]
+
+    def keys(self):
+        return list(self)
+
+    setdefault = DictMixin.setdefault
+    update = DictMixin.update
+    pop = DictMixin.pop
+    values = DictMixin.values
+    items = DictMixin.items
+    iterkeys = DictMixin.iterkeys
+    itervalues = DictMixin.itervalues
+    iteritems = DictMixin.iteritems
+
+
+class LinkedDefaultOrderedDict(LinkedOrderedDict):
+    """
+    The former DefaultOrderedDict, on top of LinkedOrderedDict.
+    """
+    def __init__(self, default_factory=None, *a, **kw):
+        LinkedOrderedDict.__init__(self, *a, **kw)
+        self.default_factory = default_factory
+
+    def __getitem__(self, key):
+        try:
+            return LinkedOrderedDict.__getitem__(self, key)
+        except KeyError:
+            return self.__missing__(key)
+
+    def __missing__(self, key):
+        if self.default_factory is None:
+            raise KeyError(key)
+        self[key] = value = self.default_factory()
+        return value
+
+
+def main():
+
+    actions = (
+        ('benchmark', 'compare GFF parsing with the former and current '
+                      'ordered dicts'),
+            )
+    p = ActionDispatcher(actions)
+    p.dispatch(globals())
+
+
+def benchmark(args):
+    """
+    %prog benchmark [gffile]
+
+    Time GFF attribute parsing with the former DictMixin-based ordered dicts
+    (before) and the ones backed by collections.OrderedDict (after): dict
+    insertions, make_attributes() and a full Gff() parse with attributes.
+    A synthetic GFF3 file is generated if none is given.
+    """
+    import os
+    import tempfile
+    import jcvi.formats.gff as gff
+
+    from timeit import default_timer
+
+    p = OptionParser(benchmark.__doc__)
+    p.add_option("--lines", default=200000, type="int",
+                 help="Number of lines in the synthetic file [default: %default]")
+    p.add_option("--repeat", default=3, type="int",
+                 help="Keep the best of this many runs [default: %default]")
+    opts, args = p.parse_args(args)
+
+    if len(args) > 1:
+        sys.exit(not p.print_help())
+
+    tmpfile = None
+    if args:
+        gffile, = args
+    else:
+        fd, tmpfile = tempfile.mkstemp(suffix=".gff")
+        fw = os.fdopen(fd, "w")
+        print >> fw, "##gff-version 3"
+        for i in xrange(opts.lines):
+            print >> fw, "\t".join(("chr{0}".format(i % 10), "bench", "exon",
+                str(i * 10 + 1), str(i * 10 + 9), ".", "+", ".",
+                "ID=exon{0};Parent=mRNA{1};Name=exon{0};Note=a,b".\
+                format(i, i / 5)))
+        fw.close()
+        gffile = tmpfile
+
+    def timed(factory, func):
+        gff.DefaultOrderedDict = factory
+        try:
+            ts = default_timer()
+            func()
+            return default_timer() - ts
+        finally:
+            gff.DefaultOrderedDict = DefaultOrderedDict
+
+    keys = ["key{0}".format(i % 8) for i in xrange(10 ** 6)]
+    texts = [row.split("\t")[8] for row in open(gffile)
+                if row[0] != '#' and row.count("\t") == 8]
+
+    def fill():
+        factory = gff.DefaultOrderedDict
+        for i in xrange(len(keys) / 8):
+            d = factory(list)
+            for k in keys[i * 8: i * 8 + 8]:
+                d[k].append(k)
+            for k in d:
+                d[k]
+
+    tasks = (("dict insert+iter", len(keys), fill),
+             ("make_attributes", len(texts),
+                lambda: [gff.make_attributes(x) for x in texts]),
+             ("Gff attributes", len(texts),
+                lambda: [g.attributes for g in gff.Gff(gffile)]))
+
+    # Best of --repeat runs, before and after interleaved against drift
+    print "\t".join(("task", "n", "before", "after", "speedup"))
+    for name, n, func in tasks:
+        before, after = [], []
+        for i in xrange(opts.repeat):
+            before.append(timed(LinkedDefaultOrderedDict, func))
+            after.append(timed(DefaultOrderedDict, func))
+        before, after = min(before), min(after)
+        print "\t".join((name, str(n), "{0:.2f}s".format(before),
+                         "{0:.2f}s".format(after),
+                         "{0:.2f}x".format(before / after if after else 0)))
+
+    if tmpfile:
+        os.remove(tmpfile)
+
+
+if __name__ == '__main__':
+    main()